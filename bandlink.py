@@ -0,0 +1,384 @@
+import asyncio
+import contextlib
+import html
+import json
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qsl, urlparse, urlunparse, urlencode
+
+from bs4 import BeautifulSoup
+
+# BandLink pages are parsed off the event loop; "process" also keeps the GIL free.
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "process").lower()
+PARSE_WORKERS = max(1, int(os.getenv("PARSE_WORKERS", "2")))
+BANDLINK_MAX_HTML_BYTES = int(os.getenv("BANDLINK_MAX_HTML_BYTES", str(2 * 1024 * 1024)))
+BANDLINK_PARSE_TIMEOUT = float(os.getenv("BANDLINK_PARSE_TIMEOUT", "5"))
+
+logger = logging.getLogger(__name__)
+
+SONGLINK_PLATFORM_ALIASES = {
+    "spotify": "spotify",
+    "applemusic": "apple",
+    "applemusicapp": "apple",
+    "apple": "apple",
+    "itunes": "itunes",
+    "youtubemusic": "youtubemusic",
+    "youtube": "youtube",
+    "deezer": "deezer",
+    "yandex": "yandex",
+    "yandexmusic": "yandex",
+    "vk": "vk",
+    "zvuk": "zvuk",
+    "kion": "kion",
+    "mts": "kion",
+}
+
+
+def _allowed_music_platform(host: str, path: str, query: dict[str, str]) -> str | None:
+    if "band.link" in host:
+        return "bandlink"
+    if host.startswith("music.yandex.") and ("/track/" in path or "/album/" in path):
+        return "yandex"
+    if host == "open.spotify.com":
+        return "spotify"
+    if host == "music.apple.com":
+        return "apple"
+    if host == "itunes.apple.com":
+        return "itunes"
+    if host in {"music.vk.com", "music.vk.ru"}:
+        return "vk"
+    if host == "vk.com" and (
+        path.startswith("/music") or path.startswith("/link/")
+    ) and not any(path.startswith(prefix) for prefix in {"/away", "/share", "/login", "/terms"}):
+        return "vk"
+    if host == "deezer.com" and any(path.startswith(prefix) for prefix in {"/track/", "/album/", "/playlist/", "/artist/"}):
+        return "deezer"
+    if host in {"youtube.com", "m.youtube.com"}:
+        if path.startswith("/watch") and query.get("v"):
+            return "youtube"
+        if path.startswith("/shorts/"):
+            return "youtube"
+    if host == "youtu.be" and path.strip("/"):
+        return "youtube"
+    if host == "music.youtube.com":
+        if path.startswith("/watch") and query.get("v"):
+            return "youtubemusic"
+        if path.startswith("/browse/MPRE"):
+            return "youtubemusic"
+    if host == "zvuk.com" and any(
+        path.startswith(prefix)
+        for prefix in {"/album/", "/artist/", "/track/", "/playlist/", "/release/"}
+    ):
+        return "zvuk"
+    if host.startswith("kion.") or host == "kion.ru" or host.startswith("music.kion."):
+        return "kion"
+    return None
+
+
+def _normalize_music_url(url: str, platform_hint: str | None = None) -> str:
+    normalized, _ = normalize_music_url_with_platform(url, platform_hint)
+    return normalized
+
+
+def normalize_music_url_with_platform(url: str, platform_hint: str | None = None) -> tuple[str, str | None]:
+    parsed = urlparse(url.strip())
+    if parsed.scheme not in {"http", "https"}:
+        return "", None
+    cleaned_query_pairs = [
+        (k, v)
+        for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_")
+    ]
+    query_dict = {k: v for k, v in cleaned_query_pairs}
+    host = parsed.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parsed.path or "/"
+
+    platform = _normalize_platform_key(platform_hint) if platform_hint else None
+    platform = platform or _allowed_music_platform(host, path, query_dict)
+    if not platform:
+        return "", None
+
+    normalized_url = urlunparse(parsed._replace(netloc=host, query=urlencode(cleaned_query_pairs), fragment=""))
+    return normalized_url, platform
+
+
+def detect_platform(url: str) -> str | None:
+    _, platform = normalize_music_url_with_platform(url)
+    return platform
+
+
+
+def _normalize_platform_key(value: str | None) -> str | None:
+    if not value:
+        return None
+    cleaned = re.sub(r"[^a-zA-Z]", "", value).lower()
+    if not cleaned:
+        return None
+    if cleaned in {"youtubemusic", "ytmusic"}:
+        cleaned = "youtubemusic"
+    if cleaned == "deezer":
+        return "deezer"
+    return SONGLINK_PLATFORM_ALIASES.get(cleaned, cleaned)
+
+
+def _collect_metadata_fields(candidate: dict, meta_acc: dict[str, set[str]]):
+    for key, val in candidate.items():
+        if not isinstance(val, str):
+            continue
+        lowered_key = key.lower()
+        if lowered_key in {"artist", "artistname", "artist_name"} or lowered_key.endswith("artist"):
+            if val.strip():
+                meta_acc.setdefault("artist", set()).add(val.strip())
+        if lowered_key in {"title", "track", "song", "name"} and not lowered_key.endswith("url"):
+            if val.strip():
+                meta_acc.setdefault("title", set()).add(val.strip())
+        if "cover" in lowered_key or "image" in lowered_key or "thumbnail" in lowered_key or "artwork" in lowered_key:
+            if val.strip().startswith("http"):
+                meta_acc.setdefault("cover_url", set()).add(val.strip())
+
+
+def parse_bandlink(html_content: str) -> tuple[dict[str, str], dict | None]:
+    links: dict[str, str] = {}
+    meta: dict | None = None
+    meta_candidates: dict[str, set[str]] = {}
+
+    soup = BeautifulSoup(html_content or "", "html.parser")
+
+    next_script = soup.find("script", id="__NEXT_DATA__")
+    if next_script and next_script.string:
+        try:
+            next_data_raw = html.unescape(next_script.string)
+            next_data = json.loads(next_data_raw)
+            print("[bandlink] __NEXT_DATA__ found")
+        except Exception as e:
+            print(f"[bandlink] failed to parse __NEXT_DATA__: {e}")
+            next_data = None
+    else:
+        print("[bandlink] __NEXT_DATA__ not found")
+        next_data = None
+
+    def add_link(url: str | None, platform_hint: str | None = None):
+        if not url:
+            return
+        normalized_url, platform = normalize_music_url_with_platform(url, platform_hint)
+        if not normalized_url or not platform:
+            return
+        if platform and platform not in links:
+            links[platform] = normalized_url
+
+    def process_service(service: dict):
+        if not isinstance(service, dict):
+            return
+        add_link(
+            service.get("href")
+            or service.get("url")
+            or service.get("link")
+            or (service.get("action") or {}).get("url"),
+            service.get("platform")
+            or service.get("service")
+            or service.get("type")
+            or service.get("id")
+            or service.get("name"),
+        )
+        _collect_metadata_fields(service, meta_candidates)
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                lowered = key.lower()
+                if isinstance(value, list) and lowered in {"services", "links", "platforms", "buttons"}:
+                    for item in value:
+                        if isinstance(item, dict):
+                            process_service(item)
+                elif isinstance(value, dict):
+                    process_service(value)
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    if next_data:
+        walk(next_data.get("props") or next_data.get("pageProps") or next_data)
+
+    for script in soup.find_all("script"):
+        content_type = (script.get("type") or "").lower()
+        if "json" not in content_type and script.get("id") != "__NEXT_DATA__":
+            continue
+        raw = script.string or ""
+        if not raw.strip():
+            continue
+        try:
+            data_blob = json.loads(raw)
+        except Exception:
+            continue
+        walk(data_blob)
+
+    if not links or len(links) < 3:
+        extracted_links = extract_links_from_bandlink(html_content, soup=soup)
+        for platform_key, href in extracted_links.items():
+            add_link(href, platform_key)
+
+    if not links:
+        legacy_links = extract_links_from_bandlink(html_content, soup=soup)
+        if legacy_links:
+            print(f"[bandlink] legacy href parser extracted {len(legacy_links)} platforms")
+            links.update(legacy_links)
+
+    og_title_match = re.search(r'<meta[^>]+property=\"og:title\"[^>]+content=\"([^\"]+)\"', html_content, re.IGNORECASE)
+    og_image_match = re.search(r'<meta[^>]+property=\"og:image\"[^>]+content=\"([^\"]+)\"', html_content, re.IGNORECASE)
+    if og_title_match:
+        title_raw = html.unescape(og_title_match.group(1)).strip()
+        if " - " in title_raw and not meta_candidates.get("artist"):
+            artist_val, title_val = title_raw.split(" - ", 1)
+            meta_candidates.setdefault("artist", set()).add(artist_val.strip())
+            meta_candidates.setdefault("title", set()).add(title_val.strip())
+        else:
+            meta_candidates.setdefault("title", set()).add(title_raw)
+    if og_image_match:
+        image_val = html.unescape(og_image_match.group(1)).strip()
+        meta_candidates.setdefault("cover_url", set()).add(image_val)
+
+    artist = next(iter(meta_candidates.get("artist", [])), "")
+    title = next(iter(meta_candidates.get("title", [])), "")
+    cover_url = next(iter(meta_candidates.get("cover_url", [])), "")
+
+    if artist or title or cover_url:
+        meta = {
+            "artist": artist,
+            "title": title,
+            "cover_url": cover_url,
+            "source_platform": "bandlink",
+            "preferred_source": "bandlink",
+            "sources": {"bandlink": {"artist": artist, "title": title, "cover_url": cover_url}},
+            "conflict": False,
+        }
+
+    print(f"[bandlink] extracted {len(links)} platforms; meta={'yes' if meta else 'no'}")
+    return links, meta
+
+
+def extract_links_from_bandlink(html_content: str, soup: BeautifulSoup | None = None) -> dict[str, str]:
+    links: dict[str, str] = {}
+    soup = soup or BeautifulSoup(html_content or "", "html.parser")
+
+    for a_tag in soup.find_all("a"):
+        href = a_tag.get("href") or ""
+        if not href:
+            continue
+        platform_hint = (
+            a_tag.get("data-platform")
+            or a_tag.get("data-service")
+            or a_tag.get("data-provider")
+            or None
+        )
+        class_tokens = {cls.lower() for cls in (a_tag.get("class") or []) if cls}
+        if not platform_hint:
+            for token in class_tokens:
+                if token in {
+                    "yandex",
+                    "vk",
+                    "spotify",
+                    "apple",
+                    "itunes",
+                    "zvuk",
+                    "kion",
+                    "youtube",
+                    "youtubemusic",
+                    "deezer",
+                }:
+                    platform_hint = token
+                    break
+        normalized, platform = normalize_music_url_with_platform(html.unescape(href), platform_hint)
+        if not normalized or not platform:
+            continue
+        if platform not in links:
+            links[platform] = normalized
+    return links
+
+_PARSE_EXECUTOR: Executor | None = None
+_PARSE_KIND = PARSE_EXECUTOR
+
+
+def _new_parse_executor(kind: str) -> Executor:
+    if kind == "process":
+        # spawn: workers import only this module, never the running bot state.
+        return ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="bandlink-parse")
+
+
+def _get_parse_executor() -> Executor:
+    global _PARSE_EXECUTOR
+    if _PARSE_EXECUTOR is None:
+        _PARSE_EXECUTOR = _new_parse_executor(_PARSE_KIND)
+    return _PARSE_EXECUTOR
+
+
+def _recycle_parse_executor(executor: Executor, kind: str | None = None):
+    """Drop `executor` so the next parse gets a fresh pool, and kill its worker processes.
+
+    A timed-out parse keeps running in its worker, so without this a few pathological
+    pages would hold every slot. Threads can't be killed: they are only detached.
+    """
+    global _PARSE_EXECUTOR, _PARSE_KIND
+    if kind:
+        _PARSE_KIND = kind
+    if executor is _PARSE_EXECUTOR:
+        _PARSE_EXECUTOR = None
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        with contextlib.suppress(Exception):
+            process.terminate()
+
+
+async def warm_parse_executor():
+    """Start the parse workers ahead of the first import so it doesn't pay the spawn cost."""
+    loop = asyncio.get_running_loop()
+    executor = _get_parse_executor()
+    try:
+        await asyncio.gather(*(loop.run_in_executor(executor, parse_bandlink, "") for _ in range(PARSE_WORKERS)))
+    except Exception as err:
+        print(f"[bandlink] parse pool warmup failed: {err}")
+
+
+def shutdown_parse_executor():
+    global _PARSE_EXECUTOR
+    if _PARSE_EXECUTOR is not None:
+        _PARSE_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+        _PARSE_EXECUTOR = None
+
+
+async def parse_bandlink_async(html_content: str) -> tuple[dict[str, str], dict | None]:
+    """Run parse_bandlink in the parse pool with an input size cap and a timeout."""
+    if not html_content:
+        return {}, None
+    size = len(html_content.encode("utf-8", errors="replace"))
+    if size > BANDLINK_MAX_HTML_BYTES:
+        logger.warning("[bandlink] html too large to parse: %s bytes", size)
+        return {}, None
+
+    loop = asyncio.get_running_loop()
+    for _ in range(2):
+        executor = _get_parse_executor()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(executor, parse_bandlink, html_content),
+                timeout=BANDLINK_PARSE_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            logger.warning("[bandlink] parse timed out after %.1fs, recycling the pool", BANDLINK_PARSE_TIMEOUT)
+            _recycle_parse_executor(executor)
+            return {}, None
+        except BrokenProcessPool:
+            if executor is not _PARSE_EXECUTOR:
+                # Killed by another parse's timeout: run this one again on the fresh pool.
+                continue
+            logger.exception("[bandlink] parse pool is broken, falling back to threads")
+            _recycle_parse_executor(executor, kind="thread")
+    return {}, None
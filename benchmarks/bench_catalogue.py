@@ -0,0 +1,77 @@
+"""Microbenchmark: catalogue lookups and screen renders against the old linear scans.
+
+Run from the repo root:  python benchmarks/bench_catalogue.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyboards import (  # noqa: E402
+    CATALOGUE,
+    SECTIONS,
+    TASKS,
+    build_focus,
+    build_section_page,
+    count_progress,
+    find_section_for_task,
+    get_next_task,
+    get_task_title,
+)
+
+
+def linear_get_task_title(task_id: int) -> str:
+    for tid, t in TASKS:
+        if tid == task_id:
+            return t
+    return "Задача"
+
+
+def linear_find_section(task_id: int):
+    for sid, stitle, ids in SECTIONS:
+        if task_id in ids:
+            return sid, stitle
+    return None
+
+
+def linear_count_progress(tasks_state: dict[int, int]):
+    return sum(1 for task_id, _ in TASKS if tasks_state.get(task_id, 0) == 1), len(TASKS)
+
+
+def linear_next_task(tasks_state: dict[int, int]):
+    for task_id, title in TASKS:
+        if tasks_state.get(task_id, 0) == 0:
+            return task_id, title
+    return None
+
+
+def bench(label: str, fn, number: int):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    print(f"{label:<42} {best / number * 1e6:8.2f} us/op")
+
+
+def main():
+    random.seed(7)
+    state = {tid: 1 if random.random() < 0.6 else 0 for tid, _ in TASKS}
+    mask = CATALOGUE.mask_of(state)
+    last_id = TASKS[-1][0]
+    n = 100_000
+
+    bench("get_task_title (linear)", lambda: linear_get_task_title(last_id), n)
+    bench("get_task_title (catalogue)", lambda: get_task_title(last_id), n)
+    bench("find_section_for_task (linear)", lambda: linear_find_section(last_id), n)
+    bench("find_section_for_task (catalogue)", lambda: find_section_for_task(last_id), n)
+    bench("count_progress (linear, dict)", lambda: linear_count_progress(state), n)
+    bench("count_progress (catalogue, dict)", lambda: count_progress(state), n)
+    bench("count_progress (catalogue, mask)", lambda: count_progress(mask), n)
+    bench("next task (linear, dict)", lambda: linear_next_task(state), n)
+    bench("next task (catalogue, mask)", lambda: get_next_task(mask), n)
+    bench("build_focus (dict)", lambda: build_focus(state, "first", {3}), 5_000)
+    bench("build_focus (mask)", lambda: build_focus(mask, "first", {3}), 5_000)
+    bench("build_section_page (mask)", lambda: build_section_page(mask, "content", 0), 5_000)
+
+
+if __name__ == "__main__":
+    main()
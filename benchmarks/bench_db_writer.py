@@ -0,0 +1,69 @@
+"""Concurrent writers: one commit per setter call against the group-commit writer task.
+
+Run from the repo root:  python benchmarks/bench_db_writer.py [writers] [writes_per_writer]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_db_"), "bench.db")
+
+import aiosqlite  # noqa: E402
+
+import db  # noqa: E402
+
+SQL = "UPDATE users SET tasks_mask = COALESCE(tasks_mask, 0) | ? WHERE tg_id=?"
+
+
+async def commit_per_call(tg_id: int, bit: int):
+    # What every setter did before the writer: its own connection and its own commit.
+    async with aiosqlite.connect(db.DB_PATH) as conn:
+        await conn.execute(SQL, (bit, tg_id))
+        await conn.commit()
+
+
+async def via_writer(tg_id: int, bit: int):
+    await db.execute_write(SQL, (bit, tg_id))
+
+
+async def run(label: str, write, writers: int, per_writer: int):
+    errors = 0
+
+    async def writer(tg_id: int):
+        nonlocal errors
+        for i in range(per_writer):
+            try:
+                await write(tg_id, 1 << (i % 60))
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(tg_id) for tg_id in range(1, writers + 1)))
+    elapsed = time.perf_counter() - started
+    total = writers * per_writer
+    print(f"{label:<18} {total / elapsed:10.0f} writes/s  {elapsed * 1e3:8.0f} ms  errors={errors}")
+
+
+async def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    per_writer = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    await db.init_db()
+    async with aiosqlite.connect(db.DB_PATH) as conn:
+        await conn.executemany("INSERT OR IGNORE INTO users (tg_id) VALUES (?)", [(i,) for i in range(1, writers + 1)])
+        await conn.commit()
+
+    print(f"{writers} concurrent writers x {per_writer} writes")
+    await run("commit per call", commit_per_call, writers, per_writer)
+
+    db.start_db_writer()
+    await run("writer task", via_writer, writers, per_writer)
+    await db.stop_db_writer()
+    stats = db.WRITER_STATS
+    print(f"writer: {stats['units']} units in {stats['batches']} transactions, {stats['failed']} failed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,278 @@
+"""Microbenchmark suite for the pure functions on hot paths, with a saved baseline.
+
+The --repeat timed runs of each case are split over --processes fresh interpreters.
+In each, a case is calibrated so one run loops it for at least --min-time seconds and
+warmed up with one discarded run. The median and the standard deviation of all runs
+are reported in microseconds per call. BandLink cases run over the synthetic pages in
+benchmarks/corpus/. Compare against a baseline to catch regressions:
+
+Run from the repo root:
+    python benchmarks/bench_hot.py                       # compare with bench_hot_baseline.json
+    python benchmarks/bench_hot.py --save                # record a new baseline on this machine
+    python benchmarks/bench_hot.py --filter bandlink --threshold 0.10
+
+Exits with status 1 when a case's median is slower than the baseline's by more than
+both --threshold and --sigma combined standard errors of the two medians, so a noisy
+case needs a bigger slowdown to count. Baselines are machine-specific:
+re-record one before comparing on different hardware.
+"""
+import argparse
+import contextlib
+import datetime as dt
+import glob
+import json
+import logging
+import os
+import platform
+import math
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+import bandlink  # noqa: E402
+import bot  # noqa: E402
+import db  # noqa: E402
+import helpers  # noqa: E402
+import keyboards  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "bench_hot_baseline.json")
+
+URL_TEMPLATES = [
+    "https://open.spotify.com/track/{id}?si={id}&utm_source=copy",
+    "https://music.yandex.ru/album/{n}/track/{m}?utm_medium=share",
+    "https://music.apple.com/ru/album/single/{n}?i={m}",
+    "https://vk.com/music/album/-2000{n}_{m}",
+    "https://www.youtube.com/watch?v={id}&feature=share",
+    "https://music.youtube.com/watch?v={id}",
+    "https://zvuk.com/release/{n}",
+    "https://www.deezer.com/track/{n}",
+    "https://band.link/{id}",
+    "https://example.com/blog/{n}",
+    "ftp://files.example.com/{id}",
+]
+DATE_INPUTS = ["01.12.2030", "2030-12-01", "1/2/2031", "15 04 2029", "31.02.2030", "завтра", "", "2030.1.9"]
+
+
+def load_corpus() -> dict[str, str]:
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            pages[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    return pages
+
+
+def make_urls(count: int, rng: random.Random) -> list[str]:
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
+    urls = []
+    for _ in range(count):
+        token = "".join(rng.choice(alphabet) for _ in range(22))
+        template = rng.choice(URL_TEMPLATES)
+        urls.append(template.format(id=token, n=rng.randrange(10**7), m=rng.randrange(10**8)))
+    return urls
+
+
+def smartlink_fixture(release_date: dt.date) -> dict:
+    return {
+        "id": 42,
+        "owner_tg_id": 1,
+        "artist": "Северный Ветер & <Friends>",
+        "title": "Огни",
+        "release_date": release_date.isoformat(),
+        "pre_save_enabled": False,
+        "reminders_enabled": True,
+        "cover_file_id": "AgACAgIAAxkBAAI",
+        "links": {key: f"https://example.com/{key}/123" for key, _ in bot.SMARTLINK_BUTTON_ORDER},
+        "caption_text": "Новый сингл уже на всех площадках",
+        "branding_disabled": False,
+    }
+
+
+def build_cases() -> dict:
+    rng = random.Random(20240101)
+    cases = {}
+
+    for name, page in load_corpus().items():
+        cases[f"parse_bandlink[{name}]"] = lambda page=page: bandlink.parse_bandlink(page)
+        cases[f"extract_links_from_bandlink[{name}]"] = lambda page=page: bandlink.extract_links_from_bandlink(page)
+
+    urls = make_urls(3000, rng)
+    cases["normalize_music_url_with_platform[x3000]"] = lambda: [
+        bandlink.normalize_music_url_with_platform(url) for url in urls
+    ]
+
+    existing = {
+        "artist": "Artist",
+        "title": "Title",
+        "cover_url": "https://example.com/a.jpg",
+        "sources": {"spotify": {"artist": "Artist", "title": "Title", "cover_url": "https://example.com/a.jpg"}},
+        "preferred_source": "spotify",
+    }
+    new = {
+        "artist": "Artist feat. Guest",
+        "title": "Title",
+        "cover_url": "https://example.com/b.jpg",
+        "sources": {
+            "apple": {"artist": "Artist feat. Guest", "title": "Title", "cover_url": "https://example.com/b.jpg"},
+            "yandex": {"artist": "Artist", "title": "Title (Single)", "cover_url": ""},
+        },
+        "preferred_source": "apple",
+        "conflict": True,
+    }
+    cases["merge_metadata"] = lambda: bot.merge_metadata(existing, new)
+    cases[f"parse_date[x{len(DATE_INPUTS)}]"] = lambda: [helpers.parse_date(value) for value in DATE_INPUTS]
+
+    mask = sum(1 << tid for tid in range(1, 25, 3))
+    important = {2, 7, 11}
+    cases["build_focus"] = lambda: keyboards.build_focus(mask, "first", important, show_completed=False)
+    cases["build_section_page"] = lambda: keyboards.build_section_page(mask, "content", 0)
+
+    release = dt.date.today() + dt.timedelta(days=30)
+    smartlink = smartlink_fixture(release)
+    released = smartlink_fixture(dt.date.today() - dt.timedelta(days=3))
+    cases["build_smartlink_caption"] = lambda: bot.build_smartlink_caption(released)
+    cases["build_smartlink_buttons"] = lambda: keyboards.build_smartlink_buttons(released, subscribed=True, page=0)
+    cases["build_smartlink_caption[presave]"] = lambda: bot.build_smartlink_caption(
+        {**smartlink, "pre_save_enabled": True}
+    )
+    cases["timeline_text"] = lambda: bot.timeline_text(release, True)
+
+    row = (
+        42, 1, "Artist", "Title", release.isoformat(), 1, 1, None, "AgACAgIAAxkBAAI",
+        json.dumps(smartlink["links"]), "caption", 0, "2024-01-01T00:00:00", 0,
+    )
+    cases["_smartlink_row_to_dict"] = lambda: db._smartlink_row_to_dict(row)
+    return cases
+
+
+def time_case(fn, repeat: int, min_time: float) -> list[float]:
+    """Microseconds per call for each of `repeat` runs of at least `min_time` seconds."""
+    timer = timeit.Timer(fn)
+    number = 1
+    while (elapsed := timer.timeit(number)) < min_time:
+        number = max(number * 2, math.ceil(number * min_time / max(elapsed, 1e-9)))
+    timer.timeit(number)  # warm-up at the calibrated size, discarded
+    return [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+
+
+def summarize(samples: list[float]) -> dict:
+    return {"median": statistics.median(samples), "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0}
+
+
+def median_error(result: dict, processes: int) -> float:
+    """Standard error of a median: sqrt(pi/2) times that of a mean.
+
+    Runs inside one interpreter drift together, so only the processes count as
+    independent samples.
+    """
+    return 1.2533 * result["stdev"] / math.sqrt(max(processes, 1))
+
+
+def baseline_entry(value) -> dict:
+    # Baselines recorded before the median/stdev format hold a single best-of time.
+    return value if isinstance(value, dict) else {"median": value, "stdev": 0.0}
+
+
+def sample_cases(name_filter: str, repeat: int, min_time: float) -> dict[str, list[float]]:
+    cases = {name: fn for name, fn in build_cases().items() if name_filter in name}
+    samples = {}
+    # parse_bandlink prints per page and parse_date logs bad input; keep both out of the timings.
+    logging.disable(logging.WARNING)
+    for name, fn in cases.items():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            samples[name] = time_case(fn, repeat, min_time)
+    logging.disable(logging.NOTSET)
+    return samples
+
+
+def sample_in_processes(args) -> dict[str, list[float]]:
+    """Split the runs over fresh interpreters: memory layout and hash seeds differ between them too."""
+    per_process = max(2, math.ceil(args.repeat / args.processes))
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", "--filter", args.filter,
+        "--repeat", str(per_process), "--min-time", str(args.min_time),
+    ]
+    samples: dict[str, list[float]] = {}
+    for _ in range(args.processes):
+        done = subprocess.run(command, capture_output=True, text=True, check=True)
+        for name, runs in json.loads(done.stdout.splitlines()[-1]).items():
+            samples.setdefault(name, []).extend(runs)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="smallest slowdown reported, 0.10 = 10%%")
+    parser.add_argument(
+        "--sigma", type=float, default=3.0, help="slowdown must also exceed this many standard errors of the medians"
+    )
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per case, over all processes")
+    parser.add_argument("--processes", type=int, default=5, help="fresh interpreters to split the runs over")
+    parser.add_argument("--min-time", type=float, default=0.1, help="seconds per run, at least")
+    parser.add_argument("--filter", default="", help="only cases whose name contains this")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(sample_cases(args.filter, args.repeat, args.min_time)))
+        return 0
+
+    baseline, baseline_processes = {}, 1
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            saved = json.load(f)
+        baseline, baseline_processes = saved.get("cases", {}), saved.get("processes", 1)
+
+    results = {name: summarize(runs) for name, runs in sample_in_processes(args).items()}
+    regressions = []
+    print(f"{'case':<48}{'us/call':>12}{'+-':>9}{'baseline':>12}{'allowed':>9}{'change':>9}")
+    for name, result in results.items():
+        us, spread = result["median"], result["stdev"]
+        if name in baseline:
+            base = baseline_entry(baseline[name])
+            noise = args.sigma * math.hypot(
+                median_error(base, baseline_processes), median_error(result, args.processes)
+            )
+            allowed = max(args.threshold, noise / base["median"])
+            change = us / base["median"] - 1
+            flag = "  REGRESSION" if change > allowed else ""
+            if flag:
+                regressions.append(name)
+            print(f"{name:<48}{us:12.2f}{spread:9.2f}{base['median']:12.2f}{allowed:+8.0%}{change:+9.0%}{flag}")
+        else:
+            print(f"{name:<48}{us:12.2f}{spread:9.2f}{'-':>12}{'':>9}{'':>9}")
+
+    if args.save:
+        payload = {
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}",
+            "recorded": dt.date.today().isoformat(),
+            "repeat": args.repeat,
+            "processes": args.processes,
+            "min_time": args.min_time,
+            "cases": {
+                name: {"median": round(r["median"], 3), "stdev": round(r["stdev"], 3)} for name, r in results.items()
+            },
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"baseline saved to {os.path.relpath(args.baseline, ROOT)}")
+        return 0
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond threshold and noise: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Microbenchmark: cached keyboards against building the pydantic markup on every call.
+
+Run from the repo root:  python benchmarks/bench_keyboards.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+from aiogram.methods import SendMessage  # noqa: E402
+
+import bot  # noqa: E402
+import keyboards  # noqa: E402
+
+CACHED = {
+    "menu_keyboard": lambda: bot.menu_keyboard(True),
+    "experience_prompt": bot.experience_prompt,
+    "build_links_kb": keyboards.build_links_kb,
+    "smartlinks_menu_kb": keyboards.smartlinks_menu_kb,
+    "smartlink_view_kb": lambda: keyboards.smartlink_view_kb(42, 1),
+    "build_donate_menu_kb": keyboards.build_donate_menu_kb,
+}
+
+UNCACHED = {
+    "menu_keyboard": lambda: bot._menu_keyboard.__wrapped__(True),
+    "experience_prompt": bot.experience_prompt.__wrapped__,
+    "build_links_kb": keyboards.build_links_kb.__wrapped__,
+    "smartlinks_menu_kb": keyboards.smartlinks_menu_kb.__wrapped__,
+    "smartlink_view_kb": lambda: keyboards.smartlink_view_kb.__wrapped__(42, 1),
+    "build_donate_menu_kb": keyboards.build_donate_menu_kb.__wrapped__,
+}
+
+
+def per_op(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    number = 20_000
+    print(f"{'keyboard':<24} {'uncached us':>12} {'cached us':>10} {'speedup':>8}")
+    for name, cached in CACHED.items():
+        slow = per_op(UNCACHED[name], number)
+        fast = per_op(cached, number)
+        print(f"{name:<24} {slow:12.2f} {fast:10.3f} {slow / fast:7.0f}x")
+
+    # End to end: the reply method model that aiogram validates for every answer().
+    slow = per_op(lambda: SendMessage(chat_id=1, text="x", reply_markup=bot._menu_keyboard.__wrapped__(True)), 5_000)
+    fast = per_op(lambda: SendMessage(chat_id=1, text="x", reply_markup=bot.menu_keyboard(True)), 5_000)
+    print(f"{'SendMessage + menu':<24} {slow:12.2f} {fast:10.3f} {slow / fast:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
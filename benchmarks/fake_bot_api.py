@@ -0,0 +1,176 @@
+"""Local stand-in for the Telegram Bot API (plus Songlink and cover hosting) for offline load tests.
+
+Serves the methods the bot calls on hot paths (getMe, getUpdates, sendMessage,
+editMessageText, editMessageReplyMarkup, sendPhoto, answerCallbackQuery, ...) with
+plausible results, counts every call and can add a fixed delay to mimic Telegram's RTT.
+Point the bot at it with TELEGRAM_API_URL and SONGLINK_API_URL.
+
+Standalone:  python benchmarks/fake_bot_api.py --port 8081 --latency-ms 30
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Iskra", "username": "iskra_fake_bot"}
+# Smallest valid JPEG: enough for the cover download path.
+COVER_BYTES = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f"
+    "141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b0800010001010111"
+    "00ffc4001f0000010501010101010100000000000000000102030405060708090a0bffc400b5100002010303020403050504"
+    "040000017d01020300041105122131410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a25"
+    "262728292a3435363738393a434445464748494a535455565758595a636465666768696a737475767778797a838485868788"
+    "898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3"
+    "e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9"
+)
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+        self.app = web.Application(client_max_size=20 * 1024 * 1024)
+        self.app.add_routes([
+            web.post("/bot{token}/{method}", self.handle_method),
+            web.get("/songlink", self.handle_songlink),
+            web.get("/cover.jpg", self.handle_cover),
+        ])
+
+    def push_update(self, update: dict):
+        self.updates.put_nowait(update)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _message(self, fields, **extra) -> dict:
+        chat_id = int(fields.get("chat_id") or 0)
+        return {
+            "message_id": int(fields.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **extra,
+        }
+
+    def _photo(self) -> list[dict]:
+        file_id = f"fake-photo-{next(self._file_ids)}"
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 640}]
+
+    async def _get_updates(self, fields) -> list[dict]:
+        offset = int(fields.get("offset") or 0)
+        timeout = float(fields.get("timeout") or 0)
+        limit = int(fields.get("limit") or 100)
+        batch = []
+        try:
+            if self.updates.empty() and timeout > 0:
+                batch.append(await asyncio.wait_for(self.updates.get(), timeout))
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return [update for update in batch if update["update_id"] >= offset]
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        fields = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getme":
+            result = BOT_USER
+        elif method == "getupdates":
+            result = await self._get_updates(fields)
+        elif method in ("sendmessage", "editmessagetext"):
+            result = self._message(fields, text=fields.get("text", ""))
+        elif method in ("sendphoto", "editmessagemedia"):
+            result = self._message(fields, photo=self._photo(), caption=fields.get("caption", ""))
+        elif method == "editmessagecaption":
+            result = self._message(fields, photo=self._photo(), caption=fields.get("caption", ""))
+        elif method == "senddocument":
+            file_id = f"fake-doc-{next(self._file_ids)}"
+            result = self._message(fields, document={"file_id": file_id, "file_unique_id": file_id})
+        elif method == "editmessagereplymarkup":
+            result = self._message(fields, text="")
+        else:
+            # answerCallbackQuery, deleteMessage, setWebhook, deleteWebhook, sendChatAction, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_songlink(self, request: web.Request) -> web.Response:
+        self.calls["songlink"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        source = request.query.get("url", "")
+        track = zlib.crc32(source.encode()) % 100000
+        cover = f"{self.url}/cover.jpg"
+        entities = {}
+        links = {}
+        for platform, prefix in (
+            ("spotify", "https://open.spotify.com/track/"),
+            ("appleMusic", "https://music.apple.com/ru/album/"),
+            ("yandex", "https://music.yandex.ru/track/"),
+            ("youtube", "https://www.youtube.com/watch?v="),
+        ):
+            entity_id = f"{platform.upper()}_SONG::{track}"
+            entities[entity_id] = {
+                "id": f"{platform}:{track}",
+                "type": "song",
+                "title": f"Track {track}",
+                "artistName": f"Artist {track % 97}",
+                "thumbnailUrl": cover,
+                "apiProvider": platform,
+                "platforms": [platform],
+            }
+            links[platform] = {"url": f"{prefix}{track}", "entityUniqueId": entity_id}
+        payload = {
+            "entityUniqueId": next(iter(entities)),
+            "pageUrl": f"https://song.link/s/{track}",
+            "entitiesByUniqueId": entities,
+            "linksByPlatform": links,
+        }
+        return web.Response(text=json.dumps(payload), content_type="application/json")
+
+    async def handle_cover(self, request: web.Request) -> web.Response:
+        self.calls["cover"] += 1
+        return web.Response(body=COVER_BYTES, content_type="image/jpeg")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    api = FakeBotAPI(latency=args.latency_ms / 1000)
+    url = await api.start(args.host, args.port)
+    print(f"Fake Bot API on {url}  (TELEGRAM_API_URL={url} SONGLINK_API_URL={url}/songlink)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+        print(f"calls: {dict(api.calls)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,219 @@
+"""End-to-end load test: a synthetic user population driving `dp` against a fake Bot API.
+
+Every outbound call goes to benchmarks/fake_bot_api.py started in-process (Bot API,
+Songlink and cover downloads), and the database is a fresh temp file, so this runs
+fully offline. Each simulated user sends its updates one after another, waiting for
+the previous one to be handled, like a person tapping through the bot.
+
+Reports updates/s, p50/p95/p99 per-update latency (per scenario and overall) and
+DB / HTTP / Bot API calls per update, taken from the bot's own metrics.
+
+Run from the repo root:
+    python benchmarks/loadtest.py --users 200 --actions 20 --latency-ms 20
+
+Exits with status 1 when any update raised, with the errors listed per scenario.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+# (scenario, weight): roughly what the bot sees in production.
+SCENARIO_MIX = [
+    ("focus_toggle", 35),
+    ("section_paging", 25),
+    ("section_toggle", 15),
+    ("start", 10),
+    ("smartlink_import", 10),
+    ("smartlink_create", 5),
+]
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+class SyntheticUser:
+    def __init__(self, user_id: int, rng: random.Random):
+        self.id = user_id
+        self.rng = rng
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+
+    def message(self, text: str) -> dict:
+        return {
+            "update_id": next(_update_ids),
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": self.chat,
+                "from": self.user,
+                "text": text,
+            },
+        }
+
+    def callback(self, data: str) -> dict:
+        # The bot edits the message the button belongs to, so it has to look like the bot's own.
+        return {
+            "update_id": next(_update_ids),
+            "callback_query": {
+                "id": str(next(_update_ids)),
+                "from": self.user,
+                "chat_instance": str(self.id),
+                "data": data,
+                "message": {
+                    "message_id": next(_message_ids),
+                    "date": int(time.time()),
+                    "chat": self.chat,
+                    "from": {"id": 1, "is_bot": True, "first_name": "Iskra"},
+                    "text": "🎯 Фокус",
+                },
+            },
+        }
+
+    def onboarding(self) -> list[dict]:
+        return [self.message("/start"), self.callback("exp:first")]
+
+    def scenario(self, name: str, sections: list[tuple[str, list[int]]], task_ids: list[int], platforms: int) -> list[dict]:
+        rng = self.rng
+        if name == "focus_toggle":
+            return [self.callback(f"focus_done:{rng.choice(task_ids)}")]
+        if name == "section_paging":
+            sid, _ = rng.choice(sections)
+            return [self.callback("sections:open"), self.callback(f"section:{sid}:0")]
+        if name == "section_toggle":
+            sid, tids = rng.choice(sections)
+            return [self.callback(f"sec_toggle:{sid}:0:{rng.choice(tids)}")]
+        if name == "start":
+            return [self.message("/start")]
+        if name == "smartlink_import":
+            track = rng.randrange(10**9)
+            return [
+                self.callback("smartlink:import"),
+                self.message(f"https://open.spotify.com/track/{track:022d}"),
+                self.message("/cancel"),
+            ]
+        if name == "smartlink_create":
+            steps = [self.callback("smartlink:new"), self.message(f"Artist {self.id}"), self.message("Single")]
+            steps.append(self.message("01.12.2030"))
+            steps.extend(self.message("skip") for _ in range(2 + platforms))
+            return steps + [self.message("/cancel")]
+        raise ValueError(name)
+
+
+def call_totals(histogram, skip: tuple[str, ...] = ()) -> int:
+    return sum(count for labels, count in histogram.counts().items() if not labels or labels[0] not in skip)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--actions", type=int, default=20, help="scenarios per user after onboarding")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fake Bot API / Songlink RTT")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency_ms / 1000)
+    url = await api.start()
+    os.environ.update({
+        "DB_PATH": os.path.join(tempfile.mkdtemp(prefix="loadtest_"), "bot.db"),
+        "BOT_TOKEN": "123456:LOADTEST",
+        "TELEGRAM_API_URL": url,
+        "SONGLINK_API_URL": f"{url}/songlink",
+    })
+    # Imported after the environment points it at the fakes.
+    import bot
+    import db
+    import metrics
+
+    await bot.init_db()
+    bot.start_db_writer()
+    tg_bot = bot.create_bot()
+    await bot.warm_caches()
+
+    sections = [(sid, tids) for sid, _, tids in bot.SECTIONS]
+    task_ids = [tid for _, tids in sections for tid in tids]
+    names = [name for name, _ in SCENARIO_MIX]
+    weights = [weight for _, weight in SCENARIO_MIX]
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: Counter = Counter()
+
+    async def feed(scenario: str, payload: dict):
+        update = bot.Update.model_validate(payload, context={"bot": tg_bot})
+        started = time.perf_counter()
+        try:
+            await bot.dp.feed_update(tg_bot, update)
+        except Exception as e:
+            errors[f"{scenario}: {type(e).__name__}"] += 1
+        latencies[scenario].append((time.perf_counter() - started) * 1000)
+
+    async def run_user(user: SyntheticUser):
+        for payload in user.onboarding():
+            await feed("onboarding", payload)
+        for _ in range(args.actions):
+            scenario = user.rng.choices(names, weights)[0]
+            for payload in user.scenario(scenario, sections, task_ids, len(bot.SMARTLINK_PLATFORMS)):
+                await feed(scenario, payload)
+
+    users = [SyntheticUser(500_000 + i, random.Random(args.seed * 100_003 + i)) for i in range(args.users)]
+    db_before = call_totals(metrics.DB_SECONDS, skip=("write_batch",))
+    http_before = call_totals(metrics.HTTP_SECONDS)
+    tg_before = call_totals(metrics.TELEGRAM_SECONDS)
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user) for user in users))
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{args.users} users, {total} updates in {elapsed:.2f}s: {total / elapsed:.0f} updates/s")
+    print(f"{'scenario':<18}{'updates':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    everything: list[float] = []
+    for scenario in ["onboarding", *names]:
+        values = sorted(latencies.get(scenario, []))
+        everything.extend(values)
+        if values:
+            print(
+                f"{scenario:<18}{len(values):>9}{percentile(values, 0.5):>10.2f}"
+                f"{percentile(values, 0.95):>10.2f}{percentile(values, 0.99):>10.2f}"
+            )
+    everything.sort()
+    print(
+        f"{'all':<18}{len(everything):>9}{percentile(everything, 0.5):>10.2f}"
+        f"{percentile(everything, 0.95):>10.2f}{percentile(everything, 0.99):>10.2f}"
+    )
+    db_calls = call_totals(metrics.DB_SECONDS, skip=("write_batch",)) - db_before
+    http_calls = call_totals(metrics.HTTP_SECONDS) - http_before
+    tg_calls = call_totals(metrics.TELEGRAM_SECONDS) - tg_before
+    print(
+        f"per update: {db_calls / max(total, 1):.2f} DB calls, {http_calls / max(total, 1):.2f} HTTP calls, "
+        f"{tg_calls / max(total, 1):.2f} Bot API calls; "
+        f"writer: {db.WRITER_STATS['units']} writes in {db.WRITER_STATS['batches']} transactions"
+    )
+    print(f"fake API calls: {dict(api.calls.most_common())}")
+    if errors:
+        print(f"errors: {dict(errors)}")
+
+    await bot.close_form_store()
+    await bot.stop_db_writer()
+    await tg_bot.session.close()
+    await api.stop()
+    # A handler that raised is a bug, not load: fail the run so it can't be read as a result.
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,89 @@
+"""Fake Telegram delivering updates to a local bot running with BOT_MODE=webhook.
+
+Posts synthetic message and callback updates with the secret header and reports how
+quickly the webhook acks them and which status codes came back (503 = queue full).
+
+Run from the repo root, against a bot started with the same WEBHOOK_SECRET:
+    python benchmarks/webhook_client.py --url http://127.0.0.1:8000/telegram/webhook --secret s3cret
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook import SECRET_HEADER  # noqa: E402
+
+_update_ids = itertools.count(int(time.time()))
+
+
+def make_update(user_id: int, kind: str) -> dict:
+    now = int(time.time())
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    message = {"message_id": next(_update_ids) % 1_000_000, "date": now, "chat": chat, "from": user, "text": "/start"}
+    if kind == "callback":
+        return {
+            "update_id": next(_update_ids),
+            "callback_query": {
+                "id": str(next(_update_ids)),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": "sections:open",
+                "message": {**message, "from": {"id": 1, "is_bot": True, "first_name": "bot"}, "text": "🎯 План"},
+            },
+        }
+    return {"update_id": next(_update_ids), "message": message}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/telegram/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=20, help="updates per user")
+    parser.add_argument("--concurrency", type=int, default=40, help="parallel deliveries, like max_connections")
+    args = parser.parse_args()
+
+    statuses: Counter = Counter()
+    latencies: list[float] = []
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def deliver(session: aiohttp.ClientSession, update: dict):
+        async with gate:
+            started = time.perf_counter()
+            try:
+                async with session.post(args.url, json=update, headers={SECRET_HEADER: args.secret}) as resp:
+                    await resp.read()
+                    statuses[resp.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+                return
+            latencies.append((time.perf_counter() - started) * 1e3)
+
+    updates = [
+        make_update(100_000 + u, "callback" if i % 2 else "message")
+        for i in range(args.updates)
+        for u in range(args.users)
+    ]
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(deliver(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.0f}/s), statuses: {dict(statuses)}")
+    if latencies:
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"ack latency ms: median {statistics.median(latencies):.2f}  p99 {p99:.2f}  max {latencies[-1]:.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
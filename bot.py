@@ -13,48 +13,65 @@
 import asyncio
 import contextlib
 import fcntl
-import json
+import hashlib
+import secrets
 import logging
 import os
 import re
 import datetime as dt
 import time
 import traceback
-from typing import IO
-from urllib.parse import parse_qsl, urlparse, urlunparse, urlencode
+from functools import lru_cache
+from typing import IO, Awaitable, Callable, NamedTuple
+from urllib.parse import urlparse
 
 import aiohttp
-from bs4 import BeautifulSoup
 import smtplib
 from email.mime.text import MIMEText
 from aiohttp import web
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError
 from aiogram.filters import CommandStart, Command
 from aiogram.types import (
     Message,
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton,
-    LabeledPrice, PreCheckoutQuery,
-    BufferedInputFile,
+    LabeledPrice, PreCheckoutQuery, SuccessfulPayment,
+    InputFile,
+    Update,
 )
 from aiogram.utils.backoff import Backoff, BackoffConfig
 from dotenv import load_dotenv
 from db import (
+    claim_payment_charge,
+    claim_update,
+    compact_processed_updates,
     count_smartlinks,
+    db_writer_alive,
+    writer_busy_for,
     cycle_account_status as db_cycle_account_status,
+    delete_cached_cover,
     delete_smartlink,
     ensure_user as db_ensure_user,
     add_smartlink_reminder,
     remove_smartlink_reminder,
     is_smartlink_reminder_set,
+    close_form_store,
+    load_form_store,
+    forget_updates,
+    journal_updates,
+    load_pending_updates,
     form_clear,
     form_get,
     form_set,
     form_start,
-    get_accounts_state,
+    has_active_form,
+    get_accounts_state as db_get_accounts_state,
+    get_bot_state,
+    get_cached_cover,
     get_export_unlocked,
     get_experience,
     get_important_tasks,
@@ -65,6 +82,11 @@ from db import (
     get_reminders_enabled,
     get_smartlink_by_id,
     list_smartlinks,
+    ping_db,
+    release_payment_charge,
+    release_update,
+    set_bot_state,
+    get_tasks_mask,
     get_tasks_state,
     get_updates_opt_in,
     get_updates_opt_in_users,
@@ -72,7 +94,9 @@ from db import (
     is_smartlink_subscribed,
     reset_all_data,
     reset_progress_only,
+    save_cached_cover,
     save_qc_check,
+    save_smartlinks,
     save_smartlink,
     set_export_unlocked,
     set_experience,
@@ -80,14 +104,17 @@ from db import (
     set_release_date,
     set_smartlink_subscription,
     set_updates_opt_in,
+    start_db_writer,
+    stop_db_writer,
     toggle_updates_opt_in,
-    set_focus_show_completed,
+    toggle_focus_show_completed,
     toggle_important_task,
-    toggle_reminders_enabled,
-    toggle_task_and_get_state,
+    toggle_reminders_and_get_release_date,
+    toggle_task_mask,
     update_smartlink_caption,
     update_smartlink_data,
     was_qc_checked,
+    write_queue_depth,
 )
 from helpers import (
     escape_html,
@@ -100,6 +127,9 @@ from helpers import (
 )
 from keyboards import (
     ACCOUNTS,
+    ACCOUNT_KEYS,
+    FrozenInlineKeyboardMarkup,
+    FrozenReplyKeyboardMarkup,
     BRANDING_DISABLE_PRICE,
     EXPORT_LABELS,
     EXPORT_UNLOCK_PRICE,
@@ -127,7 +157,6 @@ from keyboards import (
     find_section_for_task,
     get_next_task,
     get_task_title,
-    next_acc_status,
     smartlink_branding_confirm_kb,
     smartlink_edit_menu_kb,
     smartlink_export_kb,
@@ -146,10 +175,42 @@ from texts import (
     QC_PROMPTS,
     RESOLVER_FALLBACK_TEXT,
     SMARTLINKS_HELP_TEXT,
+    SMARTLINK_BULK_PROMPT,
     SMARTLINK_IMPORT_PROMPT,
     UGC_TIP_TEXT,
 )
-from scheduler import build_deadlines, reminder_scheduler
+from scheduler import (
+    REMINDER_INTERVAL_SECONDS,
+    SCHEDULER_HEARTBEAT_KEY,
+    SCHEDULER_STATE,
+    build_deadlines,
+    reminder_scheduler,
+)
+from spotify import ISRC_RE, UPC_RE, SpotifyClient
+from middlewares import IdempotencyMiddleware, MetricsMiddleware, UpdateTracker, UserSerialMiddleware
+from looplag import LoopLagMonitor
+from metrics import TELEGRAM_LAST_OK, TelegramMetricsMiddleware, http_trace, render as render_metrics
+from handover import HandoverClient, HandoverServer, HandoverSession
+from webhook import UpdateFeeder, WebhookIngress
+from cluster import (
+    LEADERSHIP,
+    WorkerPool,
+    catch_up,
+    consume_worker_queue,
+    poll_into,
+    report_results,
+    run_as_leader,
+    update_to_payload,
+)
+from bandlink import (
+    BANDLINK_MAX_HTML_BYTES,
+    SONGLINK_PLATFORM_ALIASES,
+    _normalize_music_url,
+    detect_platform,
+    parse_bandlink_async,
+    shutdown_parse_executor,
+    warm_parse_executor,
+)
 
 def build_focus_caption(
     tasks_state: dict[int, int],
@@ -277,11 +338,15 @@ HUMAN_METADATA_PLATFORMS = {"apple", "spotify", "yandex", "vk"}
 
 
 async def ensure_user(tg_id: int, username: str | None = None):
-    await db_ensure_user(tg_id, username, TASKS, ACCOUNTS)
+    await db_ensure_user(tg_id, username)
+
 
+async def get_accounts_state(tg_id: int) -> dict[str, int]:
+    return await db_get_accounts_state(tg_id, ACCOUNT_KEYS)
 
-async def cycle_account_status(tg_id: int, key: str):
-    return await db_cycle_account_status(tg_id, key, next_acc_status)
+
+async def cycle_account_status(tg_id: int, key: str) -> dict[str, int]:
+    return await db_cycle_account_status(tg_id, key, ACCOUNT_KEYS)
 
 
 def smartlink_step_prompt(step: int) -> str:
@@ -309,23 +374,6 @@ BANDLINK_USER_AGENT = (
 
 BANDLINK_REFRESH_PLATFORMS = {"spotify", "yandex", "apple", "vk", "zvuk", "youtube", "deezer", "youtubemusic"}
 
-SONGLINK_API_URL = "https://api.song.link/v1-alpha.1/links"
-SONGLINK_PLATFORM_ALIASES = {
-    "spotify": "spotify",
-    "applemusic": "apple",
-    "applemusicapp": "apple",
-    "apple": "apple",
-    "itunes": "itunes",
-    "youtubemusic": "youtubemusic",
-    "youtube": "youtube",
-    "deezer": "deezer",
-    "yandex": "yandex",
-    "yandexmusic": "yandex",
-    "vk": "vk",
-    "zvuk": "zvuk",
-    "kion": "kion",
-    "mts": "kion",
-}
 
 # -------------------- CONFIG --------------------
 
@@ -384,8 +432,9 @@ def lyrics_sync_text() -> str:
 def ugc_tip_text() -> str:
     return UGC_TIP_TEXT
 
+@lru_cache(maxsize=None)
 def experience_prompt() -> tuple[str, InlineKeyboardMarkup]:
-    kb = InlineKeyboardMarkup(inline_keyboard=[
+    kb = FrozenInlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🆕 Первый релиз", callback_data="exp:first")],
         [InlineKeyboardButton(text="🎧 Уже выпускал(а)", callback_data="exp:old")],
     ])
@@ -393,8 +442,13 @@ def experience_prompt() -> tuple[str, InlineKeyboardMarkup]:
     return text, kb
 
 def menu_keyboard(updates_enabled: bool | None = None) -> ReplyKeyboardMarkup:
-    updates_text = "🔔 Обновления: Вкл" if updates_enabled is not False else "🔔 Обновления: Выкл"
-    return ReplyKeyboardMarkup(
+    return _menu_keyboard(updates_enabled is not False)
+
+
+@lru_cache(maxsize=None)
+def _menu_keyboard(updates_on: bool) -> ReplyKeyboardMarkup:
+    updates_text = "🔔 Обновления: Вкл" if updates_on else "🔔 Обновления: Выкл"
+    return FrozenReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="🎯 План"), KeyboardButton(text="📦 Задачи по разделам")],
             [KeyboardButton(text="📅 Таймлайн"), KeyboardButton(text="⏰ Дата релиза")],
@@ -415,23 +469,77 @@ async def user_menu_keyboard(tg_id: int) -> ReplyKeyboardMarkup:
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 TOKEN = os.getenv("BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+SONGLINK_API_URL = os.getenv("SONGLINK_API_URL", "https://api.song.link/v1-alpha.1/links")
 ADMIN_TG_ID = os.getenv("ADMIN_TG_ID")
 APP_VERSION = os.getenv("APP_VERSION", "dev")
 PORT = int(os.getenv("PORT", "8000"))
+# BOT_MODE=webhook receives updates on the health server instead of long polling.
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Without a configured secret every start registers a fresh random one.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# BOT_WORKERS > 0 splits the bot into one ingress process and that many handler processes,
+# each owning the users with tg_id % BOT_WORKERS == its index.
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "0"))
+CLUSTER_QUEUE_SIZE = int(os.getenv("CLUSTER_QUEUE_SIZE", "1000"))
+# The reminder scheduler runs in whichever process holds this DB lease.
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "30"))
+# A new polling instance takes over from the running one through this socket instead of exiting.
+HANDOVER_SOCKET = os.getenv("HANDOVER_SOCKET", "/tmp/iskra_bot_handover.sock")
+# How long the running instance drains before refusing, and how long either side waits on a silent peer.
+HANDOVER_TIMEOUT = float(os.getenv("HANDOVER_TIMEOUT", "60"))
+# Polling resumes from the last handled update_id, saved at most once per interval.
+UPDATE_OFFSET_KEY = "polling_offset"
+UPDATE_OFFSET_SAVE_INTERVAL = float(os.getenv("UPDATE_OFFSET_SAVE_INTERVAL", "2"))
+CATCHUP_CONCURRENCY = int(os.getenv("CATCHUP_CONCURRENCY", "16"))
+# Buttons pressed longer ago than this are dropped on catch-up; messages and payments never are.
+CATCHUP_CALLBACK_MAX_AGE = float(os.getenv("CATCHUP_CALLBACK_MAX_AGE", "300"))
 POLLING_LOCK_FILE = os.getenv("POLLING_LOCK_FILE", "/tmp/iskra_bot_polling.lock")
 POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "60"))
 NETWORK_ERROR_LOG_THROTTLE = float(os.getenv("NETWORK_ERROR_LOG_THROTTLE", "30"))
 # HTTP timeout must be numeric: aiogram adds it to polling_timeout internally.
 HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT_TOTAL", "90"))
+# Downloads are streamed in chunks and abandoned once they pass their byte budget.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+COVER_MAX_BYTES = int(os.getenv("COVER_MAX_BYTES", str(10 * 1024 * 1024)))
+BULK_IMPORT_MAX_ITEMS = int(os.getenv("BULK_IMPORT_MAX_ITEMS", "100"))
+BULK_IMPORT_MAX_BYTES = int(os.getenv("BULK_IMPORT_MAX_BYTES", str(256 * 1024)))
+BULK_IMPORT_CONCURRENCY = int(os.getenv("BULK_IMPORT_CONCURRENCY", "4"))
+BULK_IMPORT_PROGRESS_INTERVAL = 2.0
 POLLING_BACKOFF_CONFIG = BackoffConfig(
     min_delay=float(os.getenv("BACKOFF_MIN_DELAY", "1")),
     max_delay=float(os.getenv("BACKOFF_MAX_DELAY", "60")),
     factor=float(os.getenv("BACKOFF_FACTOR", "2")),
     jitter=float(os.getenv("BACKOFF_JITTER", "0.1")),
 )
+# Loop lag is sampled every LOOP_LAG_INTERVAL; a block longer than LOOP_STALL_THRESHOLD logs
+# the blocking stack, and /health turns "degraded" while the average stays above LOOP_LAG_DEGRADED.
+LOOP_MONITOR = LoopLagMonitor(
+    interval=float(os.getenv("LOOP_LAG_INTERVAL", "0.1")),
+    stall_threshold=float(os.getenv("LOOP_STALL_THRESHOLD", "0.5")),
+    degraded_threshold=float(os.getenv("LOOP_LAG_DEGRADED", "0.1")),
+    window=float(os.getenv("LOOP_LAG_WINDOW", "10")),
+)
+# /readyz budgets: how slow or stale a dependency may get before traffic should go elsewhere.
+READY_DB_BUDGET = float(os.getenv("READY_DB_BUDGET", "0.5"))
+READY_POLL_MAX_AGE = float(os.getenv("READY_POLL_MAX_AGE", str(POLLING_TIMEOUT + HTTP_TIMEOUT + 30)))
+READY_SCHEDULER_MAX_AGE = float(os.getenv("READY_SCHEDULER_MAX_AGE", str(2 * REMINDER_INTERVAL_SECONDS + 120)))
+READY_MAX_QUEUE_FILL = float(os.getenv("READY_MAX_QUEUE_FILL", "0.8"))
+READY_MAX_WRITE_QUEUE = int(os.getenv("READY_MAX_WRITE_QUEUE", "1000"))
+READY_DB_WRITE_MAX_BUSY = float(os.getenv("READY_DB_WRITE_MAX_BUSY", "5"))
+STARTED_AT = time.monotonic()
+# Long-running tasks /livez watches; a finished one means the process needs a restart.
+HEALTH_TASKS: dict[str, asyncio.Task] = {}
+# Child processes /livez watches, as name -> "is it running".
+HEALTH_PROCESSES: dict[str, Callable[[], bool]] = {}
+HEALTH_QUEUES: dict[str, Callable[[], tuple[int, int]]] = {}
 HEALTH_STATE: dict[str, str | int | None] = {
     "status": "starting",
-    "mode": "polling",
+    "mode": BOT_MODE,
     "version": APP_VERSION,
     "bot_id": None,
     "username": None,
@@ -444,11 +552,41 @@ SMTP_TO = os.getenv("SMTP_TO") or LABEL_EMAIL
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 SPOTIFY_UPC_ENABLED = bool(SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET)
+SPOTIFY = SpotifyClient(
+    SPOTIFY_CLIENT_ID,
+    SPOTIFY_CLIENT_SECRET,
+    concurrency=int(os.getenv("SPOTIFY_CONCURRENCY", "4")),
+    requests_per_second=float(os.getenv("SPOTIFY_RPS", "8")),
+)
 
-_SPOTIFY_ACCESS_TOKEN: str | None = None
-_SPOTIFY_TOKEN_EXPIRES_AT: dt.datetime | None = None
+# Per-user ordering plus global caps: DISPATCH_MAX_IN_FLIGHT handlers run at once,
+# link imports get their own DISPATCH_SLOW_LANE slots, and polling stops fetching
+# once DISPATCH_MAX_PENDING updates are queued.
+DISPATCH_MAX_IN_FLIGHT = int(os.getenv("DISPATCH_MAX_IN_FLIGHT", "64"))
+DISPATCH_SLOW_LANE = int(os.getenv("DISPATCH_SLOW_LANE", "4"))
+DISPATCH_MAX_PENDING = int(os.getenv("DISPATCH_MAX_PENDING", "1000"))
+# Redelivered updates are dropped by update_id; claims older than the TTL are compacted.
+IDEMPOTENCY_MEMORY_SIZE = int(os.getenv("IDEMPOTENCY_MEMORY_SIZE", "10000"))
+PROCESSED_UPDATES_TTL = float(os.getenv("PROCESSED_UPDATES_TTL", str(2 * 24 * 3600)))
+PROCESSED_UPDATES_COMPACT_INTERVAL = float(os.getenv("PROCESSED_UPDATES_COMPACT_INTERVAL", "600"))
 
 dp = Dispatcher()
+update_tracker = UpdateTracker()
+dp.update.outer_middleware(update_tracker)
+idempotency_middleware = IdempotencyMiddleware(
+    claim_update,
+    release_update,
+    compact_processed_updates,
+    memory_size=IDEMPOTENCY_MEMORY_SIZE,
+    ttl=PROCESSED_UPDATES_TTL,
+    compact_interval=PROCESSED_UPDATES_COMPACT_INTERVAL,
+)
+dp.update.outer_middleware(idempotency_middleware)
+dispatch_middleware = UserSerialMiddleware(max_in_flight=DISPATCH_MAX_IN_FLIGHT, slow_lane=DISPATCH_SLOW_LANE)
+dp.update.outer_middleware(dispatch_middleware)
+# Latency and error metrics are labelled by the commands and callback prefixes the
+# handlers below register; anything else (typos, forged callback data) is "other".
+dp.update.outer_middleware(MetricsMiddleware(dp))
 logger = logging.getLogger(__name__)
 
 async def maybe_send_update_notice(message: Message, tg_id: int):
@@ -501,23 +639,232 @@ async def start_smartlink_import(message: Message, tg_id: int):
     )
 
 
+async def start_smartlink_bulk_import(message: Message, tg_id: int):
+    await form_start(tg_id, "smartlink_bulk_import")
+    await message.answer(SMARTLINK_BULK_PROMPT, reply_markup=await user_menu_keyboard(tg_id))
+
+
+def parse_bulk_import_entries(raw: str) -> tuple[list[str], list[str]]:
+    """Split pasted text or a txt/csv file into release URLs and UPC/ISRC codes."""
+    urls: list[str] = []
+    codes: list[str] = []
+    for token in re.split(r"[\s,;]+", raw or ""):
+        token = token.strip().strip("\"'<>")
+        if not token:
+            continue
+        if re.match(r"https?://", token, re.IGNORECASE):
+            if _is_valid_url(token):
+                urls.append(token)
+            continue
+        code = token.upper().replace("-", "")
+        if UPC_RE.fullmatch(code) or ISRC_RE.fullmatch(code):
+            codes.append(code)
+    return list(dict.fromkeys(urls)), list(dict.fromkeys(codes))
+
+
+async def read_bulk_import_document(message: Message) -> str | None:
+    document = message.document
+    if document.file_size and document.file_size > BULK_IMPORT_MAX_BYTES:
+        return None
+    buffer = await message.bot.download(document)
+    data = buffer.read(BULK_IMPORT_MAX_BYTES + 1)
+    if len(data) > BULK_IMPORT_MAX_BYTES:
+        return None
+    return data.decode("utf-8-sig", errors="replace")
+
+
+async def run_bulk_import(message: Message, tg_id: int, urls: list[str], codes: list[str]):
+    progress = await message.answer(f"📦 Импорт: 0/{len(urls) + len(codes)}…")
+    not_found: list[str] = []
+    urls = list(urls)
+    if codes:
+        found = await SPOTIFY.lookup_many(codes) if SPOTIFY.enabled else {}
+        for code in codes:
+            candidates = found.get(code) or []
+            if candidates:
+                urls.append(candidates[0]["spotify_url"])
+            else:
+                not_found.append(code)
+    urls = list(dict.fromkeys(urls))
+
+    total = len(urls) + len(not_found)
+    processed = len(not_found)
+    last_edit = time.monotonic()
+    semaphore = asyncio.Semaphore(max(1, BULK_IMPORT_CONCURRENCY))
+
+    async def resolve_one(url: str) -> tuple[str, dict[str, str], dict | None]:
+        async with semaphore:
+            try:
+                links, metadata = await resolve_links(url)
+            except Exception:
+                logger.exception("[smartlink] bulk resolve failed url=%s", url)
+                return url, {}, None
+            return url, links, metadata
+
+    items: list[dict] = []
+    seen_links: set[str] = set()
+    duplicates = 0
+    for task in asyncio.as_completed([resolve_one(url) for url in urls]):
+        url, links, metadata = await task
+        processed += 1
+        links_clean = {
+            k: v
+            for k, v in (links or {}).items()
+            if v and isinstance(v, str) and _is_valid_url(v.strip())
+        }
+        if not links_clean:
+            not_found.append(url)
+        elif seen_links.intersection(links_clean.values()):
+            duplicates += 1
+        else:
+            seen_links.update(links_clean.values())
+            selected_meta = pick_selected_metadata({"metadata": metadata or {}})
+            cover_url = selected_meta.get("cover_url") or (metadata or {}).get("cover_url") or ""
+            items.append(
+                {
+                    "artist": selected_meta.get("artist") or "",
+                    "title": selected_meta.get("title") or "",
+                    "cover_file_id": (await get_cached_cover(cover_url) or "") if cover_url else "",
+                    "links": links_clean,
+                }
+            )
+
+        if time.monotonic() - last_edit >= BULK_IMPORT_PROGRESS_INTERVAL and processed < total:
+            progress = await safe_edit(progress, f"📦 Импорт: {processed}/{total}…") or progress
+            last_edit = time.monotonic()
+
+    saved = await save_smartlinks(tg_id, items)
+    logger.info(
+        "[smartlink] bulk import tg_id=%s total=%s saved=%s failed=%s duplicates=%s",
+        tg_id,
+        total,
+        saved,
+        len(not_found),
+        duplicates,
+    )
+    lines = [f"📦 Импорт завершён: создано {saved} из {total}."]
+    if duplicates:
+        lines.append(f"Повторы пропущены: {duplicates}.")
+    if not_found:
+        lines.append("")
+        lines.append("Не удалось распознать:")
+        lines.extend(f"• {entry}" for entry in not_found[:10])
+        if len(not_found) > 10:
+            lines.append(f"…и ещё {len(not_found) - 10}")
+    if saved:
+        lines.append("")
+        lines.append("Обложки и даты релизов можно добавить в «Мои смарт-линки».")
+    await safe_edit(progress, "\n".join(lines), reply_markup=smartlinks_menu_kb())
+
+
 async def health_handler(request: web.Request) -> web.Response:
-    return web.json_response(HEALTH_STATE)
+    state = dict(HEALTH_STATE)
+    state["loop_lag_ms"] = round(LOOP_MONITOR.avg_lag * 1000, 1)
+    state["loop_stalls"] = LOOP_MONITOR.stalls
+    if state["status"] == "running" and LOOP_MONITOR.degraded:
+        state["status"] = "degraded"
+    return web.json_response(state)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        body=render_metrics().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+def _check(ok: bool, **details) -> dict:
+    return {"ok": bool(ok), **details}
+
 
+def liveness_checks() -> dict[str, dict]:
+    checks = {}
+    for name, task in HEALTH_TASKS.items():
+        checks[f"task:{name}"] = _check(not task.done())
+    for name, alive in HEALTH_PROCESSES.items():
+        checks[f"process:{name}"] = _check(alive())
+    checks["db_writer"] = _check(db_writer_alive())
+    return checks
 
-async def start_health_server() -> web.AppRunner:
+
+async def readiness_checks() -> dict[str, dict]:
+    now = time.monotonic()
+    checks = liveness_checks()
+    checks["status"] = _check(HEALTH_STATE["status"] == "running", status=HEALTH_STATE["status"])
+
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(ping_db(), READY_DB_BUDGET)
+        db_error = None
+    except Exception as e:
+        db_error = repr(e)
+    db_ms = round((time.perf_counter() - started) * 1000, 1)
+    checks["db"] = _check(db_error is None, ms=db_ms, error=db_error)
+
+    if LEADERSHIP.get("reminder_scheduler"):
+        last = SCHEDULER_STATE["last_run_at"] or SCHEDULER_STATE["started_at"] or now
+        checks["scheduler"] = _check(now - last <= READY_SCHEDULER_MAX_AGE, age_s=round(now - last, 1))
+    elif HEALTH_STATE.get("workers"):
+        # The scheduler runs in one of the workers; it records each pass in bot_state.
+        try:
+            raw = await asyncio.wait_for(get_bot_state(SCHEDULER_HEARTBEAT_KEY), READY_DB_BUDGET)
+            # A heartbeat from before this start counts from the start instead.
+            age = min(time.time() - float(raw), now - STARTED_AT) if raw else now - STARTED_AT
+            checks["scheduler"] = _check(age <= READY_SCHEDULER_MAX_AGE, age_s=round(age, 1))
+        except Exception as e:
+            checks["scheduler"] = _check(False, error=repr(e))
+    if BOT_MODE == "polling":
+        last = TELEGRAM_LAST_OK.get("GetUpdates", STARTED_AT)
+        checks["get_updates"] = _check(now - last <= READY_POLL_MAX_AGE, age_s=round(now - last, 1))
+
+    depth = write_queue_depth()
+    checks["queue:db_writes"] = _check(depth <= READY_MAX_WRITE_QUEUE, depth=depth)
+    busy = writer_busy_for()
+    checks["db_writer_busy"] = _check(busy <= READY_DB_WRITE_MAX_BUSY, busy_s=round(busy, 1))
+    for name, probe in HEALTH_QUEUES.items():
+        depth, capacity = probe()
+        checks[f"queue:{name}"] = _check(depth < capacity * READY_MAX_QUEUE_FILL, depth=depth, capacity=capacity)
+    checks["loop"] = _check(not LOOP_MONITOR.degraded, lag_ms=round(LOOP_MONITOR.avg_lag * 1000, 1))
+    return checks
+
+
+def _checks_response(checks: dict[str, dict]) -> web.Response:
+    ok = all(check["ok"] for check in checks.values())
+    return web.json_response({"status": "ok" if ok else "fail", "checks": checks}, status=200 if ok else 503)
+
+
+async def livez_handler(request: web.Request) -> web.Response:
+    """Restart me if this fails: a task that should run forever has ended."""
+    return _checks_response(liveness_checks())
+
+
+async def readyz_handler(request: web.Request) -> web.Response:
+    """Route traffic away if this fails: a dependency is slow, stale or backed up."""
+    return _checks_response(await readiness_checks())
+
+
+async def start_health_server(webhook: WebhookIngress | None = None) -> web.AppRunner:
     app = web.Application()
-    app.add_routes([web.get("/health", health_handler)])
+    app.add_routes([
+        web.get("/health", health_handler),
+        web.get("/livez", livez_handler),
+        web.get("/readyz", readyz_handler),
+        web.get("/metrics", metrics_handler),
+    ])
+    if webhook:
+        app.add_routes([web.post(WEBHOOK_PATH, webhook.handle)])
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", PORT)
+    # reuse_port lets a successor bind while this process is still handing over.
+    site = web.TCPSite(runner, "0.0.0.0", PORT, reuse_port=True)
     await site.start()
-    print(f"Health endpoint available on port {PORT} (GET /health)")
+    print(f"Health endpoint available on port {PORT} (GET /health, /livez, /readyz, /metrics)")
+    if webhook:
+        print(f"Webhook endpoint available on port {PORT} (POST {WEBHOOK_PATH})")
     return runner
 
 
 def acquire_single_instance_lock(lock_path: str) -> IO[str] | None:
-    """Try to acquire an exclusive file lock to avoid running multiple polling instances."""
+    """Try to acquire an exclusive file lock to avoid running multiple bot instances."""
 
     dir_name = os.path.dirname(lock_path)
     if dir_name:
@@ -548,10 +895,10 @@ async def build_focus_for_user(
     *,
     show_completed: bool | None = None,
 ) -> tuple[str, InlineKeyboardMarkup]:
-    tasks_state = await get_tasks_state(tg_id)
+    tasks_mask = await get_tasks_mask(tg_id)
     important = await get_important_tasks(tg_id)
     show_completed = show_completed if show_completed is not None else await get_focus_show_completed(tg_id)
-    return build_focus(tasks_state, exp, important, focus_task_id, show_completed)
+    return build_focus(tasks_mask, exp, important, focus_task_id, show_completed)
 
 SMARTLINKS_PAGE_SIZE = 5
 SUPPORT_DONATE_PRICE = 50
@@ -650,154 +997,10 @@ async def get_owned_smartlink(tg_id: int, smartlink_id: int) -> dict | None:
     if not smartlink or smartlink.get("owner_tg_id") != tg_id:
         return None
     return smartlink
-async def get_spotify_access_token() -> str | None:
-    global _SPOTIFY_ACCESS_TOKEN, _SPOTIFY_TOKEN_EXPIRES_AT
-
-    if not SPOTIFY_UPC_ENABLED:
-        return None
-
-    now = dt.datetime.utcnow()
-    if _SPOTIFY_ACCESS_TOKEN and _SPOTIFY_TOKEN_EXPIRES_AT and _SPOTIFY_TOKEN_EXPIRES_AT > now:
-        return _SPOTIFY_ACCESS_TOKEN
-
-    timeout = aiohttp.ClientTimeout(total=10)
-    try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(
-                "https://accounts.spotify.com/api/token",
-                data={"grant_type": "client_credentials"},
-                auth=aiohttp.BasicAuth(SPOTIFY_CLIENT_ID or "", SPOTIFY_CLIENT_SECRET or ""),
-            ) as resp:
-                if resp.status >= 400:
-                    return None
-                payload = await resp.json()
-                token = payload.get("access_token")
-                expires_in = int(payload.get("expires_in", 3600))
-                if not token:
-                    return None
-                _SPOTIFY_ACCESS_TOKEN = token
-                _SPOTIFY_TOKEN_EXPIRES_AT = now + dt.timedelta(seconds=max(expires_in - 30, 0))
-                return token
-    except Exception:
-        return None
-
-    return None
 
 
 async def spotify_search_upc(upc: str) -> list[dict[str, str]]:
-    token = await get_spotify_access_token()
-    if not token:
-        return []
-
-    timeout = aiohttp.ClientTimeout(total=10)
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {"q": f"upc:{upc}", "type": "album,track", "limit": 5}
-    candidates: list[dict[str, str]] = []
-    seen_urls: set[str] = set()
-
-    def add_candidate(title: str, artists: list[dict] | list[str], url: str | None):
-        if not url or url in seen_urls:
-            return
-        artist_names_list: list[str] = []
-        for a in artists:
-            name = a.get("name") if isinstance(a, dict) else str(a)
-            if name:
-                artist_names_list.append(name)
-        artist_names = ", ".join(artist_names_list)
-        candidates.append({"artist": artist_names, "title": title, "spotify_url": url})
-        seen_urls.add(url)
-
-    try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get("https://api.spotify.com/v1/search", headers=headers, params=params) as resp:
-                if resp.status >= 400:
-                    return []
-                data = await resp.json()
-    except Exception:
-        return []
-
-    for item in data.get("albums", {}).get("items", []) or []:
-        add_candidate(item.get("name", ""), item.get("artists", []), (item.get("external_urls") or {}).get("spotify"))
-
-    for item in data.get("tracks", {}).get("items", []) or []:
-        add_candidate(item.get("name", ""), item.get("artists", []), (item.get("external_urls") or {}).get("spotify"))
-
-    return candidates
-
-
-def _allowed_music_platform(host: str, path: str, query: dict[str, str]) -> str | None:
-    if "band.link" in host:
-        return "bandlink"
-    if host.startswith("music.yandex.") and ("/track/" in path or "/album/" in path):
-        return "yandex"
-    if host == "open.spotify.com":
-        return "spotify"
-    if host == "music.apple.com":
-        return "apple"
-    if host == "itunes.apple.com":
-        return "itunes"
-    if host in {"music.vk.com", "music.vk.ru"}:
-        return "vk"
-    if host == "vk.com" and (
-        path.startswith("/music") or path.startswith("/link/")
-    ) and not any(path.startswith(prefix) for prefix in {"/away", "/share", "/login", "/terms"}):
-        return "vk"
-    if host == "deezer.com" and any(path.startswith(prefix) for prefix in {"/track/", "/album/", "/playlist/", "/artist/"}):
-        return "deezer"
-    if host in {"youtube.com", "m.youtube.com"}:
-        if path.startswith("/watch") and query.get("v"):
-            return "youtube"
-        if path.startswith("/shorts/"):
-            return "youtube"
-    if host == "youtu.be" and path.strip("/"):
-        return "youtube"
-    if host == "music.youtube.com":
-        if path.startswith("/watch") and query.get("v"):
-            return "youtubemusic"
-        if path.startswith("/browse/MPRE"):
-            return "youtubemusic"
-    if host == "zvuk.com" and any(
-        path.startswith(prefix)
-        for prefix in {"/album/", "/artist/", "/track/", "/playlist/", "/release/"}
-    ):
-        return "zvuk"
-    if host.startswith("kion.") or host == "kion.ru" or host.startswith("music.kion."):
-        return "kion"
-    return None
-
-
-def _normalize_music_url(url: str, platform_hint: str | None = None) -> str:
-    normalized, _ = normalize_music_url_with_platform(url, platform_hint)
-    return normalized
-
-
-def normalize_music_url_with_platform(url: str, platform_hint: str | None = None) -> tuple[str, str | None]:
-    parsed = urlparse(url.strip())
-    if parsed.scheme not in {"http", "https"}:
-        return "", None
-    cleaned_query_pairs = [
-        (k, v)
-        for k, v in parse_qsl(parsed.query, keep_blank_values=True)
-        if not k.lower().startswith("utm_")
-    ]
-    query_dict = {k: v for k, v in cleaned_query_pairs}
-    host = parsed.netloc.lower()
-    if host.startswith("www."):
-        host = host[4:]
-    path = parsed.path or "/"
-
-    platform = _normalize_platform_key(platform_hint) if platform_hint else None
-    platform = platform or _allowed_music_platform(host, path, query_dict)
-    if not platform:
-        return "", None
-
-    normalized_url = urlunparse(parsed._replace(netloc=host, query=urlencode(cleaned_query_pairs), fragment=""))
-    return normalized_url, platform
-
-
-def detect_platform(url: str) -> str | None:
-    _, platform = normalize_music_url_with_platform(url)
-    return platform
+    return await SPOTIFY.search_upc(upc)
 
 
 def platform_label(platform: str) -> str:
@@ -822,154 +1025,6 @@ def filter_human_sources(sources: dict[str, dict]) -> dict[str, dict]:
     return filtered
 
 
-def _normalize_platform_key(value: str | None) -> str | None:
-    if not value:
-        return None
-    cleaned = re.sub(r"[^a-zA-Z]", "", value).lower()
-    if not cleaned:
-        return None
-    if cleaned in {"youtubemusic", "ytmusic"}:
-        cleaned = "youtubemusic"
-    if cleaned == "deezer":
-        return "deezer"
-    return SONGLINK_PLATFORM_ALIASES.get(cleaned, cleaned)
-
-
-def _collect_metadata_fields(candidate: dict, meta_acc: dict[str, set[str]]):
-    for key, val in candidate.items():
-        if not isinstance(val, str):
-            continue
-        lowered_key = key.lower()
-        if lowered_key in {"artist", "artistname", "artist_name"} or lowered_key.endswith("artist"):
-            if val.strip():
-                meta_acc.setdefault("artist", set()).add(val.strip())
-        if lowered_key in {"title", "track", "song", "name"} and not lowered_key.endswith("url"):
-            if val.strip():
-                meta_acc.setdefault("title", set()).add(val.strip())
-        if "cover" in lowered_key or "image" in lowered_key or "thumbnail" in lowered_key or "artwork" in lowered_key:
-            if val.strip().startswith("http"):
-                meta_acc.setdefault("cover_url", set()).add(val.strip())
-
-
-def parse_bandlink(html_content: str) -> tuple[dict[str, str], dict | None]:
-    links: dict[str, str] = {}
-    meta: dict | None = None
-    meta_candidates: dict[str, set[str]] = {}
-
-    soup = BeautifulSoup(html_content or "", "html.parser")
-
-    next_script = soup.find("script", id="__NEXT_DATA__")
-    if next_script and next_script.string:
-        try:
-            next_data_raw = html.unescape(next_script.string)
-            next_data = json.loads(next_data_raw)
-            print("[bandlink] __NEXT_DATA__ found")
-        except Exception as e:
-            print(f"[bandlink] failed to parse __NEXT_DATA__: {e}")
-            next_data = None
-    else:
-        print("[bandlink] __NEXT_DATA__ not found")
-        next_data = None
-
-    def add_link(url: str | None, platform_hint: str | None = None):
-        if not url:
-            return
-        normalized_url, platform = normalize_music_url_with_platform(url, platform_hint)
-        if not normalized_url or not platform:
-            return
-        if platform and platform not in links:
-            links[platform] = normalized_url
-
-    def process_service(service: dict):
-        if not isinstance(service, dict):
-            return
-        add_link(
-            service.get("href")
-            or service.get("url")
-            or service.get("link")
-            or (service.get("action") or {}).get("url"),
-            service.get("platform")
-            or service.get("service")
-            or service.get("type")
-            or service.get("id")
-            or service.get("name"),
-        )
-        _collect_metadata_fields(service, meta_candidates)
-
-    def walk(node):
-        if isinstance(node, dict):
-            for key, value in node.items():
-                lowered = key.lower()
-                if isinstance(value, list) and lowered in {"services", "links", "platforms", "buttons"}:
-                    for item in value:
-                        if isinstance(item, dict):
-                            process_service(item)
-                elif isinstance(value, dict):
-                    process_service(value)
-                walk(value)
-        elif isinstance(node, list):
-            for item in node:
-                walk(item)
-
-    if next_data:
-        walk(next_data.get("props") or next_data.get("pageProps") or next_data)
-
-    for script in soup.find_all("script"):
-        content_type = (script.get("type") or "").lower()
-        if "json" not in content_type and script.get("id") != "__NEXT_DATA__":
-            continue
-        raw = script.string or ""
-        if not raw.strip():
-            continue
-        try:
-            data_blob = json.loads(raw)
-        except Exception:
-            continue
-        walk(data_blob)
-
-    if not links or len(links) < 3:
-        extracted_links = extract_links_from_bandlink(html_content, soup=soup)
-        for platform_key, href in extracted_links.items():
-            add_link(href, platform_key)
-
-    if not links:
-        legacy_links = extract_links_from_bandlink(html_content, soup=soup)
-        if legacy_links:
-            print(f"[bandlink] legacy href parser extracted {len(legacy_links)} platforms")
-            links.update(legacy_links)
-
-    og_title_match = re.search(r'<meta[^>]+property=\"og:title\"[^>]+content=\"([^\"]+)\"', html_content, re.IGNORECASE)
-    og_image_match = re.search(r'<meta[^>]+property=\"og:image\"[^>]+content=\"([^\"]+)\"', html_content, re.IGNORECASE)
-    if og_title_match:
-        title_raw = html.unescape(og_title_match.group(1)).strip()
-        if " - " in title_raw and not meta_candidates.get("artist"):
-            artist_val, title_val = title_raw.split(" - ", 1)
-            meta_candidates.setdefault("artist", set()).add(artist_val.strip())
-            meta_candidates.setdefault("title", set()).add(title_val.strip())
-        else:
-            meta_candidates.setdefault("title", set()).add(title_raw)
-    if og_image_match:
-        image_val = html.unescape(og_image_match.group(1)).strip()
-        meta_candidates.setdefault("cover_url", set()).add(image_val)
-
-    artist = next(iter(meta_candidates.get("artist", [])), "")
-    title = next(iter(meta_candidates.get("title", [])), "")
-    cover_url = next(iter(meta_candidates.get("cover_url", [])), "")
-
-    if artist or title or cover_url:
-        meta = {
-            "artist": artist,
-            "title": title,
-            "cover_url": cover_url,
-            "source_platform": "bandlink",
-            "preferred_source": "bandlink",
-            "sources": {"bandlink": {"artist": artist, "title": title, "cover_url": cover_url}},
-            "conflict": False,
-        }
-
-    print(f"[bandlink] extracted {len(links)} platforms; meta={'yes' if meta else 'no'}")
-    return links, meta
-
 
 async def resolve_links(url: str) -> tuple[dict[str, str], dict | None]:
     timeout = aiohttp.ClientTimeout(total=10)
@@ -994,7 +1049,9 @@ async def resolve_links(url: str) -> tuple[dict[str, str], dict | None]:
             return SONGLINK_PLATFORM_ALIASES.get(platform.lower()) if platform else None
 
         try:
-            async with aiohttp.ClientSession(timeout=timeout, headers={"User-Agent": BANDLINK_USER_AGENT}) as session:
+            async with aiohttp.ClientSession(
+                timeout=timeout, headers={"User-Agent": BANDLINK_USER_AGENT}, trace_configs=[http_trace("songlink")]
+            ) as session:
                 async with session.get(SONGLINK_API_URL, params={"url": url}) as resp:
                     if resp.status != 200:
                         return {}, {}
@@ -1071,7 +1128,7 @@ async def resolve_links(url: str) -> tuple[dict[str, str], dict | None]:
 
     if detected == "bandlink":
         html_content = await fetch_bandlink_html(url) or ""
-        band_links, band_meta = parse_bandlink(html_content)
+        band_links, band_meta = await parse_bandlink_async(html_content)
         links.update(band_links)
         metadata = merge_metadata(metadata, band_meta)
 
@@ -1129,44 +1186,6 @@ def merge_metadata(existing: dict | None, new: dict | None) -> dict:
     return merged
 
 
-def extract_links_from_bandlink(html_content: str, soup: BeautifulSoup | None = None) -> dict[str, str]:
-    links: dict[str, str] = {}
-    soup = soup or BeautifulSoup(html_content or "", "html.parser")
-
-    for a_tag in soup.find_all("a"):
-        href = a_tag.get("href") or ""
-        if not href:
-            continue
-        platform_hint = (
-            a_tag.get("data-platform")
-            or a_tag.get("data-service")
-            or a_tag.get("data-provider")
-            or None
-        )
-        class_tokens = {cls.lower() for cls in (a_tag.get("class") or []) if cls}
-        if not platform_hint:
-            for token in class_tokens:
-                if token in {
-                    "yandex",
-                    "vk",
-                    "spotify",
-                    "apple",
-                    "itunes",
-                    "zvuk",
-                    "kion",
-                    "youtube",
-                    "youtubemusic",
-                    "deezer",
-                }:
-                    platform_hint = token
-                    break
-        normalized, platform = normalize_music_url_with_platform(html.unescape(href), platform_hint)
-        if not normalized or not platform:
-            continue
-        if platform not in links:
-            links[platform] = normalized
-    return links
-
 
 async def fetch_bandlink_html(url: str) -> str | None:
     timeout = aiohttp.ClientTimeout(total=20)
@@ -1177,11 +1196,24 @@ async def fetch_bandlink_html(url: str) -> str | None:
         "Cache-Control": "no-cache",
     }
     try:
-        async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
+        async with aiohttp.ClientSession(
+            timeout=timeout, headers=headers, trace_configs=[http_trace("bandlink")]
+        ) as session:
             async with session.get(url, allow_redirects=True) as resp:
                 if resp.status >= 400:
                     return None
-                return await resp.text()
+                if resp.content_length and resp.content_length > BANDLINK_MAX_HTML_BYTES:
+                    print(f"[bandlink] page too large: {resp.content_length} bytes url={url}")
+                    return None
+                chunks: list[bytes] = []
+                received = 0
+                async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > BANDLINK_MAX_HTML_BYTES:
+                        print(f"[bandlink] page exceeded {BANDLINK_MAX_HTML_BYTES} bytes url={url}")
+                        return None
+                    chunks.append(chunk)
+                return b"".join(chunks).decode(resp.charset or "utf-8", errors="replace")
     except Exception:
         return None
 
@@ -1195,7 +1227,7 @@ async def refresh_smartlink_links_from_bandlink(smartlink: dict) -> dict[str, st
     if not html_content:
         raise RuntimeError("bandlink_fetch_failed")
 
-    links, _ = parse_bandlink(html_content)
+    links, _ = await parse_bandlink_async(html_content)
     filtered_links = {k: v for k, v in links.items() if k in BANDLINK_REFRESH_PLATFORMS}
     if not filtered_links:
         return smartlink.get("links") or {}
@@ -1436,24 +1468,55 @@ async def finalize_smartlink_form(message: Message, tg_id: int, data: dict):
         await form_clear(tg_id)
 
 
-async def fetch_cover_file(cover_url: str) -> BufferedInputFile | None:
+class CoverStream(InputFile):
+    """Cover download streamed straight into the Telegram upload, capped at COVER_MAX_BYTES."""
+
+    def __init__(self, session: aiohttp.ClientSession, resp: aiohttp.ClientResponse, filename: str):
+        super().__init__(filename=filename, chunk_size=DOWNLOAD_CHUNK_SIZE)
+        self._session = session
+        self._resp = resp
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.content_hash: str | None = None
+
+    async def read(self, bot: Bot):
+        async for chunk in self._resp.content.iter_chunked(self.chunk_size):
+            self.size += len(chunk)
+            if self.size > COVER_MAX_BYTES:
+                raise ValueError(f"cover exceeded {COVER_MAX_BYTES} bytes")
+            self._sha256.update(chunk)
+            yield chunk
+        if not self.size:
+            raise ValueError("cover is empty")
+        self.content_hash = self._sha256.hexdigest()
+
+    async def close(self):
+        self._resp.release()
+        await self._session.close()
+
+
+async def fetch_cover_file(cover_url: str) -> CoverStream | None:
+    """Open the cover response; the caller uploads it and must close() it afterwards."""
     if not cover_url:
         return None
     timeout = aiohttp.ClientTimeout(total=10)
+    session = aiohttp.ClientSession(timeout=timeout, trace_configs=[http_trace("covers")])
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(cover_url) as resp:
-                if resp.status >= 400:
-                    print(f"[cover] failed to fetch {cover_url}: status {resp.status}")
-                    return None
-                data = await resp.read()
-                if not data:
-                    return None
-                filename = cover_url.split("/")[-1] or "cover.jpg"
-                return BufferedInputFile(data, filename=filename)
+        resp = await session.get(cover_url)
+        if resp.status >= 400:
+            print(f"[cover] failed to fetch {cover_url}: status {resp.status}")
+        elif resp.content_length == 0:
+            pass
+        elif resp.content_length and resp.content_length > COVER_MAX_BYTES:
+            print(f"[cover] too large {cover_url}: {resp.content_length} bytes")
+        else:
+            filename = cover_url.split("/")[-1] or "cover.jpg"
+            return CoverStream(session, resp, filename)
+        resp.release()
     except Exception as e:
         print(f"[cover] error fetching {cover_url}: {e}")
-        return None
+    await session.close()
+    return None
 
 
 async def show_import_confirmation(
@@ -1510,26 +1573,44 @@ async def show_import_confirmation(
         kb.inline_keyboard.insert(0, source_row)
 
     cover_source = selected_meta.get("cover_url") or cover_file_id
+    preview_text = "\n".join(caption_lines)
     preview_message: Message | None = None
     if cover_source:
-        try:
-            input_file = await fetch_cover_file(cover_source)
-        except Exception:
+        cached_file_id = await get_cached_cover(cover_source)
+        if cached_file_id:
+            try:
+                preview_message = await message.answer_photo(
+                    photo=cached_file_id, caption=preview_text, reply_markup=kb
+                )
+            except Exception as e:
+                # Telegram forgot the file_id: upload the cover again below.
+                print(f"[cover] cached file_id rejected, uploading again: {e}")
+                await delete_cached_cover(cover_source)
+        if not preview_message:
             input_file = None
-        try:
-            preview_message = await message.answer_photo(
-                photo=input_file or cover_source,
-                caption="\n".join(caption_lines),
-                reply_markup=kb,
-            )
-            if input_file:
-                print(f"[cover] downloaded cover from {cover_source}")
-        except Exception as e:
-            print(f"[cover] failed to show preview: {e}")
-            preview_message = None
+            try:
+                input_file = await fetch_cover_file(cover_source)
+            except Exception:
+                input_file = None
+            try:
+                preview_message = await message.answer_photo(
+                    photo=input_file or cover_source,
+                    caption=preview_text,
+                    reply_markup=kb,
+                )
+                if input_file:
+                    print(f"[cover] downloaded cover from {cover_source}")
+                    if preview_message.photo:
+                        await save_cached_cover(cover_source, input_file.content_hash, preview_message.photo[-1].file_id)
+            except Exception as e:
+                print(f"[cover] failed to show preview: {e}")
+                preview_message = None
+            finally:
+                if input_file:
+                    await input_file.close()
 
     if not preview_message:
-        preview_message = await message.answer("\n".join(caption_lines), reply_markup=kb)
+        preview_message = await message.answer(preview_text, reply_markup=kb)
 
     if preview_message.photo:
         cover_file_id = preview_message.photo[-1].file_id
@@ -2103,8 +2184,8 @@ async def rb_plan(message: Message):
 async def rb_sections(message: Message):
     tg_id = message.from_user.id
     await ensure_user(tg_id, message.from_user.username)
-    tasks_state = await get_tasks_state(tg_id)
-    text, kb = build_sections_menu(tasks_state)
+    tasks_mask = await get_tasks_mask(tg_id)
+    text, kb = build_sections_menu(tasks_mask)
     await message.answer(text, reply_markup=kb)
 
 @dp.message(F.text == "👤 Кабинеты")
@@ -2251,6 +2332,17 @@ async def pre_checkout(pre_checkout_q: PreCheckoutQuery, bot: Bot):
 @dp.message(F.successful_payment)
 async def successful_payment(message: Message):
     sp = message.successful_payment
+    # The same charge must never unlock or answer twice, even if it arrives in another update.
+    if not await claim_payment_charge(sp.telegram_payment_charge_id, message.from_user.id):
+        logger.warning("Payment %s already processed", sp.telegram_payment_charge_id)
+        return
+    try:
+        await process_successful_payment(message, sp)
+    except Exception:
+        await release_payment_charge(sp.telegram_payment_charge_id)
+        raise
+
+async def process_successful_payment(message: Message, sp: SuccessfulPayment):
     # sp.currency для Stars будет "XTR" :contentReference[oaicite:2]{index=2}
     if (sp.invoice_payload or "").startswith("donate_iskra_"):
         await message.answer("💫 Принято! Спасибо за поддержку ИСКРЫ 🤝", reply_markup=await user_menu_keyboard(message.from_user.id))
@@ -2316,13 +2408,10 @@ async def focus_done_cb(callback):
         await callback.answer()
         return
     task_id = int(callback.data.split(":")[1])
-    tasks_state = await get_tasks_state(tg_id)
-    was_done = tasks_state.get(task_id, 0) == 1
-    await set_task_done(tg_id, task_id, 0 if was_done else 1)
-    tasks_state = await get_tasks_state(tg_id)
+    tasks_mask = await toggle_task_mask(tg_id, task_id)
     important = await get_important_tasks(tg_id)
     show_completed = await get_focus_show_completed(tg_id)
-    text, kb = build_focus(tasks_state, exp, important, show_completed=show_completed)
+    text, kb = build_focus(tasks_mask, exp, important, show_completed=show_completed)
     await safe_edit(callback.message, text, kb)
     await callback.answer("Ок")
 
@@ -2337,9 +2426,7 @@ async def focus_toggle_completed_cb(callback):
         await callback.message.answer(text, reply_markup=kb)
         await callback.answer()
         return
-    current = await get_focus_show_completed(tg_id)
-    new_value = not current
-    await set_focus_show_completed(tg_id, new_value)
+    new_value = await toggle_focus_show_completed(tg_id)
     text, kb = await build_focus_for_user(tg_id, exp, show_completed=new_value)
     await safe_edit(callback.message, text, kb)
     await callback.answer("Обновил фокус")
@@ -2372,8 +2459,8 @@ async def qc_answer_cb(callback):
 async def sections_open_cb(callback):
     tg_id = callback.from_user.id
     await ensure_user(tg_id)
-    tasks_state = await get_tasks_state(tg_id)
-    text, kb = build_sections_menu(tasks_state)
+    tasks_mask = await get_tasks_mask(tg_id)
+    text, kb = build_sections_menu(tasks_mask)
     await safe_edit(callback.message, text, kb)
     await callback.answer()
 
@@ -2383,8 +2470,8 @@ async def section_page_cb(callback):
     await ensure_user(tg_id)
     _, sid, page_s = callback.data.split(":")
     page = int(page_s)
-    tasks_state = await get_tasks_state(tg_id)
-    text, kb = build_section_page(tasks_state, sid, page)
+    tasks_mask = await get_tasks_mask(tg_id)
+    text, kb = build_section_page(tasks_mask, sid, page)
     await safe_edit(callback.message, text, kb)
     await callback.answer()
 
@@ -2397,8 +2484,8 @@ async def section_toggle_cb(callback):
     page = int(page_s)
     task_id = int(tid_s)
 
-    tasks_state = await toggle_task_and_get_state(tg_id, task_id)
-    text, kb = build_section_page(tasks_state, sid, page)
+    tasks_mask = await toggle_task_mask(tg_id, task_id)
+    text, kb = build_section_page(tasks_mask, sid, page)
     await safe_edit(callback.message, text, kb)
     await callback.answer("Ок")
 
@@ -2419,8 +2506,7 @@ async def accounts_cycle_cb(callback):
     if key not in [k for k, _ in ACCOUNTS]:
         await callback.answer("Неизвестный пункт", show_alert=True)
         return
-    await cycle_account_status(tg_id, key)
-    state = await get_accounts_state(tg_id)
+    state = await cycle_account_status(tg_id, key)
     text, kb = build_accounts_checklist(state)
     await safe_edit(callback.message, text, kb)
     await callback.answer("Ок")
@@ -2441,8 +2527,7 @@ async def timeline_cb(callback):
 async def reminders_toggle_cb(callback):
     tg_id = callback.from_user.id
     await ensure_user(tg_id)
-    new_state = await toggle_reminders_enabled(tg_id)
-    rd = await get_release_date(tg_id)
+    new_state, rd = await toggle_reminders_and_get_release_date(tg_id)
     d = parse_date(rd) if rd else None
     kb = build_timeline_kb(new_state, has_date=bool(d))
     await safe_edit(callback.message, timeline_text(d, new_state), kb)
@@ -2479,6 +2564,14 @@ async def smartlinks_create_cb(callback):
     await callback.answer()
 
 
+@dp.callback_query(F.data == "smartlinks:bulk")
+async def smartlinks_bulk_cb(callback):
+    tg_id = callback.from_user.id
+    await ensure_user(tg_id)
+    await start_smartlink_bulk_import(callback.message, tg_id)
+    await callback.answer()
+
+
 @dp.callback_query(F.data == "smartlinks:help")
 async def smartlinks_help_cb(callback):
     await callback.message.answer(smartlinks_help_text(), reply_markup=smartlinks_menu_kb())
@@ -3408,9 +3501,9 @@ async def reset_menu_cb(callback):
 async def important_list_cb(callback):
     tg_id = callback.from_user.id
     await ensure_user(tg_id)
-    tasks_state = await get_tasks_state(tg_id)
+    tasks_mask = await get_tasks_mask(tg_id)
     important = await get_important_tasks(tg_id)
-    text, kb = build_important_screen(tasks_state, important)
+    text, kb = build_important_screen(tasks_mask, important)
     await safe_edit(callback.message, text, kb)
     await callback.answer()
 
@@ -3420,13 +3513,13 @@ async def important_toggle_cb(callback):
     await ensure_user(tg_id)
     task_id = int(callback.data.split(":")[2])
     important = await toggle_important_task(tg_id, task_id)
-    tasks_state = await get_tasks_state(tg_id)
-    exp = await get_experience(tg_id)
+    tasks_mask = await get_tasks_mask(tg_id)
     if callback.message.text and callback.message.text.startswith("🔥 Важное"):
-        text, kb = build_important_screen(tasks_state, important)
+        text, kb = build_important_screen(tasks_mask, important)
     else:
+        exp = await get_experience(tg_id)
         show_completed = await get_focus_show_completed(tg_id)
-        text, kb = build_focus(tasks_state, exp, important, show_completed=show_completed)
+        text, kb = build_focus(tasks_mask, exp, important, show_completed=show_completed)
     await safe_edit(callback.message, text, kb)
     await callback.answer("Обновил")
 
@@ -3506,582 +3599,624 @@ async def label_start_cb(callback):
 
 # -------------------- Form router --------------------
 
-@dp.message()
-async def any_message_router(message: Message):
-    tg_id = message.from_user.id
-    await ensure_user(tg_id, message.from_user.username)
+class FormStep(NamedTuple):
+    handler: Callable[[Message, int, dict, str], Awaitable[None]]
+    text_only: bool
 
-    form = await form_get(tg_id)
-    txt = (message.text or "").strip()
 
-    if not form:
-        if not txt or txt.startswith("/"):
-            return
+# form_name -> step handler. Handlers get the message, the owner, the form and the stripped text;
+# text_only forms ignore stickers, photos and commands before their handler runs.
+FORM_HANDLERS: dict[str, FormStep] = {}
 
-        exp = await get_experience(tg_id)
-        if exp == "unknown":
-            lower = txt.lower()
-            inferred: str | None = None
-            if "уже" in lower or "не первый" in lower:
-                inferred = "old"
-            elif "перв" in lower:
-                inferred = "first"
-
-            if not inferred:
-                text, kb = experience_prompt()
-                await message.answer(text, reply_markup=kb)
-                return
 
-            await set_experience(tg_id, inferred)
-            await message.answer("Ок. Меню снизу, держу фокус здесь:", reply_markup=await user_menu_keyboard(tg_id))
-            focus_text, kb = await build_focus_for_user(tg_id, inferred)
-            await message.answer(focus_text, reply_markup=kb)
-            return
-        return
+def form_handler(form_name: str, *, text_only: bool = False):
+    def decorator(fn):
+        FORM_HANDLERS[form_name] = FormStep(fn, text_only)
+        return fn
+    return decorator
 
-    form_name = form.get("form_name")
-    if form_name == "donate_custom":
-        if not txt.isdigit():
-            await message.answer(
-                "Нужна целая сумма в Stars. Попробуй ещё раз.",
-                reply_markup=await user_menu_keyboard(tg_id),
-            )
-            return
-        stars = int(txt)
-        if stars < DONATE_MIN_STARS or stars > DONATE_MAX_STARS:
-            await message.answer(
-                f"Минимум {DONATE_MIN_STARS} ⭐. Максимум {DONATE_MAX_STARS} ⭐.",
-                reply_markup=await user_menu_keyboard(tg_id),
-            )
-            return
-        await form_clear(tg_id)
-        await send_donate_invoice(message, stars)
+
+async def handle_no_form_message(message: Message, tg_id: int, txt: str):
+    exp = await get_experience(tg_id)
+    if exp != "unknown":
+        return
+    lower = txt.lower()
+    inferred: str | None = None
+    if "уже" in lower or "не первый" in lower:
+        inferred = "old"
+    elif "перв" in lower:
+        inferred = "first"
+
+    if not inferred:
+        text, kb = experience_prompt()
+        await message.answer(text, reply_markup=kb)
         return
 
-    if form_name == "smartlink_upc":
-        digits = re.sub(r"\D", "", txt)
-        if not re.fullmatch(r"\d{12,14}", digits):
-            await message.answer(
-                "Нужен UPC: 12–14 цифр. Пришли номер ещё раз.\n\n(Отмена: /cancel)",
-                reply_markup=await user_menu_keyboard(tg_id),
-            )
-            return
+    await set_experience(tg_id, inferred)
+    await message.answer("Ок. Меню снизу, держу фокус здесь:", reply_markup=await user_menu_keyboard(tg_id))
+    focus_text, kb = await build_focus_for_user(tg_id, inferred)
+    await message.answer(focus_text, reply_markup=kb)
 
-        results = await spotify_search_upc(digits)
-        if not results:
-            await message.answer(
-                "Не нашёл, попробуй BandLink или вставь ссылки вручную. Можешь прислать другой UPC.",
-                reply_markup=await user_menu_keyboard(tg_id),
-            )
-            return
 
-        await form_set(tg_id, 1, {"upc": digits, "candidates": results})
-        if len(results) == 1:
-            candidate = results[0]
-            kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="✅ Подтвердить", callback_data="smartlink:upc_pick:0")],
-                    [InlineKeyboardButton(text="Отмена", callback_data="smartlink:upc_cancel")],
-                ]
-            )
-            await message.answer(
-                f"Нашёл: {candidate.get('artist') or 'Без артиста'} — {candidate.get('title') or ''}\n"
-                f"{candidate.get('spotify_url', '')}\n\nПодтверждаешь?",
-                reply_markup=kb,
-            )
-        else:
-            rows = []
-            for idx, candidate in enumerate(results):
-                label = f"{candidate.get('artist') or ''} — {candidate.get('title') or ''}".strip(" —")
-                if len(label) > 60:
-                    label = label[:57] + "…"
-                if not label:
-                    label = f"Вариант {idx + 1}"
-                rows.append([InlineKeyboardButton(text=label, callback_data=f"smartlink:upc_pick:{idx}")])
-            rows.append([InlineKeyboardButton(text="Отмена", callback_data="smartlink:upc_cancel")])
-            await message.answer(
-                "Выбери релиз по UPC:",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=rows),
-            )
+@form_handler("donate_custom")
+async def donate_custom_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    if not txt.isdigit():
+        await message.answer(
+            "Нужна целая сумма в Stars. Попробуй ещё раз.",
+            reply_markup=await user_menu_keyboard(tg_id),
+        )
         return
+    stars = int(txt)
+    if stars < DONATE_MIN_STARS or stars > DONATE_MAX_STARS:
+        await message.answer(
+            f"Минимум {DONATE_MIN_STARS} ⭐. Максимум {DONATE_MAX_STARS} ⭐.",
+            reply_markup=await user_menu_keyboard(tg_id),
+        )
+        return
+    await form_clear(tg_id)
+    await send_donate_invoice(message, stars)
 
-    if form_name == "smartlink_import":
-        if not re.match(r"https?://", txt):
-            await message.answer(
-                "Нужна ссылка (http/https).\n\nОтмена: /cancel",
-                reply_markup=await user_menu_keyboard(tg_id),
-            )
-            return
-
-        data = form.get("data") or {}
-        existing_links = data.get("links") or {}
-        existing_metadata = data.get("metadata") or {}
-        bandlink_help_shown = bool(data.get("bandlink_help_shown"))
-        low_links_hint_shown = bool(data.get("low_links_hint_shown"))
-
-        detected_platform = detect_platform(txt) or ""
-        if detected_platform and detected_platform != "bandlink":
-            await message.answer("Принял ссылку, пытаюсь найти релиз…", reply_markup=await user_menu_keyboard(tg_id))
 
-        links, metadata = await resolve_links(txt)
+@form_handler("smartlink_upc")
+async def smartlink_upc_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    digits = re.sub(r"\D", "", txt)
+    if not re.fullmatch(r"\d{12,14}", digits):
+        await message.answer(
+            "Нужен UPC: 12–14 цифр. Пришли номер ещё раз.\n\n(Отмена: /cancel)",
+            reply_markup=await user_menu_keyboard(tg_id),
+        )
+        return
 
-        merged_links = dict(existing_links)
-        added_platforms: list[str] = []
-        for platform_key, url in links.items():
-            if platform_key not in merged_links or merged_links[platform_key] != url:
-                merged_links[platform_key] = url
-                added_platforms.append(platform_key)
+    results = await spotify_search_upc(digits)
+    if not results:
+        await message.answer(
+            "Не нашёл, попробуй BandLink или вставь ссылки вручную. Можешь прислать другой UPC.",
+            reply_markup=await user_menu_keyboard(tg_id),
+        )
+        return
 
-        merged_metadata = merge_metadata(existing_metadata, metadata)
+    await form_set(tg_id, 1, {"upc": digits, "candidates": results})
+    if len(results) == 1:
+        candidate = results[0]
+        kb = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text="✅ Подтвердить", callback_data="smartlink:upc_pick:0")],
+                [InlineKeyboardButton(text="Отмена", callback_data="smartlink:upc_cancel")],
+            ]
+        )
+        await message.answer(
+            f"Нашёл: {candidate.get('artist') or 'Без артиста'} — {candidate.get('title') or ''}\n"
+            f"{candidate.get('spotify_url', '')}\n\nПодтверждаешь?",
+            reply_markup=kb,
+        )
+    else:
+        rows = []
+        for idx, candidate in enumerate(results):
+            label = f"{candidate.get('artist') or ''} — {candidate.get('title') or ''}".strip(" —")
+            if len(label) > 60:
+                label = label[:57] + "…"
+            if not label:
+                label = f"Вариант {idx + 1}"
+            rows.append([InlineKeyboardButton(text=label, callback_data=f"smartlink:upc_pick:{idx}")])
+        rows.append([InlineKeyboardButton(text="Отмена", callback_data="smartlink:upc_cancel")])
+        await message.answer(
+            "Выбери релиз по UPC:",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=rows),
+        )
 
-        key_links_count = sum(1 for p in KEY_PLATFORM_SET if merged_links.get(p))
 
-        if added_platforms:
-            added_labels = [platform_label(p) for p in added_platforms]
-            total_added = len(merged_links)
+@form_handler("smartlink_bulk_import")
+async def smartlink_bulk_import_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    raw = txt
+    if message.document:
+        raw = await read_bulk_import_document(message)
+        if raw is None:
             await message.answer(
-                f"Добавил площадки: {', '.join(added_labels)}. Всего: {total_added}",
+                f"Файл слишком большой: до {BULK_IMPORT_MAX_BYTES // 1024} КБ.\n\nОтмена: /cancel",
                 reply_markup=await user_menu_keyboard(tg_id),
             )
-
-        total = len(merged_links)
-        latest = await get_latest_smartlink(tg_id)
-        temp_data = {"metadata": merged_metadata, "preferred_source": merged_metadata.get("preferred_source")}
-        selected_meta = pick_selected_metadata(temp_data)
-        cover_source = selected_meta.get("cover_url") or (merged_metadata or {}).get("cover_url") or ""
-        cover_file_id = ""
-        if cover_source:
-            try:
-                input_file = await fetch_cover_file(cover_source)
-                if input_file:
-                    preview = await message.answer_photo(photo=input_file, caption="Загрузил обложку…")
-                    cover_file_id = preview.photo[-1].file_id if preview.photo else ""
-                    await preview.delete()
-            except Exception as e:
-                print(f"[cover] failed to auto download: {e}")
-
-        ready_for_autofill = (
-            not (merged_metadata or {}).get("conflict")
-            and bool(selected_meta.get("artist"))
-            and bool(selected_meta.get("title"))
-            and bool(cover_file_id)
-            and total >= 2
+            return
+    urls, codes = parse_bulk_import_entries(raw)
+    if not urls and not codes:
+        await message.answer(
+            "Не нашёл ссылок или кодов UPC/ISRC. Пришли список ещё раз.\n\nОтмена: /cancel",
+            reply_markup=await user_menu_keyboard(tg_id),
         )
+        return
+    if len(urls) + len(codes) > BULK_IMPORT_MAX_ITEMS:
+        await message.answer(
+            f"За раз можно импортировать до {BULK_IMPORT_MAX_ITEMS} релизов. Раздели список.\n\nОтмена: /cancel",
+            reply_markup=await user_menu_keyboard(tg_id),
+        )
+        return
+    await form_clear(tg_id)
+    await run_bulk_import(message, tg_id, urls, codes)
 
-        if ready_for_autofill:
-            data.update(
-                {
-                    "artist": selected_meta.get("artist", ""),
-                    "title": selected_meta.get("title", ""),
-                    "cover_file_id": cover_file_id,
-                    "links": merged_links,
-                    "metadata": merged_metadata,
-                    "preferred_source": merged_metadata.get("preferred_source"),
-                    "release_date": (latest or {}).get("release_date", ""),
-                    "caption_text": (latest or {}).get("caption_text", ""),
-                }
-            )
-            await form_start(tg_id, "smartlink_prefill_edit")
-            await form_set(tg_id, 0, data)
-            platforms_text = ", ".join(sorted(merged_links.keys())) if merged_links else "—"
-            summary_lines = [
-                "Нашёл ссылки и данные релиза:",
-                f"{data.get('artist') or 'Без артиста'} — {data.get('title') or 'Без названия'}",
-                f"Площадки: {platforms_text}",
-                "Карточку заполнил автоматически.",
-            ]
-            kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="Продолжить", callback_data="smartlink:prefill_continue")],
-                    [InlineKeyboardButton(text="✏️ Изменить данные", callback_data="smartlink:import_edit")],
-                    [InlineKeyboardButton(text="Отмена", callback_data="smartlink:import_cancel")],
-                ]
-            )
-            try:
-                await message.answer_photo(photo=cover_file_id, caption="\n".join(summary_lines), reply_markup=kb)
-            except Exception:
-                await message.answer("\n".join(summary_lines), reply_markup=kb)
-            return
 
-        meta_complete = bool((merged_metadata or {}).get("artist") and (merged_metadata or {}).get("title"))
+@form_handler("smartlink_import")
+async def smartlink_import_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    if not re.match(r"https?://", txt):
+        await message.answer(
+            "Нужна ссылка (http/https).\n\nОтмена: /cancel",
+            reply_markup=await user_menu_keyboard(tg_id),
+        )
+        return
 
-        if key_links_count < 3 and not low_links_hint_shown:
-            data["low_links_hint_shown"] = True
-            await form_set(tg_id, form.get("step", 0) or 0, data)
-            await message.answer(
-                "Ссылок мало. Можешь прислать Яндекс или VK — доберу остальные.",
-                reply_markup=await user_menu_keyboard(tg_id),
-            )
+    data = form.get("data") or {}
+    existing_links = data.get("links") or {}
+    existing_metadata = data.get("metadata") or {}
+    bandlink_help_shown = bool(data.get("bandlink_help_shown"))
+    low_links_hint_shown = bool(data.get("low_links_hint_shown"))
 
-        if total >= 2 and meta_complete:
-            await show_import_confirmation(message, tg_id, merged_links, merged_metadata, latest)
-            return
+    detected_platform = detect_platform(txt) or ""
+    if detected_platform and detected_platform != "bandlink":
+        await message.answer("Принял ссылку, пытаюсь найти релиз…", reply_markup=await user_menu_keyboard(tg_id))
 
-        if meta_complete:
-            await show_import_confirmation(message, tg_id, merged_links, merged_metadata, latest)
-            return
+    links, metadata = await resolve_links(txt)
 
-        if total >= 2:
-            await show_import_confirmation(message, tg_id, merged_links, merged_metadata, latest)
-            return
+    merged_links = dict(existing_links)
+    added_platforms: list[str] = []
+    for platform_key, url in links.items():
+        if platform_key not in merged_links or merged_links[platform_key] != url:
+            merged_links[platform_key] = url
+            added_platforms.append(platform_key)
 
-        data.update({
-            "links": merged_links,
-            "metadata": merged_metadata,
-            "bandlink_help_shown": bandlink_help_shown,
-            "low_links_hint_shown": data.get("low_links_hint_shown", False),
-        })
-        await form_set(tg_id, form.get("step", 0) or 0, data)
+    merged_metadata = merge_metadata(existing_metadata, metadata)
 
-        failure = total <= 1 and not meta_complete
-        if detected_platform == "bandlink" and not bandlink_help_shown and failure:
-            data["bandlink_help_shown"] = True
-            await form_set(tg_id, form.get("step", 0) or 0, data)
-            await message.answer(
-                RESOLVER_FALLBACK_TEXT,
-                reply_markup=await user_menu_keyboard(tg_id),
-            )
-            return
+    key_links_count = sum(1 for p in KEY_PLATFORM_SET if merged_links.get(p))
 
+    if added_platforms:
+        added_labels = [platform_label(p) for p in added_platforms]
+        total_added = len(merged_links)
         await message.answer(
-            "Не нашёл остальные площадки, пришли ссылку другой платформы.",
+            f"Добавил площадки: {', '.join(added_labels)}. Всего: {total_added}",
             reply_markup=await user_menu_keyboard(tg_id),
         )
+
+    total = len(merged_links)
+    latest = await get_latest_smartlink(tg_id)
+    temp_data = {"metadata": merged_metadata, "preferred_source": merged_metadata.get("preferred_source")}
+    selected_meta = pick_selected_metadata(temp_data)
+    cover_source = selected_meta.get("cover_url") or (merged_metadata or {}).get("cover_url") or ""
+    cover_file_id = (await get_cached_cover(cover_source) or "") if cover_source else ""
+    if cover_source and not cover_file_id:
+        input_file = None
+        try:
+            input_file = await fetch_cover_file(cover_source)
+            if input_file:
+                preview = await message.answer_photo(photo=input_file, caption="Загрузил обложку…")
+                cover_file_id = preview.photo[-1].file_id if preview.photo else ""
+                if cover_file_id:
+                    await save_cached_cover(cover_source, input_file.content_hash, cover_file_id)
+                await preview.delete()
+        except Exception as e:
+            print(f"[cover] failed to auto download: {e}")
+        finally:
+            if input_file:
+                await input_file.close()
+
+    ready_for_autofill = (
+        not (merged_metadata or {}).get("conflict")
+        and bool(selected_meta.get("artist"))
+        and bool(selected_meta.get("title"))
+        and bool(cover_file_id)
+        and total >= 2
+    )
+
+    if ready_for_autofill:
+        data.update(
+            {
+                "artist": selected_meta.get("artist", ""),
+                "title": selected_meta.get("title", ""),
+                "cover_file_id": cover_file_id,
+                "links": merged_links,
+                "metadata": merged_metadata,
+                "preferred_source": merged_metadata.get("preferred_source"),
+                "release_date": (latest or {}).get("release_date", ""),
+                "caption_text": (latest or {}).get("caption_text", ""),
+            }
+        )
+        await form_start(tg_id, "smartlink_prefill_edit")
+        await form_set(tg_id, 0, data)
+        platforms_text = ", ".join(sorted(merged_links.keys())) if merged_links else "—"
+        summary_lines = [
+            "Нашёл ссылки и данные релиза:",
+            f"{data.get('artist') or 'Без артиста'} — {data.get('title') or 'Без названия'}",
+            f"Площадки: {platforms_text}",
+            "Карточку заполнил автоматически.",
+        ]
+        kb = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text="Продолжить", callback_data="smartlink:prefill_continue")],
+                [InlineKeyboardButton(text="✏️ Изменить данные", callback_data="smartlink:import_edit")],
+                [InlineKeyboardButton(text="Отмена", callback_data="smartlink:import_cancel")],
+            ]
+        )
+        try:
+            await message.answer_photo(photo=cover_file_id, caption="\n".join(summary_lines), reply_markup=kb)
+        except Exception:
+            await message.answer("\n".join(summary_lines), reply_markup=kb)
         return
 
-    if form_name == "smartlink":
-        step = int(form.get("step", 0))
-        data = form.get("data") or {}
-        links = data.get("links") or {}
-        data["links"] = links
-        total_steps = 5 + len(SMARTLINK_PLATFORMS)
-        skip_text = txt.lower() in {"пропустить", "skip"}
-        field_name = ""
+    meta_complete = bool((merged_metadata or {}).get("artist") and (merged_metadata or {}).get("title"))
 
-        if step == 0:
-            if skip_text:
-                data["artist"] = ""
-            else:
-                if len(txt) < 2:
-                    await _update_smartlink_prompt(message, tg_id, step, data)
-                    return
-                data["artist"] = txt
-            field_name = "artist"
-        elif step == 1:
-            if skip_text:
-                data["title"] = ""
-            else:
-                if len(txt) < 1:
-                    await _update_smartlink_prompt(message, tg_id, step, data)
-                    return
-                data["title"] = txt
-            field_name = "title"
-        elif step == 2:
-            if skip_text:
-                data["release_date"] = ""
-            else:
-                d = parse_date(txt)
-                if not d:
-                    await _update_smartlink_prompt(
-                        message,
-                        tg_id,
-                        step,
-                        data,
-                        prefix="Не понял дату. Формат: ДД.ММ.ГГГГ",
-                    )
-                    return
-                data["release_date"] = d.isoformat()
-            field_name = "release_date"
-        elif step == 3:
-            if skip_text:
-                data["cover_file_id"] = ""
-            else:
-                if not message.photo:
-                    await _update_smartlink_prompt(
-                        message,
-                        tg_id,
-                        step,
-                        data,
-                        prefix="Пришли фото для обложки.",
-                    )
-                    return
-                data["cover_file_id"] = message.photo[-1].file_id
-            field_name = "cover_file_id"
-        elif step == 4:
-            if skip_text:
-                data["caption_text"] = ""
-            else:
-                if not txt:
-                    await _update_smartlink_prompt(message, tg_id, step, data)
-                    return
-                if len(txt) > 600:
-                    await _update_smartlink_prompt(
-                        message,
-                        tg_id,
-                        step,
-                        data,
-                        prefix="Максимум 600 символов. Сократи текст и отправь снова.",
-                    )
-                    return
-                data["caption_text"] = txt
-            field_name = "caption_text"
-        else:
-            idx = step - 5
-            if idx < 0 or idx >= len(SMARTLINK_PLATFORMS):
-                await form_clear(tg_id)
-                return
-            if skip_text:
-                links[SMARTLINK_PLATFORMS[idx][0]] = ""
-            else:
-                if not txt:
-                    await _update_smartlink_prompt(message, tg_id, step, data)
-                    return
-                if not re.match(r"https?://", txt):
-                    await _update_smartlink_prompt(
-                        message,
-                        tg_id,
-                        step,
-                        data,
-                        prefix="Нужна ссылка или «Пропустить».",
-                    )
-                    return
-                links[SMARTLINK_PLATFORMS[idx][0]] = txt
-            field_name = SMARTLINK_PLATFORMS[idx][0]
-
-        log_smartlink_step(tg_id, step, field_name or "unknown", skip_text)
-
-        await _cleanup_user_input_message(message, data)
-
-        step += 1
-        step = skip_prefilled_smartlink_steps(step, data)
-        if step < total_steps:
-            await _send_smartlink_prompt(message, tg_id, step, data)
-            return
+    if key_links_count < 3 and not low_links_hint_shown:
+        data["low_links_hint_shown"] = True
+        await form_set(tg_id, form.get("step", 0) or 0, data)
+        await message.answer(
+            "Ссылок мало. Можешь прислать Яндекс или VK — доберу остальные.",
+            reply_markup=await user_menu_keyboard(tg_id),
+        )
 
-        await form_set(tg_id, step, data)
-        await finalize_smartlink_form(message, tg_id, data)
+    if total >= 2 and meta_complete:
+        await show_import_confirmation(message, tg_id, merged_links, merged_metadata, latest)
+        return
+
+    if meta_complete:
+        await show_import_confirmation(message, tg_id, merged_links, merged_metadata, latest)
+        return
+
+    if total >= 2:
+        await show_import_confirmation(message, tg_id, merged_links, merged_metadata, latest)
+        return
+
+    data.update({
+        "links": merged_links,
+        "metadata": merged_metadata,
+        "bandlink_help_shown": bandlink_help_shown,
+        "low_links_hint_shown": data.get("low_links_hint_shown", False),
+    })
+    await form_set(tg_id, form.get("step", 0) or 0, data)
+
+    failure = total <= 1 and not meta_complete
+    if detected_platform == "bandlink" and not bandlink_help_shown and failure:
+        data["bandlink_help_shown"] = True
+        await form_set(tg_id, form.get("step", 0) or 0, data)
+        await message.answer(
+            RESOLVER_FALLBACK_TEXT,
+            reply_markup=await user_menu_keyboard(tg_id),
+        )
         return
 
-    if form_name == "smartlink_prefill_edit":
-        data = form.get("data") or {}
-        pending = data.get("pending")
-        if pending == "artist":
+    await message.answer(
+        "Не нашёл остальные площадки, пришли ссылку другой платформы.",
+        reply_markup=await user_menu_keyboard(tg_id),
+    )
+
+
+@form_handler("smartlink")
+async def smartlink_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    step = int(form.get("step", 0))
+    data = form.get("data") or {}
+    links = data.get("links") or {}
+    data["links"] = links
+    total_steps = 5 + len(SMARTLINK_PLATFORMS)
+    skip_text = txt.lower() in {"пропустить", "skip"}
+    field_name = ""
+
+    if step == 0:
+        if skip_text:
+            data["artist"] = ""
+        else:
             if len(txt) < 2:
-                await message.answer("Минимум 2 символа. Попробуй ещё раз.", reply_markup=await user_menu_keyboard(tg_id))
+                await _update_smartlink_prompt(message, tg_id, step, data)
                 return
             data["artist"] = txt
-        elif pending == "title":
+        field_name = "artist"
+    elif step == 1:
+        if skip_text:
+            data["title"] = ""
+        else:
             if len(txt) < 1:
-                await message.answer("Нужно название релиза.", reply_markup=await user_menu_keyboard(tg_id))
+                await _update_smartlink_prompt(message, tg_id, step, data)
                 return
             data["title"] = txt
-        elif pending == "cover":
+        field_name = "title"
+    elif step == 2:
+        if skip_text:
+            data["release_date"] = ""
+        else:
+            d = parse_date(txt)
+            if not d:
+                await _update_smartlink_prompt(
+                    message,
+                    tg_id,
+                    step,
+                    data,
+                    prefix="Не понял дату. Формат: ДД.ММ.ГГГГ",
+                )
+                return
+            data["release_date"] = d.isoformat()
+        field_name = "release_date"
+    elif step == 3:
+        if skip_text:
+            data["cover_file_id"] = ""
+        else:
             if not message.photo:
-                await message.answer("Пришли фото.", reply_markup=await user_menu_keyboard(tg_id))
+                await _update_smartlink_prompt(
+                    message,
+                    tg_id,
+                    step,
+                    data,
+                    prefix="Пришли фото для обложки.",
+                )
                 return
             data["cover_file_id"] = message.photo[-1].file_id
+        field_name = "cover_file_id"
+    elif step == 4:
+        if skip_text:
+            data["caption_text"] = ""
         else:
-            await start_prefill_editor(message, tg_id, data)
-            return
-        await _cleanup_user_input_message(message, data)
-        data.pop("pending", None)
-        await form_set(tg_id, 0, data)
-        await start_prefill_editor(message, tg_id, data)
-        return
-
-    if form_name == "smartlink_caption_edit":
-        data = form.get("data") or {}
-        smartlink_id = data.get("smartlink_id")
-        if not smartlink_id:
+            if not txt:
+                await _update_smartlink_prompt(message, tg_id, step, data)
+                return
+            if len(txt) > 600:
+                await _update_smartlink_prompt(
+                    message,
+                    tg_id,
+                    step,
+                    data,
+                    prefix="Максимум 600 символов. Сократи текст и отправь снова.",
+                )
+                return
+            data["caption_text"] = txt
+        field_name = "caption_text"
+    else:
+        idx = step - 5
+        if idx < 0 or idx >= len(SMARTLINK_PLATFORMS):
             await form_clear(tg_id)
-            await message.answer("Смартлинк не найден.", reply_markup=await user_menu_keyboard(tg_id))
             return
-        if not txt:
-            await message.answer(smartlink_step_prompt(4) + "\n\n(Отмена: /cancel)", reply_markup=smartlink_step_kb())
-            return
-        if txt.lower() in {"пропустить", "skip"}:
-            caption_text = ""
+        if skip_text:
+            links[SMARTLINK_PLATFORMS[idx][0]] = ""
         else:
-            if len(txt) > 600:
-                await message.answer(
-                    "Максимум 600 символов. Сократи текст и отправь снова.\n\n" + smartlink_step_prompt(4),
-                    reply_markup=smartlink_step_kb(),
+            if not txt:
+                await _update_smartlink_prompt(message, tg_id, step, data)
+                return
+            if not re.match(r"https?://", txt):
+                await _update_smartlink_prompt(
+                    message,
+                    tg_id,
+                    step,
+                    data,
+                    prefix="Нужна ссылка или «Пропустить».",
                 )
                 return
-            caption_text = txt
-        await apply_caption_update(message, tg_id, smartlink_id, caption_text)
+            links[SMARTLINK_PLATFORMS[idx][0]] = txt
+        field_name = SMARTLINK_PLATFORMS[idx][0]
+
+    log_smartlink_step(tg_id, step, field_name or "unknown", skip_text)
+
+    await _cleanup_user_input_message(message, data)
+
+    step += 1
+    step = skip_prefilled_smartlink_steps(step, data)
+    if step < total_steps:
+        await _send_smartlink_prompt(message, tg_id, step, data)
         return
 
-    if form_name == "smartlink_edit":
-        info = form.get("data") or {}
-        smartlink_id = info.get("smartlink_id")
-        page = int(info.get("page") or 0)
-        field = info.get("field")
-        smartlink = await get_owned_smartlink(tg_id, smartlink_id) if smartlink_id else None
-        if not smartlink or not field:
-            await form_clear(tg_id)
-            await message.answer("Смартлинк не найден.", reply_markup=await user_menu_keyboard(tg_id))
+    await form_set(tg_id, step, data)
+    await finalize_smartlink_form(message, tg_id, data)
+
+
+@form_handler("smartlink_prefill_edit")
+async def smartlink_prefill_edit_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    data = form.get("data") or {}
+    pending = data.get("pending")
+    if pending == "artist":
+        if len(txt) < 2:
+            await message.answer("Минимум 2 символа. Попробуй ещё раз.", reply_markup=await user_menu_keyboard(tg_id))
+            return
+        data["artist"] = txt
+    elif pending == "title":
+        if len(txt) < 1:
+            await message.answer("Нужно название релиза.", reply_markup=await user_menu_keyboard(tg_id))
             return
+        data["title"] = txt
+    elif pending == "cover":
+        if not message.photo:
+            await message.answer("Пришли фото.", reply_markup=await user_menu_keyboard(tg_id))
+            return
+        data["cover_file_id"] = message.photo[-1].file_id
+    else:
+        await start_prefill_editor(message, tg_id, data)
+        return
+    await _cleanup_user_input_message(message, data)
+    data.pop("pending", None)
+    await form_set(tg_id, 0, data)
+    await start_prefill_editor(message, tg_id, data)
 
-        step = int(form.get("step", 0))
-        updates: dict = {}
-
-        if field == "title":
-            if step == 0:
-                if len(txt) < 2:
-                    await message.answer(
-                        "Минимум 2 символа. Пришли артиста ещё раз.\n\n(Отмена: /cancel)",
-                        reply_markup=await user_menu_keyboard(tg_id),
-                    )
-                    return
-                info_data = info.get("data") or {}
-                info_data["artist"] = txt
-                info["data"] = info_data
-                await form_set(tg_id, 1, info)
+
+@form_handler("smartlink_caption_edit")
+async def smartlink_caption_edit_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    data = form.get("data") or {}
+    smartlink_id = data.get("smartlink_id")
+    if not smartlink_id:
+        await form_clear(tg_id)
+        await message.answer("Смартлинк не найден.", reply_markup=await user_menu_keyboard(tg_id))
+        return
+    if not txt:
+        await message.answer(smartlink_step_prompt(4) + "\n\n(Отмена: /cancel)", reply_markup=smartlink_step_kb())
+        return
+    if txt.lower() in {"пропустить", "skip"}:
+        caption_text = ""
+    else:
+        if len(txt) > 600:
+            await message.answer(
+                "Максимум 600 символов. Сократи текст и отправь снова.\n\n" + smartlink_step_prompt(4),
+                reply_markup=smartlink_step_kb(),
+            )
+            return
+        caption_text = txt
+    await apply_caption_update(message, tg_id, smartlink_id, caption_text)
+
+
+@form_handler("smartlink_edit")
+async def smartlink_edit_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    info = form.get("data") or {}
+    smartlink_id = info.get("smartlink_id")
+    page = int(info.get("page") or 0)
+    field = info.get("field")
+    smartlink = await get_owned_smartlink(tg_id, smartlink_id) if smartlink_id else None
+    if not smartlink or not field:
+        await form_clear(tg_id)
+        await message.answer("Смартлинк не найден.", reply_markup=await user_menu_keyboard(tg_id))
+        return
+
+    step = int(form.get("step", 0))
+    updates: dict = {}
+
+    if field == "title":
+        if step == 0:
+            if len(txt) < 2:
                 await message.answer(
-                    "Теперь пришли название релиза.\n\n(Отмена: /cancel)",
+                    "Минимум 2 символа. Пришли артиста ещё раз.\n\n(Отмена: /cancel)",
                     reply_markup=await user_menu_keyboard(tg_id),
                 )
                 return
             info_data = info.get("data") or {}
-            artist = info_data.get("artist") or smartlink.get("artist")
-            if len(txt) < 1:
+            info_data["artist"] = txt
+            info["data"] = info_data
+            await form_set(tg_id, 1, info)
+            await message.answer(
+                "Теперь пришли название релиза.\n\n(Отмена: /cancel)",
+                reply_markup=await user_menu_keyboard(tg_id),
+            )
+            return
+        info_data = info.get("data") or {}
+        artist = info_data.get("artist") or smartlink.get("artist")
+        if len(txt) < 1:
+            await message.answer(
+                "Нужно название релиза.\n\n(Отмена: /cancel)",
+                reply_markup=await user_menu_keyboard(tg_id),
+            )
+            return
+        updates["artist"] = artist
+        updates["title"] = txt
+    elif field == "date":
+        if txt.lower() in {"нет", "пропустить", "skip"}:
+            updates["release_date"] = ""
+        else:
+            d = parse_date(txt)
+            if not d:
                 await message.answer(
-                    "Нужно название релиза.\n\n(Отмена: /cancel)",
+                    "Не понял дату. Формат: ДД.ММ.ГГГГ или напиши «нет».\n\n(Отмена: /cancel)",
                     reply_markup=await user_menu_keyboard(tg_id),
                 )
                 return
-            updates["artist"] = artist
-            updates["title"] = txt
-        elif field == "date":
-            if txt.lower() in {"нет", "пропустить", "skip"}:
-                updates["release_date"] = ""
-            else:
-                d = parse_date(txt)
-                if not d:
-                    await message.answer(
-                        "Не понял дату. Формат: ДД.ММ.ГГГГ или напиши «нет».\n\n(Отмена: /cancel)",
-                        reply_markup=await user_menu_keyboard(tg_id),
-                    )
-                    return
-                updates["release_date"] = d.isoformat()
-        elif field == "caption":
-            if txt.lower() in {"пропустить", "skip"}:
-                updates["caption_text"] = ""
-            else:
-                if len(txt) > 600:
-                    await message.answer(
-                        "Максимум 600 символов. Сократи текст.\n\n(Отмена: /cancel)",
-                        reply_markup=await user_menu_keyboard(tg_id),
-                    )
-                    return
-                updates["caption_text"] = txt
-        elif field == "cover":
-            if not message.photo:
+            updates["release_date"] = d.isoformat()
+    elif field == "caption":
+        if txt.lower() in {"пропустить", "skip"}:
+            updates["caption_text"] = ""
+        else:
+            if len(txt) > 600:
                 await message.answer(
-                    "Пришли фото для обложки.\n\n(Отмена: /cancel)",
+                    "Максимум 600 символов. Сократи текст.\n\n(Отмена: /cancel)",
                     reply_markup=await user_menu_keyboard(tg_id),
                 )
                 return
-            updates["cover_file_id"] = message.photo[-1].file_id
-        elif field == "link":
-            platform = info.get("platform")
-            links = smartlink.get("links") or {}
-            lower = txt.lower()
-            if lower in {"удалить", "delete", "remove", "пропустить", "skip"}:
-                links.pop(platform, None)
-            else:
-                if not re.match(r"https?://", txt):
-                    await message.answer(
-                        "Нужна ссылка вида https://... или слово «удалить».\n\n(Отмена: /cancel)",
-                        reply_markup=await user_menu_keyboard(tg_id),
-                    )
-                    return
-                links[platform] = txt
-            updates["links"] = links
-        else:
-            await form_clear(tg_id)
-            await message.answer("Не понял запрос.", reply_markup=await user_menu_keyboard(tg_id))
-            return
-
-        if updates:
-            await update_smartlink_data(smartlink_id, tg_id, updates)
-        await form_clear(tg_id)
-        updated = await get_smartlink_by_id(smartlink_id)
-        if updated:
-            await resend_smartlink_card(message, tg_id, updated, page)
-        else:
-            await message.answer("Смартлинк обновлён.", reply_markup=await user_menu_keyboard(tg_id))
-        return
-
-    if not txt or txt.startswith("/"):
-        return
-
-    if form_name == "release_date":
-        d = parse_date(txt)
-        if not d:
+            updates["caption_text"] = txt
+    elif field == "cover":
+        if not message.photo:
             await message.answer(
-                "Не понял дату. Формат: ДД.ММ.ГГГГ. Пример: 31.12.2025\n\nПопробуй ещё раз:",
+                "Пришли фото для обложки.\n\n(Отмена: /cancel)",
                 reply_markup=await user_menu_keyboard(tg_id),
             )
             return
-        await set_release_date(tg_id, d.isoformat())
+        updates["cover_file_id"] = message.photo[-1].file_id
+    elif field == "link":
+        platform = info.get("platform")
+        links = smartlink.get("links") or {}
+        lower = txt.lower()
+        if lower in {"удалить", "delete", "remove", "пропустить", "skip"}:
+            links.pop(platform, None)
+        else:
+            if not re.match(r"https?://", txt):
+                await message.answer(
+                    "Нужна ссылка вида https://... или слово «удалить».\n\n(Отмена: /cancel)",
+                    reply_markup=await user_menu_keyboard(tg_id),
+                )
+                return
+            links[platform] = txt
+        updates["links"] = links
+    else:
         await form_clear(tg_id)
-        reminders = await get_reminders_enabled(tg_id)
-        await message.answer(
-            f"Ок. Дата релиза: {format_date_ru(d)}",
-            reply_markup=build_timeline_kb(reminders, has_date=True),
-        )
-        await message.answer(timeline_text(d, reminders), reply_markup=await user_menu_keyboard(tg_id))
+        await message.answer("Не понял запрос.", reply_markup=await user_menu_keyboard(tg_id))
         return
 
-    if form_name == "pitch_texts":
-        step = int(form["step"])
-        data = form["data"]
-        if step < 0 or step >= len(TEXT_FORM_STEPS):
-            await form_clear(tg_id)
-            await message.answer("Форма сброшена. Нажми «✍️ Тексты» ещё раз.", reply_markup=await user_menu_keyboard(tg_id))
-            return
-        key, prompt, *rest = TEXT_FORM_STEPS[step]
-        optional = rest[0] if rest else False
-        value = txt.strip()
-        if not value and optional:
-            data[key] = ""
-        elif len(value) < 2:
-            await message.answer(prompt + "\n\n(Отмена: /cancel)", reply_markup=await user_menu_keyboard(tg_id))
-            return
-        else:
-            data[key] = value
-
-        step += 1
-        if step < len(TEXT_FORM_STEPS):
-            await form_set(tg_id, step, data)
-            await message.answer(TEXT_FORM_STEPS[step][1] + "\n\n(Отмена: /cancel)", reply_markup=await user_menu_keyboard(tg_id))
-            return
+    if updates:
+        await update_smartlink_data(smartlink_id, tg_id, updates)
+    await form_clear(tg_id)
+    updated = await get_smartlink_by_id(smartlink_id)
+    if updated:
+        await resend_smartlink_card(message, tg_id, updated, page)
+    else:
+        await message.answer("Смартлинк обновлён.", reply_markup=await user_menu_keyboard(tg_id))
 
-        texts = generate_pitch_texts(data)
-        await form_start(tg_id, "pitch_texts_ready")
-        await form_set(tg_id, 0, {"texts": texts})
 
-        for idx, text in enumerate(texts, start=1):
-            await message.answer(f"Вариант {idx}:\n{text}", reply_markup=await user_menu_keyboard(tg_id))
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="📋 Скопировать 1", callback_data="texts:copy:0")],
-                [InlineKeyboardButton(text="📋 Скопировать 2", callback_data="texts:copy:1")],
-                [InlineKeyboardButton(text="📋 Скопировать 3", callback_data="texts:copy:2")],
-                [InlineKeyboardButton(text="↩️ В фокус", callback_data="back_to_focus")],
-            ]
+@form_handler("release_date", text_only=True)
+async def release_date_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    d = parse_date(txt)
+    if not d:
+        await message.answer(
+            "Не понял дату. Формат: ДД.ММ.ГГГГ. Пример: 31.12.2025\n\nПопробуй ещё раз:",
+            reply_markup=await user_menu_keyboard(tg_id),
         )
-        await message.answer("Выбери, что скопировать:", reply_markup=kb)
         return
+    await set_release_date(tg_id, d.isoformat())
+    await form_clear(tg_id)
+    reminders = await get_reminders_enabled(tg_id)
+    await message.answer(
+        f"Ок. Дата релиза: {format_date_ru(d)}",
+        reply_markup=build_timeline_kb(reminders, has_date=True),
+    )
+    await message.answer(timeline_text(d, reminders), reply_markup=await user_menu_keyboard(tg_id))
 
-    if form_name == "pitch_texts_ready":
+
+@form_handler("pitch_texts", text_only=True)
+async def pitch_texts_form_step(message: Message, tg_id: int, form: dict, txt: str):
+    step = int(form["step"])
+    data = form["data"]
+    if step < 0 or step >= len(TEXT_FORM_STEPS):
+        await form_clear(tg_id)
+        await message.answer("Форма сброшена. Нажми «✍️ Тексты» ещё раз.", reply_markup=await user_menu_keyboard(tg_id))
+        return
+    key, prompt, *rest = TEXT_FORM_STEPS[step]
+    optional = rest[0] if rest else False
+    value = txt.strip()
+    if not value and optional:
+        data[key] = ""
+    elif len(value) < 2:
+        await message.answer(prompt + "\n\n(Отмена: /cancel)", reply_markup=await user_menu_keyboard(tg_id))
         return
+    else:
+        data[key] = value
 
-    if form_name != "label_submit":
+    step += 1
+    if step < len(TEXT_FORM_STEPS):
+        await form_set(tg_id, step, data)
+        await message.answer(TEXT_FORM_STEPS[step][1] + "\n\n(Отмена: /cancel)", reply_markup=await user_menu_keyboard(tg_id))
         return
 
+    texts = generate_pitch_texts(data)
+    await form_start(tg_id, "pitch_texts_ready")
+    await form_set(tg_id, 0, {"texts": texts})
+
+    for idx, text in enumerate(texts, start=1):
+        await message.answer(f"Вариант {idx}:\n{text}", reply_markup=await user_menu_keyboard(tg_id))
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="📋 Скопировать 1", callback_data="texts:copy:0")],
+            [InlineKeyboardButton(text="📋 Скопировать 2", callback_data="texts:copy:1")],
+            [InlineKeyboardButton(text="📋 Скопировать 3", callback_data="texts:copy:2")],
+            [InlineKeyboardButton(text="↩️ В фокус", callback_data="back_to_focus")],
+        ]
+    )
+    await message.answer("Выбери, что скопировать:", reply_markup=kb)
+
+
+@form_handler("label_submit", text_only=True)
+async def label_submit_form_step(message: Message, tg_id: int, form: dict, txt: str):
+
     step = int(form["step"])
     data = form["data"]
 
@@ -4146,6 +4281,33 @@ async def any_message_router(message: Message):
 
     await form_clear(tg_id)
 
+
+@dp.message()
+async def any_message_router(message: Message):
+    tg_id = message.from_user.id
+    txt = (message.text or "").strip()
+
+    # Most chatter arrives with no form open: answer that from memory, without a form query.
+    if not await has_active_form(tg_id):
+        if not txt or txt.startswith("/"):
+            return
+        await ensure_user(tg_id, message.from_user.username)
+        await handle_no_form_message(message, tg_id, txt)
+        return
+
+    await ensure_user(tg_id, message.from_user.username)
+    form = await form_get(tg_id)
+    if not form:
+        return
+
+    step = FORM_HANDLERS.get(form.get("form_name"))
+    if step is None:
+        return
+    if step.text_only and (not txt or txt.startswith("/")):
+        return
+    await step.handler(message, tg_id, form, txt)
+
+
 # -------------------- Runner --------------------
 
 async def run_polling(bot: Bot):
@@ -4160,6 +4322,7 @@ async def run_polling(bot: Bot):
                 backoff_config=POLLING_BACKOFF_CONFIG,
                 allowed_updates=dp.resolve_used_update_types(),
                 close_bot_session=False,
+                tasks_concurrency_limit=DISPATCH_MAX_PENDING,
             )
             break
         except TelegramNetworkError as exc:
@@ -4173,48 +4336,374 @@ async def run_polling(bot: Bot):
             await asyncio.sleep(delay)
 
 
-async def main():
-    if not TOKEN:
-        raise RuntimeError("BOT_TOKEN не задан.")
-    lock_file = acquire_single_instance_lock(POLLING_LOCK_FILE)
-    if lock_file is None:
-        print(f"Another polling instance is already running (lock: {POLLING_LOCK_FILE}). Exiting.")
-        return
-
-    print(f"Single-instance lock acquired at {POLLING_LOCK_FILE} (pid={os.getpid()})")
-
-    # Ensure database schema is initialized before starting external services
-    await init_db()
-    _smartlink_sanity_check()
+def create_bot() -> Bot:
     timeout_seconds = float(HTTP_TIMEOUT)
-    session = AiohttpSession(timeout=timeout_seconds)
+    # TELEGRAM_API_URL points the bot at a local Bot API server (or benchmarks/fake_bot_api.py).
+    api = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION
+    session = AiohttpSession(api=api, timeout=timeout_seconds)
     if not isinstance(session.timeout, (int, float)):
         with contextlib.suppress(Exception):
             session.timeout = float(getattr(session.timeout, "total", timeout_seconds))
     if not isinstance(session.timeout, (int, float)):
         session.timeout = timeout_seconds
-    bot = Bot(token=TOKEN, session=session)
-    me = await bot.get_me()
-    HEALTH_STATE.update({
-        "status": "running",
-        "bot_id": me.id,
-        "username": me.username,
-    })
-    print(
-        "Starting bot in POLLING mode, "
-        f"bot_id={me.id}, username=@{me.username}, pid={os.getpid()}"
+    session.middleware(TelegramMetricsMiddleware())
+    return Bot(token=TOKEN, session=session)
+
+
+async def feed_payload(bot: Bot, payload: dict):
+    update = Update.model_validate(payload, context={"bot": bot})
+    await dp.feed_update(bot, update)
+
+
+def run_scheduler_leader(bot: Bot) -> asyncio.Task:
+    # Every process competes for the lease; only the holder sends reminders.
+    return asyncio.create_task(
+        run_as_leader(
+            "reminder_scheduler", lambda: reminder_scheduler(bot, send_smartlink_photo), ttl=SCHEDULER_LEASE_TTL
+        )
+    )
+
+
+async def run_webhook(bot: Bot, ingress: WebhookIngress):
+    ingress.feeder.start()
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+    await bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
     )
-    await start_health_server()
-    print("Dropping webhook and pending updates before polling...")
-    await bot.delete_webhook(drop_pending_updates=True)
+    print(f"Webhook registered at {WEBHOOK_URL}{WEBHOOK_PATH}")
     try:
-        asyncio.create_task(reminder_scheduler(bot, send_smartlink_photo))
-    except Exception as err:
-        print(f"[main] reminder scheduler not started: {err}")
+        # Updates arrive through the web server; just stay alive until cancelled.
+        await asyncio.Event().wait()
+    finally:
+        await ingress.feeder.stop()
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+
+
+async def run_worker(index: int, updates, results):
+    """Handler process of a cluster: runs the dispatcher on the updates the ingress routes here.
+
+    Every finished update_id is reported on `results`, so the ingress knows what is done.
+    """
+    HEALTH_STATE.update({"mode": f"worker-{index}", "pid": os.getpid()})
+    LOOP_MONITOR.start()
+    start_db_writer()
+    bot = create_bot()
+    feeder = UpdateFeeder(
+        report_results(results, lambda payload: feed_payload(bot, payload)),
+        concurrency=DISPATCH_MAX_PENDING,
+    )
+    feeder.start()
+    asyncio.create_task(warm_parse_executor())
+    scheduler = run_scheduler_leader(bot)
+    print(f"[cluster] worker {index} ready (pid={os.getpid()})")
+    try:
+        await consume_worker_queue(updates, feeder)
+    finally:
+        scheduler.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await scheduler
+        await feeder.stop()
+        shutdown_parse_executor()
+        await SPOTIFY.close()
+        await close_form_store()
+        await stop_db_writer()
+        await LOOP_MONITOR.stop()
+        await bot.session.close()
+
+
+async def warm_caches():
+    """Pay the first-update costs up front, before this process takes traffic.
+
+    Form owners are not loaded here: a running instance may still change them until
+    it hands over. main() loads them with load_form_store() once it has.
+    """
+    for updates_on in (True, False):
+        _menu_keyboard(updates_on)
+    experience_prompt()
+    await warm_parse_executor()
+
+
+async def wait_for_lock(lock_path: str, timeout: float) -> IO[str] | None:
+    deadline = time.monotonic() + timeout
+    while True:
+        lock_file = acquire_single_instance_lock(lock_path)
+        if lock_file is not None or time.monotonic() >= deadline:
+            return lock_file
+        await asyncio.sleep(0.1)
+
+
+async def confirm_offset(bot: Bot, offset: int):
+    # getUpdates with an offset marks every earlier update as handled on Telegram's side;
+    # limit=1, timeout=0 returns at once and leaves the rest for polling.
+    for attempt in range(3):
+        try:
+            await bot.get_updates(offset=offset, limit=1, timeout=0)
+            return
+        except TelegramNetworkError as exc:
+            print(f"[handover] confirming offset {offset} failed: {exc}")
+            await asyncio.sleep(1 + attempt)
+    raise RuntimeError(f"Could not confirm update offset {offset}")
+
+
+async def load_update_offset() -> int | None:
+    raw = await get_bot_state(UPDATE_OFFSET_KEY)
+    return int(raw) if raw else None
+
+
+async def save_update_offset(offset: int | None):
+    if offset is not None:
+        await set_bot_state(UPDATE_OFFSET_KEY, str(offset))
+
+
+async def persist_update_offset(get_offset: Callable[[], int | None]):
+    # One write per interval, whatever the update rate.
+    saved = None
+    while True:
+        await asyncio.sleep(UPDATE_OFFSET_SAVE_INTERVAL)
+        offset = get_offset()
+        if offset is not None and offset != saved:
+            try:
+                await save_update_offset(offset)
+                saved = offset
+            except Exception as e:
+                print(f"[offset] save failed: {e}")
+
+
+async def main():
+    if not TOKEN:
+        raise RuntimeError("BOT_TOKEN не задан.")
+    if BOT_MODE not in ("polling", "webhook"):
+        raise RuntimeError(f"Unknown BOT_MODE: {BOT_MODE}")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is required when BOT_MODE=webhook.")
+
+    LOOP_MONITOR.start()
+    # Ensure database schema is initialized before starting external services
+    await init_db()
+    start_db_writer()
+    _smartlink_sanity_check()
+    bot = create_bot()
+    pool = None
+    runner = None
+    scheduler = None
+    lock_file = None
+    handover = None
+    successor = None
+    offset_saver = None
+    poll_progress: dict[str, int | None] = {"offset": None}
     try:
-        await run_polling(bot)
+        me = await bot.get_me()
+        # Warm up before the running instance is asked to stop, so the gap stays short.
+        if BOT_WORKERS <= 0:
+            await warm_caches()
+
+        # One instance per database in both modes: form sessions, the ensure_user cache and
+        # edit fingerprints live in process memory, so a second instance would act on stale state.
+        # Only polling can hand over; a second webhook instance exits until the first is gone.
+        resume_offset = None
+        handed_over = False
+        lock_file = acquire_single_instance_lock(POLLING_LOCK_FILE)
+        if lock_file is None and BOT_MODE == "webhook":
+            print(f"Another instance is already running (lock: {POLLING_LOCK_FILE}). Exiting.")
+            return
+        if lock_file is None:
+            print(f"Polling lock {POLLING_LOCK_FILE} is held, asking the running instance to hand over...")
+            predecessor = HandoverClient(HANDOVER_SOCKET, idle_timeout=HANDOVER_TIMEOUT)
+            handed_over, resume_offset = await predecessor.request()
+            if handed_over:
+                try:
+                    if resume_offset is not None:
+                        await confirm_offset(bot, resume_offset)
+                    await predecessor.ack()
+                    # It shuts down now and closes the connection once the lock is free.
+                    await predecessor.wait_released()
+                finally:
+                    predecessor.close()
+                lock_file = await wait_for_lock(POLLING_LOCK_FILE, HANDOVER_TIMEOUT)
+            if lock_file is None:
+                predecessor.close()
+                print(f"Another polling instance is already running (lock: {POLLING_LOCK_FILE}). Exiting.")
+                return
+            print(f"[handover] took over polling at offset {resume_offset}")
+        print(f"Single-instance lock acquired at {POLLING_LOCK_FILE} (pid={os.getpid()})")
+
+        HEALTH_STATE.update({
+            "status": "running",
+            "bot_id": me.id,
+            "username": me.username,
+            "workers": BOT_WORKERS,
+        })
+        print(
+            f"Starting bot in {BOT_MODE.upper()} mode, "
+            f"bot_id={me.id}, username=@{me.username}, pid={os.getpid()}, workers={BOT_WORKERS}"
+        )
+        # With workers this process only receives updates and routes them by user.
+        pool = (
+            WorkerPool(BOT_WORKERS, queue_size=CLUSTER_QUEUE_SIZE, on_done=forget_updates)
+            if BOT_WORKERS > 0
+            else None
+        )
+        sink = pool.dispatch if pool else (lambda payload: feed_payload(bot, payload))
+        ingress = None
+        if BOT_MODE == "webhook":
+            feeder = UpdateFeeder(sink, queue_size=WEBHOOK_QUEUE_SIZE, concurrency=DISPATCH_MAX_PENDING)
+            ingress = WebhookIngress(feeder, WEBHOOK_SECRET)
+            HEALTH_QUEUES["webhook"] = lambda: (feeder.queue_depth, WEBHOOK_QUEUE_SIZE)
+        if pool:
+            HEALTH_QUEUES["workers"] = lambda: (max(pool.queue_depths(), default=0), CLUSTER_QUEUE_SIZE)
+        runner = await start_health_server(ingress)
+        if pool:
+            pool.start()
+            for index in range(len(pool)):
+                HEALTH_PROCESSES[f"worker-{index}"] = lambda index=index: pool.is_alive(index)
+            # Updates confirmed with Telegram that no worker finished before the last exit.
+            replay = await load_pending_updates()
+            if replay:
+                print(f"[cluster] replaying {len(replay)} unfinished updates from the journal")
+            for payload in replay:
+                await pool.dispatch(payload)
+        else:
+            scheduler = run_scheduler_leader(bot)
+            HEALTH_TASKS["scheduler"] = scheduler
+        if BOT_MODE == "polling" and not handed_over:
+            # Keep what Telegram queued while we were down; catch-up below works through it.
+            await bot.delete_webhook(drop_pending_updates=False)
+            resume_offset = await load_update_offset()
+        if not pool:
+            # The predecessor, if any, flushed its form sessions before releasing the lock.
+            await load_form_store()
+
+        if BOT_MODE == "polling":
+            catch_up_sink = (
+                (lambda update: pool.dispatch(update_to_payload(update)))
+                if pool
+                else (lambda update: dp.feed_update(bot, update))
+            )
+            print(f"Catching up on queued updates from offset {resume_offset}...")
+            resume_offset = await catch_up(
+                bot,
+                catch_up_sink,
+                offset=resume_offset,
+                allowed_updates=dp.resolve_used_update_types(),
+                concurrency=CATCHUP_CONCURRENCY,
+                max_callback_age=CATCHUP_CALLBACK_MAX_AGE,
+                progress=poll_progress,
+                journal=journal_updates if pool else None,
+            )
+            await save_update_offset(resume_offset)
+            poll_progress["offset"] = resume_offset
+            offset_saver = asyncio.create_task(persist_update_offset(
+                (lambda: pool.processed_offset(poll_progress["offset"]))
+                if pool
+                else (lambda: update_tracker.processed_offset)
+            ))
+
+        def start_updates() -> asyncio.Task:
+            if ingress:
+                task = asyncio.create_task(run_webhook(bot, ingress))
+            elif pool:
+                task = asyncio.create_task(poll_into(
+                    bot,
+                    pool.dispatch,
+                    allowed_updates=dp.resolve_used_update_types(),
+                    polling_timeout=POLLING_TIMEOUT,
+                    backoff_config=POLLING_BACKOFF_CONFIG,
+                    offset=poll_progress["offset"],
+                    progress=poll_progress,
+                    journal=journal_updates,
+                ))
+            else:
+                task = asyncio.create_task(run_polling(bot))
+            HEALTH_TASKS["updates"] = task
+            return task
+
+        async def stop_updates(task: asyncio.Task):
+            if pool:
+                task.cancel()
+            else:
+                try:
+                    await dp.stop_polling()
+                except RuntimeError:
+                    # Between polling attempts (network backoff): nothing is being fetched.
+                    task.cancel()
+            await asyncio.wait({task})
+
+        async def hand_over(session: HandoverSession) -> bool:
+            """Drain and pass the offset on; False leaves this process in charge."""
+            drained = await (pool.drain if pool else update_tracker.drain)(HANDOVER_TIMEOUT)
+            if not drained:
+                running = pool.in_flight if pool else update_tracker.in_flight
+                print(f"[handover] {running} updates still running after {HANDOVER_TIMEOUT}s, refusing")
+                session.refuse()
+                return False
+            offset = pool.processed_offset(poll_progress["offset"]) if pool else update_tracker.processed_offset
+            if await session.send_offset(offset, HANDOVER_TIMEOUT):
+                print(f"[handover] successor confirmed offset {offset}, shutting down")
+                return True
+            session.close()
+            return False
+
+        if BOT_MODE == "polling":
+            handover = HandoverServer(HANDOVER_SOCKET)
+            await handover.start()
+
+        updates_task = start_updates()
+        request = None
+        try:
+            while True:
+                waiters = {updates_task}
+                if handover:
+                    request = asyncio.create_task(handover.next_request())
+                    waiters.add(request)
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                if request is None or not request.done():
+                    if not updates_task.cancelled():
+                        updates_task.result()
+                    break
+                print("[handover] successor asked for handover, stopping updates")
+                await stop_updates(updates_task)
+                if await hand_over(request.result()):
+                    successor = request.result()
+                    break
+                print("[handover] resuming updates")
+                updates_task = start_updates()
+        finally:
+            if request and not request.done():
+                request.cancel()
+            if not updates_task.done():
+                updates_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await updates_task
     finally:
-        release_single_instance_lock(lock_file)
+        # Stop accepting webhook calls before the stores they write to are closed.
+        if runner:
+            await runner.cleanup()
+        if handover:
+            await handover.close()
+        if pool:
+            await pool.stop()
+        if scheduler:
+            scheduler.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await scheduler
+        if offset_saver:
+            offset_saver.cancel()
+            with contextlib.suppress(Exception):
+                await save_update_offset(
+                    pool.processed_offset(poll_progress["offset"]) if pool else update_tracker.processed_offset
+                )
+        shutdown_parse_executor()
+        await SPOTIFY.close()
+        await close_form_store()
+        await stop_db_writer()
+        if lock_file:
+            release_single_instance_lock(lock_file)
+        if successor:
+            successor.close()
+        await LOOP_MONITOR.stop()
         await bot.session.close()
 
 if __name__ == "__main__":
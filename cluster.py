@@ -0,0 +1,378 @@
+import asyncio
+import multiprocessing as mp
+import os
+import queue
+import socket
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+from db import release_lease, try_acquire_lease
+from webhook import UpdateFeeder
+
+HOLDER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# Lease name -> whether this process currently runs the job.
+LEADERSHIP: dict[str, bool] = {}
+
+
+def payload_user_id(payload: dict) -> int:
+    """The user an update belongs to: its sender, else its chat; 0 when it has neither."""
+    for key, event in payload.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+        return 0
+    return 0
+
+
+def update_to_payload(update: Update) -> dict:
+    return update.model_dump(mode="json", by_alias=True, exclude_unset=True)
+
+
+def _worker_entry(index: int, updates: Any, results: Any):
+    # Imported here: the spawned child builds its own dispatcher, bot and stores.
+    import bot
+
+    asyncio.run(bot.run_worker(index, updates, results))
+
+
+class WorkerPool:
+    """Handler processes fed from the ingress, one queue each.
+
+    Updates are partitioned by user id, so one user's updates always reach the same
+    worker in order and that worker's per-user caches (forms, ensure_user) stay valid.
+
+    Workers report each finished update_id on a shared results queue, so the pool knows
+    which dispatched updates are unfinished; `on_done` gets the ids of each finished batch.
+    A dead worker is restarted with a fresh queue holding its unfinished updates again.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        queue_size: int = 1000,
+        on_done: Callable[[list[int]], Awaitable[Any]] | None = None,
+    ):
+        self._ctx = mp.get_context("spawn")
+        self.queues = [self._ctx.Queue(maxsize=max(1, queue_size)) for _ in range(workers)]
+        self.results = self._ctx.Queue()
+        self.processes: list[mp.process.BaseProcess | None] = [None] * workers
+        self.routed = [0] * workers
+        self.on_done = on_done
+        # One put at a time per queue, in call order: a put blocked on a full queue must
+        # not be overtaken by a later update for the same worker.
+        self._put_locks = [asyncio.Lock() for _ in range(workers)]
+        self._queue_size = max(1, queue_size)
+        # update_id -> (worker, payload), from dispatch until the worker reports it finished.
+        self._pending: dict[int, tuple[int, dict]] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._collector: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self.queues)
+
+    def is_alive(self, index: int) -> bool:
+        process = self.processes[index]
+        return process is not None and process.is_alive()
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=_worker_entry, args=(index, self.queues[index], self.results), name=f"bot-worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._spawn(index)
+        self._collector = asyncio.create_task(self._collect())
+        print(f"[cluster] started {len(self.queues)} workers")
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def processed_offset(self, forwarded: int | None) -> int | None:
+        """First update_id that may not be finished; `forwarded` is the first not dispatched yet."""
+        return min(self._pending) if self._pending else forwarded
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait until every dispatched update is finished; False on timeout."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _finish(self, update_id: int):
+        self._pending.pop(update_id, None)
+        if not self._pending:
+            self._idle.set()
+
+    async def _restart(self, index: int):
+        """Respawn a dead worker and queue its unfinished updates again, in order.
+
+        The old queue is dropped: a process killed inside get() can leave its lock held.
+        Updates the dead worker had already started are claimed, so the new one skips them.
+        """
+        unfinished = sorted(
+            (update_id, payload) for update_id, (owner, payload) in self._pending.items() if owner == index
+        )
+        self.queues[index] = self._ctx.Queue(maxsize=self._queue_size)
+        self._spawn(index)
+        if unfinished:
+            print(f"[cluster] worker {index}: queueing {len(unfinished)} unfinished updates again")
+        for _, payload in unfinished:
+            await asyncio.to_thread(self.queues[index].put, payload)
+
+    async def _collect(self):
+        stopping = False
+        while not stopping:
+            reports = [await asyncio.to_thread(self.results.get)]
+            # Take whatever else is already there, so on_done sees batches.
+            while True:
+                try:
+                    reports.append(self.results.get_nowait())
+                except queue.Empty:
+                    break
+            done = []
+            for report in reports:
+                if report is None:
+                    stopping = True
+                    continue
+                self._finish(report)
+                done.append(report)
+            if done and self.on_done:
+                try:
+                    await self.on_done(done)
+                except Exception as e:
+                    print(f"[cluster] on_done failed: {e}")
+
+    def partition(self, payload: dict) -> int:
+        return payload_user_id(payload) % len(self.queues)
+
+    async def dispatch(self, payload: dict):
+        """Hand one update to its worker; waits while that worker's queue is full."""
+        index = self.partition(payload)
+        update_id = payload["update_id"]
+        async with self._put_locks[index]:
+            process = self.processes[index]
+            if process is not None and not process.is_alive():
+                print(f"[cluster] worker {index} exited with {process.exitcode}, restarting")
+                await self._restart(index)
+            target = self.queues[index]
+            # Tracked before the put: the worker may report it finished before put returns.
+            self._pending[update_id] = (index, payload)
+            self._idle.clear()
+            try:
+                target.put_nowait(payload)
+            except queue.Full:
+                try:
+                    await asyncio.to_thread(target.put, payload)
+                except BaseException:
+                    self._finish(update_id)
+                    raise
+        self.routed[index] += 1
+
+    def queue_depths(self) -> list[int]:
+        depths = []
+        for q in self.queues:
+            try:
+                depths.append(q.qsize())
+            except NotImplementedError:  # macOS
+                depths.append(-1)
+        return depths
+
+    async def stop(self, timeout: float = 30.0):
+        """Let every worker finish its queue, then stop it."""
+        for q in self.queues:
+            await asyncio.to_thread(q.put, None)
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, max(deadline - time.monotonic(), 0.1))
+            if process.is_alive():
+                print(f"[cluster] worker {index} did not stop in time, terminating")
+                process.terminate()
+        if self._collector is not None:
+            # Workers flush their reports before exiting, so None arrives after all of them;
+            # what a terminated worker left unfinished stays pending and in the journal.
+            self.results.put(None)
+            await self._collector
+            self._collector = None
+
+
+def report_results(results: Any, sink: Callable[[dict], Awaitable[Any]]):
+    """Worker side: wrap the feeder's sink so the ingress hears when each update is finished."""
+
+    async def handle(payload: dict):
+        try:
+            await sink(payload)
+        finally:
+            results.put(payload["update_id"])
+
+    return handle
+
+
+async def consume_worker_queue(updates: Any, feeder: UpdateFeeder):
+    """Worker side: move updates from the ingress queue into the local feeder until None."""
+    while True:
+        payload = await asyncio.to_thread(updates.get)
+        if payload is None:
+            return
+        while not feeder.submit(payload):
+            await asyncio.sleep(0.05)
+
+
+async def poll_into(
+    bot: Bot,
+    sink: Callable[[dict], Awaitable[Any]],
+    *,
+    allowed_updates: list[str],
+    polling_timeout: int,
+    backoff_config: BackoffConfig,
+    offset: int | None = None,
+    progress: dict | None = None,
+    journal: Callable[[list[dict]], Awaitable[Any]] | None = None,
+):
+    """getUpdates loop that forwards raw updates instead of dispatching them here.
+
+    progress["offset"] tracks the first update_id not yet forwarded. The next getUpdates
+    confirms a batch with Telegram, so `journal` stores it before it is forwarded.
+    """
+    backoff = Backoff(backoff_config)
+    while True:
+        try:
+            updates = await bot(
+                GetUpdates(offset=offset, timeout=polling_timeout, allowed_updates=allowed_updates),
+                request_timeout=int(bot.session.timeout + polling_timeout),
+            )
+        except TelegramRetryAfter as exc:
+            print(f"[cluster] getUpdates flood control, retrying in {exc.retry_after}s")
+            await asyncio.sleep(exc.retry_after)
+            continue
+        except Exception as exc:
+            # Like aiogram's own polling: 5xx, conflicts and the rest are retried, never fatal.
+            delay = next(backoff)
+            print(f"[cluster] getUpdates failed: {type(exc).__name__}: {exc}. Retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        backoff.reset()
+        payloads = [update_to_payload(update) for update in updates]
+        if journal is not None and payloads:
+            await journal(payloads)
+        for payload in payloads:
+            await sink(payload)
+            offset = payload["update_id"] + 1
+            if progress is not None:
+                progress["offset"] = offset
+
+
+def stale_callback_ids(updates: list[Update], now: float, max_age: float) -> set[int]:
+    """update_ids of callback queries provably pressed more than `max_age` seconds ago.
+
+    Callback queries carry no timestamp, but updates arrive in order: a press happened no
+    later than the next dated update (message, payment, member change) after it. Presses
+    with nothing dated after them in the batch are kept.
+    """
+    stale: set[int] = set()
+    next_date: float | None = None
+    for update in reversed(updates):
+        date = getattr(update.event, "date", None)
+        if date is not None:
+            next_date = date.timestamp()
+        elif update.callback_query is not None and next_date is not None and now - next_date > max_age:
+            stale.add(update.update_id)
+    return stale
+
+
+async def catch_up(
+    bot: Bot,
+    sink: Callable[[Update], Awaitable[Any]],
+    *,
+    offset: int | None,
+    allowed_updates: list[str],
+    concurrency: int,
+    max_callback_age: float,
+    progress: dict | None = None,
+    journal: Callable[[list[dict]], Awaitable[Any]] | None = None,
+) -> int | None:
+    """Work through the updates Telegram queued while no process was polling.
+
+    Passing `offset` first confirms everything below it, so updates handled before a
+    restart are not handled twice. Each batch runs at most `concurrency` updates at a
+    time and is finished before the next getUpdates confirms it; when `sink` only hands
+    updates on, `journal` stores the batch first. Returns the offset that regular
+    polling continues from.
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+    handled = skipped = 0
+
+    async def process(update: Update):
+        async with slots:
+            try:
+                await sink(update)
+            except Exception as e:
+                print(f"[catch-up] update {update.update_id} failed: {e}")
+
+    while True:
+        updates = await bot.get_updates(offset=offset, limit=100, timeout=0, allowed_updates=allowed_updates)
+        if not updates:
+            break
+        stale = stale_callback_ids(updates, time.time(), max_callback_age)
+        if journal is not None and len(stale) < len(updates):
+            await journal([update_to_payload(update) for update in updates if update.update_id not in stale])
+        await asyncio.gather(*(process(update) for update in updates if update.update_id not in stale))
+        handled += len(updates) - len(stale)
+        skipped += len(stale)
+        offset = updates[-1].update_id + 1
+        if progress is not None:
+            progress["offset"] = offset
+    if handled or skipped:
+        print(f"[catch-up] handled {handled} queued updates, skipped {skipped} stale callback queries")
+    return offset
+
+
+async def run_as_leader(name: str, job: Callable[[], Awaitable[Any]], ttl: float = 30.0):
+    """Run `job` only while this process holds the `name` lease; other processes stand by.
+
+    The lease is renewed every ttl/3 seconds. If renewal fails (another holder took over
+    after we stalled past the TTL), the job is cancelled until the lease comes back.
+    """
+    task: asyncio.Task | None = None
+    try:
+        while True:
+            try:
+                leader = await try_acquire_lease(name, HOLDER_ID, ttl)
+            except Exception as e:
+                print(f"[lease] {name}: renew failed: {e}")
+                leader = False
+            LEADERSHIP[name] = leader
+            if leader and (task is None or task.done()):
+                print(f"[lease] {name}: acquired by {HOLDER_ID}")
+                task = asyncio.create_task(job())
+            elif not leader and task is not None:
+                print(f"[lease] {name}: lost by {HOLDER_ID}")
+                task.cancel()
+                task = None
+            await asyncio.sleep(ttl / 3)
+    finally:
+        LEADERSHIP[name] = False
+        if task is not None:
+            task.cancel()
+            try:
+                await release_lease(name, HOLDER_ID)
+            except Exception as e:
+                print(f"[lease] {name}: release failed: {e}")
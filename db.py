@@ -1,15 +1,37 @@
+import asyncio
+import contextlib
+import copy
 import datetime as dt
 import json
 import os
-from typing import Iterable
+import time
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Sequence
 
 import aiosqlite
 
+from metrics import DB_SECONDS
+
 DB_PATH = os.getenv("DB_PATH", "bot.db")
 DEFAULT_TIMEZONE = "Europe/Moscow"
 DEFAULT_REMINDER_OFFSETS = "-7,-1,0,7"
 DEFAULT_REMINDER_TIME = "12:00"
 REMINDER_CLEAN_DAYS = 60
+ENSURE_USER_CACHE_SIZE = int(os.getenv("ENSURE_USER_CACHE_SIZE", "50000"))
+
+# tg_id -> username for users already provisioned by ensure_user (LRU).
+_PROVISIONED_USERS: OrderedDict[int, str | None] = OrderedDict()
+
+# Form sessions live in memory and reach user_forms write-behind. _FORM_OWNERS holds every
+# tg_id with a form (loaded from user_forms on first use), so "no form" never hits the DB.
+FORM_TTL_SECONDS = float(os.getenv("FORM_TTL_SECONDS", str(6 * 3600)))
+FORM_FLUSH_INTERVAL = float(os.getenv("FORM_FLUSH_INTERVAL", "1.0"))
+_FORMS: dict[int, dict] = {}
+_FORM_OWNERS: set[int] = set()
+_FORMS_DIRTY: set[int] = set()
+_FORMS_LOADED = False
+_FORMS_LOAD_LOCK = asyncio.Lock()
+_FORMS_FLUSH_TASK: asyncio.Task | None = None
 
 
 def _parse_offsets(raw: str | None) -> list[int]:
@@ -32,9 +54,196 @@ def _parse_reminder_time(raw: str | None) -> dt.time | None:
         return None
 
 
+# -------------------- Write path --------------------
+# SQLite takes one writer at a time. Mutations are queued to a single writer task that owns
+# its connection and applies them in batched transactions: one commit (and fsync) per batch,
+# and no "database is locked" retries between concurrent setters. Each submitted unit runs in
+# its own savepoint, so a failing unit is rolled back alone and the rest of the batch commits.
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "128"))
+DB_WRITE_MAX_DELAY = float(os.getenv("DB_WRITE_MAX_DELAY", "0.002"))
+WRITER_STATS = {"batches": 0, "units": 0, "failed": 0}
+_WRITE_QUEUE: asyncio.Queue | None = None
+_WRITER_TASK: asyncio.Task | None = None
+# Monotonic time the writer took its current batch; None while it waits for work.
+_WRITER_BUSY_SINCE: float | None = None
+
+
+class WriteStatement(NamedTuple):
+    sql: str
+    params: Sequence = ()
+    many: bool = False
+
+
+class WriteResult(NamedTuple):
+    rowcount: int
+    rows: list
+
+
+@contextlib.asynccontextmanager
+async def _connect(op: str):
+    """A connection for one db.py call; the whole call is timed under `op`."""
+    started = time.perf_counter()
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            yield db
+    finally:
+        DB_SECONDS.observe(time.perf_counter() - started, op)
+
+
+async def _apply_statements(db: aiosqlite.Connection, statements: Sequence[WriteStatement]) -> list[WriteResult]:
+    results = []
+    for stmt in statements:
+        if stmt.many:
+            cur = await db.executemany(stmt.sql, stmt.params)
+            rows = []
+        else:
+            cur = await db.execute(stmt.sql, stmt.params)
+            # RETURNING rows; a plain UPDATE/INSERT/DELETE yields none.
+            rows = list(await cur.fetchall())
+        results.append(WriteResult(cur.rowcount, rows))
+        await cur.close()
+    return results
+
+
+async def _commit_batch(db: aiosqlite.Connection, batch: list):
+    started = time.perf_counter()
+    applied = []
+    try:
+        await db.execute("BEGIN IMMEDIATE")
+        for statements, fut in batch:
+            await db.execute("SAVEPOINT write_unit")
+            try:
+                result = await _apply_statements(db, statements)
+            except Exception as e:
+                await db.execute("ROLLBACK TO write_unit")
+                await db.execute("RELEASE write_unit")
+                WRITER_STATS["failed"] += 1
+                if not fut.done():
+                    fut.set_exception(e)
+                continue
+            await db.execute("RELEASE write_unit")
+            applied.append((fut, result))
+        await db.commit()
+    except Exception as e:
+        print(f"[db] write batch failed: {e}")
+        with contextlib.suppress(Exception):
+            await db.rollback()
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_exception(e)
+        return
+    WRITER_STATS["batches"] += 1
+    WRITER_STATS["units"] += len(applied)
+    DB_SECONDS.observe(time.perf_counter() - started, "write_batch")
+    for fut, result in applied:
+        if not fut.done():
+            fut.set_result(result)
+
+
+async def _writer_loop(queue: asyncio.Queue):
+    global _WRITER_BUSY_SINCE
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            stopping = False
+            while not stopping:
+                job = await queue.get()
+                if job is None:
+                    break
+                batch = [job]
+                # Give the taps that arrive right behind this one a moment to join the batch.
+                if DB_WRITE_MAX_DELAY > 0 and queue.qsize() < DB_WRITE_BATCH_SIZE - 1:
+                    await asyncio.sleep(DB_WRITE_MAX_DELAY)
+                while len(batch) < DB_WRITE_BATCH_SIZE:
+                    try:
+                        job = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if job is None:
+                        stopping = True
+                        break
+                    batch.append(job)
+                _WRITER_BUSY_SINCE = time.monotonic()
+                try:
+                    await _commit_batch(db, batch)
+                finally:
+                    _WRITER_BUSY_SINCE = None
+    finally:
+        # Don't leave callers waiting on a writer that is gone.
+        while not queue.empty():
+            job = queue.get_nowait()
+            if job is not None and not job[1].done():
+                job[1].set_exception(RuntimeError("database writer stopped"))
+
+
+def start_db_writer():
+    global _WRITE_QUEUE, _WRITER_TASK
+    if _WRITER_TASK and not _WRITER_TASK.done():
+        return
+    _WRITE_QUEUE = asyncio.Queue()
+    _WRITER_TASK = asyncio.create_task(_writer_loop(_WRITE_QUEUE))
+
+
+async def stop_db_writer():
+    """Apply everything already queued, then stop the writer task."""
+    global _WRITE_QUEUE, _WRITER_TASK
+    if _WRITER_TASK is None:
+        return
+    queue, task = _WRITE_QUEUE, _WRITER_TASK
+    _WRITE_QUEUE, _WRITER_TASK = None, None
+    queue.put_nowait(None)
+    await task
+
+
+async def run_write(statements: Sequence[WriteStatement]) -> list[WriteResult]:
+    """Apply statements as one atomic unit and return a WriteResult per statement."""
+    if _WRITER_TASK is None or _WRITER_TASK.done():
+        # No writer running (scripts, startup): commit on a connection of our own.
+        async with _connect("write") as db:
+            result = await _apply_statements(db, statements)
+            await db.commit()
+        return result
+    started = time.perf_counter()
+    fut = asyncio.get_running_loop().create_future()
+    _WRITE_QUEUE.put_nowait((statements, fut))
+    try:
+        return await fut
+    finally:
+        # Queue wait included: what a setter's caller actually waits for.
+        DB_SECONDS.observe(time.perf_counter() - started, "write")
+
+
+def write_queue_depth() -> int:
+    return _WRITE_QUEUE.qsize() if _WRITE_QUEUE is not None else 0
+
+
+def db_writer_alive() -> bool:
+    return _WRITER_TASK is not None and not _WRITER_TASK.done()
+
+
+def writer_busy_for() -> float:
+    """Seconds the writer has been on its current batch; 0 while it waits for work."""
+    return 0.0 if _WRITER_BUSY_SINCE is None else time.monotonic() - _WRITER_BUSY_SINCE
+
+
+async def ping_db():
+    """A read on a fresh connection: the file opens and answers.
+
+    Under WAL readers never wait for the writer, so a stuck write does not show up
+    here; writer_busy_for() covers that.
+    """
+    async with _connect("ping") as db:
+        cur = await db.execute("SELECT 1 FROM bot_state LIMIT 1")
+        await cur.fetchall()
+
+
+async def execute_write(sql: str, params: Sequence = ()) -> int:
+    """Queue one statement; returns its rowcount once the batch is committed."""
+    return (await run_write([WriteStatement(sql, params)]))[0].rowcount
+
+
 async def init_db():
     """Initialize the SQLite database schema and tuning pragmas."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("init_db") as db:
         await db.execute("PRAGMA journal_mode=WAL;")
         await db.execute("PRAGMA synchronous=NORMAL;")
         await db.execute("PRAGMA temp_store=MEMORY;")
@@ -89,6 +298,14 @@ async def init_db():
             await db.execute("ALTER TABLE users ADD COLUMN export_unlocked INTEGER DEFAULT 0")
         except Exception:
             pass
+        # Compact progress storage; NULL tasks_mask marks a user whose legacy
+        # user_tasks/user_accounts rows have not been migrated yet. Account statuses
+        # are a {key: status} object so ACCOUNTS can be reordered or trimmed freely.
+        for column in ("tasks_mask INTEGER", "accounts_json TEXT", "focus_show_completed INTEGER"):
+            try:
+                await db.execute(f"ALTER TABLE users ADD COLUMN {column}")
+            except Exception:
+                pass
         await db.execute("""
         CREATE TABLE IF NOT EXISTS reminder_log (
             tg_id INTEGER,
@@ -122,6 +339,21 @@ async def init_db():
             PRIMARY KEY (tg_id, key)
         )
         """)
+        # Fold the legacy per-row progress into the users columns before anything can
+        # write them, so a COALESCE-based update never masks an unmigrated user.
+        await db.execute(
+            "UPDATE users SET "
+            "tasks_mask = (SELECT COALESCE(SUM(1 << (task_id - 1)), 0) FROM user_tasks "
+            "WHERE tg_id=users.tg_id AND done AND task_id BETWEEN 1 AND ?), "
+            "accounts_json = (SELECT json_group_object(key, status % 3) FROM user_accounts "
+            "WHERE tg_id=users.tg_id), "
+            "focus_show_completed = COALESCE((SELECT done != 0 FROM user_tasks "
+            "WHERE tg_id=users.tg_id AND task_id=?), 0) "
+            "WHERE tasks_mask IS NULL",
+            (MAX_TASK_ID, FOCUS_SHOW_COMPLETED_TASK_ID),
+        )
+        await db.execute("DELETE FROM user_tasks WHERE tg_id IN (SELECT tg_id FROM users)")
+        await db.execute("DELETE FROM user_accounts WHERE tg_id IN (SELECT tg_id FROM users)")
         await db.execute("""
         CREATE TABLE IF NOT EXISTS user_forms (
             tg_id INTEGER PRIMARY KEY,
@@ -233,89 +465,169 @@ async def init_db():
             PRIMARY KEY (tg_id, task_id, key)
         )
         """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS cover_cache (
+            cover_url TEXT PRIMARY KEY,
+            content_hash TEXT,
+            file_id TEXT NOT NULL,
+            created_at TEXT
+        )
+        """)
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cover_cache_hash ON cover_cache(content_hash)"
+        )
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            processed_at REAL NOT NULL
+        )
+        """)
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_processed_updates_at ON processed_updates(processed_at)"
+        )
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS processed_payments (
+            charge_id TEXT PRIMARY KEY,
+            tg_id INTEGER,
+            processed_at REAL NOT NULL
+        )
+        """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """)
+        # Updates the polling ingress confirmed with Telegram but no worker has finished yet.
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS pending_updates (
+            update_id INTEGER PRIMARY KEY,
+            payload TEXT
+        )
+        """)
         await db.commit()
 
 
-async def ensure_user(
-    tg_id: int,
-    username: str | None = None,
-    tasks: Iterable[tuple[int, str]] | None = None,
-    accounts: Iterable[tuple[str, str]] | None = None,
-):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR IGNORE INTO users (tg_id) VALUES (?)", (tg_id,))
-        if username is not None:
-            await db.execute("UPDATE users SET username=? WHERE tg_id=?", (username, tg_id))
-        for task_id, _ in tasks or []:
-            await db.execute("INSERT OR IGNORE INTO user_tasks (tg_id, task_id) VALUES (?, ?)", (tg_id, task_id))
-        for key, _ in accounts or []:
-            await db.execute("INSERT OR IGNORE INTO user_accounts (tg_id, key) VALUES (?, ?)", (tg_id, key))
-        await db.commit()
+FOCUS_SHOW_COMPLETED_TASK_ID = -1000
+MAX_TASK_ID = 62
+
+
+def _task_bit(task_id: int) -> int:
+    if not 1 <= task_id <= MAX_TASK_ID:
+        raise ValueError(f"task_id out of range: {task_id}")
+    return 1 << (task_id - 1)
+
+
+def mask_to_state(mask: int) -> dict[int, int]:
+    return {bit + 1: 1 for bit in range(mask.bit_length()) if mask >> bit & 1}
+
+
+def accounts_from_json(raw: str | None, account_keys: Iterable[str]) -> dict[str, int]:
+    stored = json.loads(raw) if raw else {}
+    return {key: int(stored.get(key) or 0) % 3 for key in account_keys}
+
+
+async def ensure_user(tg_id: int, username: str | None = None):
+    """Create the user row or refresh its username; users seen before return without touching the DB.
+
+    Progress lives in users columns with defaults, so there is nothing per task or account
+    to provision; legacy per-row progress is folded in once by init_db.
+    """
+    if tg_id in _PROVISIONED_USERS and (username is None or _PROVISIONED_USERS[tg_id] == username):
+        _PROVISIONED_USERS.move_to_end(tg_id)
+        return
+
+    # Write-first on the writer: concurrent first updates from new users queue behind
+    # each other instead of racing for the file lock.
+    await execute_write(
+        "INSERT INTO users (tg_id, username, tasks_mask, accounts_json, focus_show_completed) "
+        "VALUES (?, ?, 0, '{}', 0) "
+        "ON CONFLICT(tg_id) DO UPDATE SET username = excluded.username "
+        "WHERE excluded.username IS NOT NULL AND users.username IS NOT excluded.username",
+        (tg_id, username),
+    )
+
+    _PROVISIONED_USERS[tg_id] = username
+    _PROVISIONED_USERS.move_to_end(tg_id)
+    while len(_PROVISIONED_USERS) > ENSURE_USER_CACHE_SIZE:
+        _PROVISIONED_USERS.popitem(last=False)
 
 
 async def get_experience(tg_id: int) -> str:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_experience") as db:
         cur = await db.execute("SELECT experience FROM users WHERE tg_id=?", (tg_id,))
         row = await cur.fetchone()
         return row[0] if row and row[0] else "unknown"
 
 
 async def set_experience(tg_id: int, exp: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE users SET experience=? WHERE tg_id=?", (exp, tg_id))
-        await db.commit()
+    await execute_write("UPDATE users SET experience=? WHERE tg_id=?", (exp, tg_id))
 
 
 async def set_release_date(tg_id: int, date_str: str | None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT release_date FROM users WHERE tg_id=?", (tg_id,))
-        row = await cur.fetchone()
-        current = row[0] if row else None
-        if current == date_str:
-            return
-        await db.execute("UPDATE users SET release_date=? WHERE tg_id=?", (date_str, tg_id))
-        await db.execute("DELETE FROM reminder_log WHERE tg_id=?", (tg_id,))
-        await db.commit()
+    # Only a changed date clears the reminders already sent for the old one.
+    await run_write([
+        WriteStatement(
+            "DELETE FROM reminder_log WHERE tg_id=? AND EXISTS "
+            "(SELECT 1 FROM users WHERE tg_id=? AND release_date IS NOT ?)",
+            (tg_id, tg_id, date_str),
+        ),
+        WriteStatement(
+            "UPDATE users SET release_date=? WHERE tg_id=? AND release_date IS NOT ?", (date_str, tg_id, date_str)
+        ),
+    ])
 
 
 async def get_release_date(tg_id: int) -> str | None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_release_date") as db:
         cur = await db.execute("SELECT release_date FROM users WHERE tg_id=?", (tg_id,))
         row = await cur.fetchone()
         return row[0] if row and row[0] else None
 
 
 async def set_reminders_enabled(tg_id: int, enabled: bool):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT reminders_enabled FROM users WHERE tg_id=?", (tg_id,))
-        row = await cur.fetchone()
-        current = row[0] if row else 1
-        if current == (1 if enabled else 0):
-            return
-        await db.execute("UPDATE users SET reminders_enabled=? WHERE tg_id=?", (1 if enabled else 0, tg_id))
-        await db.commit()
+    value = 1 if enabled else 0
+    await execute_write(
+        "UPDATE users SET reminders_enabled=? WHERE tg_id=? AND reminders_enabled IS NOT ?", (value, tg_id, value)
+    )
 
 
 async def get_reminders_enabled(tg_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_reminders_enabled") as db:
         cur = await db.execute("SELECT reminders_enabled FROM users WHERE tg_id=?", (tg_id,))
         row = await cur.fetchone()
         return bool(row[0]) if row and row[0] is not None else True
 
 
+async def toggle_reminders_and_get_release_date(tg_id: int) -> tuple[bool, str | None]:
+    """Flip reminders_enabled; returns the new flag and the release date the timeline renders."""
+    [result] = await run_write([
+        WriteStatement(
+            "UPDATE users SET reminders_enabled = CASE WHEN reminders_enabled THEN 0 ELSE 1 END WHERE tg_id=? "
+            "RETURNING reminders_enabled, release_date",
+            (tg_id,),
+        )
+    ])
+    if not result.rows:
+        return False, None
+    enabled, release_date = result.rows[0]
+    return bool(enabled), release_date or None
+
+
 async def toggle_reminders_enabled(tg_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT reminders_enabled FROM users WHERE tg_id=?", (tg_id,))
-        row = await cur.fetchone()
-        current = row[0] if row else 1
-        new_value = 0 if current else 1
-        await db.execute("UPDATE users SET reminders_enabled=? WHERE tg_id=?", (new_value, tg_id))
-        await db.commit()
-        return bool(new_value)
+    enabled, _ = await toggle_reminders_and_get_release_date(tg_id)
+    return enabled
 
 
 async def get_user_reminder_prefs(tg_id: int) -> tuple[str, list[int], dt.time | None]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_user_reminder_prefs") as db:
         cur = await db.execute(
             "SELECT timezone, reminder_offsets, reminder_time FROM users WHERE tg_id=?",
             (tg_id,),
@@ -328,42 +640,43 @@ async def get_user_reminder_prefs(tg_id: int) -> tuple[str, list[int], dt.time |
 
 
 async def get_updates_opt_in(tg_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_updates_opt_in") as db:
         cur = await db.execute("SELECT updates_opt_in FROM users WHERE tg_id=?", (tg_id,))
         row = await cur.fetchone()
         return bool(row[0]) if row and row[0] is not None else True
 
 
 async def set_updates_opt_in(tg_id: int, enabled: bool):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE users SET updates_opt_in=? WHERE tg_id=?", (1 if enabled else 0, tg_id))
-        await db.commit()
+    await execute_write("UPDATE users SET updates_opt_in=? WHERE tg_id=?", (1 if enabled else 0, tg_id))
 
 
 async def set_export_unlocked(tg_id: int, unlocked: bool = True):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET export_unlocked=? WHERE tg_id=?",
-            (1 if unlocked else 0, tg_id),
-        )
-        await db.commit()
+    await execute_write(
+        "UPDATE users SET export_unlocked=? WHERE tg_id=?",
+        (1 if unlocked else 0, tg_id),
+    )
 
 
 async def get_export_unlocked(tg_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_export_unlocked") as db:
         cur = await db.execute("SELECT export_unlocked FROM users WHERE tg_id=?", (tg_id,))
         row = await cur.fetchone()
         return bool(row[0]) if row and row[0] is not None else False
 
 
 async def toggle_updates_opt_in(tg_id: int) -> bool:
-    enabled = await get_updates_opt_in(tg_id)
-    await set_updates_opt_in(tg_id, not enabled)
-    return not enabled
+    [result] = await run_write([
+        WriteStatement(
+            "UPDATE users SET updates_opt_in = CASE WHEN COALESCE(updates_opt_in, 1) THEN 0 ELSE 1 END "
+            "WHERE tg_id=? RETURNING updates_opt_in",
+            (tg_id,),
+        )
+    ])
+    return bool(result.rows[0][0]) if result.rows else False
 
 
 async def get_last_update_notified(tg_id: int) -> str | None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_last_update_notified") as db:
         cur = await db.execute("SELECT last_update_notified FROM users WHERE tg_id=?", (tg_id,))
         row = await cur.fetchone()
         return row[0] if row and row[0] else None
@@ -381,109 +694,115 @@ async def set_last_update_notified(
         if commit:
             await db.commit()
         return
-    async with aiosqlite.connect(DB_PATH) as db_conn:
-        await db_conn.execute("UPDATE users SET last_update_notified=? WHERE tg_id=?", (value, tg_id))
-        await db_conn.commit()
+    await execute_write("UPDATE users SET last_update_notified=? WHERE tg_id=?", (value, tg_id))
+
+
+async def get_tasks_mask(tg_id: int) -> int:
+    async with _connect("get_tasks_mask") as db:
+        cur = await db.execute("SELECT COALESCE(tasks_mask, 0) FROM users WHERE tg_id=?", (tg_id,))
+        row = await cur.fetchone()
+    return row[0] if row else 0
 
 
 async def get_tasks_state(tg_id: int) -> dict[int, int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT task_id, done FROM user_tasks WHERE tg_id=? AND task_id > 0", (tg_id,)
-        )
-        rows = await cur.fetchall()
-        return {tid: done for tid, done in rows}
+    """Done tasks as {task_id: 1}; tasks that are not done are absent."""
+    return mask_to_state(await get_tasks_mask(tg_id))
 
 
 async def toggle_task(tg_id: int, task_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE user_tasks SET done = 1 - done WHERE tg_id=? AND task_id=?", (tg_id, task_id))
-        await db.commit()
+    bit = _task_bit(task_id)
+    # SQLite has no XOR operator: (a | b) - (a & b).
+    await execute_write(
+        "UPDATE users SET tasks_mask = (COALESCE(tasks_mask, 0) | ?) - (COALESCE(tasks_mask, 0) & ?) WHERE tg_id=?",
+        (bit, bit, tg_id),
+    )
+
+
+async def toggle_task_mask(tg_id: int, task_id: int) -> int:
+    """Flip one task and return the resulting tasks_mask."""
+    bit = _task_bit(task_id)
+    [result] = await run_write([
+        WriteStatement(
+            "UPDATE users SET tasks_mask = (COALESCE(tasks_mask, 0) | ?) - (COALESCE(tasks_mask, 0) & ?) "
+            "WHERE tg_id=? RETURNING tasks_mask",
+            (bit, bit, tg_id),
+        )
+    ])
+    return result.rows[0][0] if result.rows else 0
 
 
 async def toggle_task_and_get_state(tg_id: int, task_id: int) -> dict[int, int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE user_tasks SET done = 1 - done WHERE tg_id=? AND task_id=?", (tg_id, task_id))
-        cur = await db.execute("SELECT task_id, done FROM user_tasks WHERE tg_id=?", (tg_id,))
-        rows = await cur.fetchall()
-        await db.commit()
-        return {tid: done for tid, done in rows}
+    return mask_to_state(await toggle_task_mask(tg_id, task_id))
 
 
 async def set_task_done(tg_id: int, task_id: int, done: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT done FROM user_tasks WHERE tg_id=? AND task_id=?", (tg_id, task_id))
-        row = await cur.fetchone()
-        current = row[0] if row else 0
-        if current == done:
-            return False
-        await db.execute("UPDATE user_tasks SET done=? WHERE tg_id=? AND task_id=?", (done, tg_id, task_id))
-        await db.commit()
-        return True
-
-
-FOCUS_SHOW_COMPLETED_TASK_ID = -1000
+    bit = _task_bit(task_id)
+    if done:
+        sql = "UPDATE users SET tasks_mask = COALESCE(tasks_mask, 0) | ? WHERE tg_id=? AND (COALESCE(tasks_mask, 0) & ?) = 0"
+    else:
+        sql = "UPDATE users SET tasks_mask = tasks_mask & ~? WHERE tg_id=? AND (COALESCE(tasks_mask, 0) & ?) != 0"
+    return await execute_write(sql, (bit, tg_id, bit)) > 0
 
 
 async def get_focus_show_completed(tg_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT done FROM user_tasks WHERE tg_id=? AND task_id=?",
-            (tg_id, FOCUS_SHOW_COMPLETED_TASK_ID),
-        )
+    async with _connect("get_focus_show_completed") as db:
+        cur = await db.execute("SELECT focus_show_completed FROM users WHERE tg_id=?", (tg_id,))
         row = await cur.fetchone()
     return bool(row[0]) if row else False
 
 
 async def set_focus_show_completed(tg_id: int, show: bool):
-    value = 1 if show else 0
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO user_tasks (tg_id, task_id, done) VALUES (?, ?, ?) "
-            "ON CONFLICT(tg_id, task_id) DO UPDATE SET done=excluded.done",
-            (tg_id, FOCUS_SHOW_COMPLETED_TASK_ID, value),
-        )
-        await db.commit()
+    await execute_write("UPDATE users SET focus_show_completed=? WHERE tg_id=?", (1 if show else 0, tg_id))
 
 
-async def get_accounts_state(tg_id: int) -> dict[str, int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT key, status FROM user_accounts WHERE tg_id=?", (tg_id,))
-        rows = await cur.fetchall()
-        return {k: (s if s is not None else 0) for k, s in rows}
+async def toggle_focus_show_completed(tg_id: int) -> bool:
+    [result] = await run_write([
+        WriteStatement(
+            "UPDATE users SET focus_show_completed = 1 - COALESCE(focus_show_completed, 0) "
+            "WHERE tg_id=? RETURNING focus_show_completed",
+            (tg_id,),
+        )
+    ])
+    return bool(result.rows[0][0]) if result.rows else False
 
 
-async def cycle_account_status(tg_id: int, key: str, status_fn) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT status FROM user_accounts WHERE tg_id=? AND key=?", (tg_id, key))
+async def get_accounts_state(tg_id: int, account_keys: Iterable[str]) -> dict[str, int]:
+    async with _connect("get_accounts_state") as db:
+        cur = await db.execute("SELECT accounts_json FROM users WHERE tg_id=?", (tg_id,))
         row = await cur.fetchone()
-        current = row[0] if row and row[0] is not None else 0
-        new = status_fn(current)
-        await db.execute("UPDATE user_accounts SET status=? WHERE tg_id=? AND key=?", (new, tg_id, key))
-        await db.commit()
-        return new
+    return accounts_from_json(row[0] if row else None, account_keys)
+
+
+async def cycle_account_status(tg_id: int, key: str, account_keys: Iterable[str]) -> dict[str, int]:
+    """Advance one account 0 -> 1 -> 2 -> 0 in place; returns every account's new status."""
+    path = '$."' + key.replace('"', "") + '"'
+    [result] = await run_write([
+        WriteStatement(
+            "UPDATE users SET accounts_json = json_set(COALESCE(accounts_json, '{}'), ?, "
+            "(COALESCE(json_extract(accounts_json, ?), 0) + 1) % 3) "
+            "WHERE tg_id=? RETURNING accounts_json",
+            (path, path, tg_id),
+        )
+    ])
+    return accounts_from_json(result.rows[0][0] if result.rows else None, account_keys)
 
 
 async def add_important_task(tg_id: int, task_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO important_tasks (tg_id, task_id) VALUES (?, ?)",
-            (tg_id, task_id)
-        )
-        await db.commit()
+    await execute_write(
+        "INSERT OR IGNORE INTO important_tasks (tg_id, task_id) VALUES (?, ?)",
+        (tg_id, task_id)
+    )
 
 
 async def remove_important_task(tg_id: int, task_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM important_tasks WHERE tg_id=? AND task_id=?",
-            (tg_id, task_id)
-        )
-        await db.commit()
+    await execute_write(
+        "DELETE FROM important_tasks WHERE tg_id=? AND task_id=?",
+        (tg_id, task_id)
+    )
 
 
 async def get_important_tasks(tg_id: int) -> set[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_important_tasks") as db:
         cur = await db.execute(
             "SELECT task_id FROM important_tasks WHERE tg_id=?",
             (tg_id,),
@@ -493,43 +812,28 @@ async def get_important_tasks(tg_id: int) -> set[int]:
 
 
 async def toggle_important_task(tg_id: int, task_id: int) -> set[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT task_id FROM important_tasks WHERE tg_id=?",
-            (tg_id,),
-        )
-        rows = await cur.fetchall()
-        important = {r[0] for r in rows}
-        if task_id in important:
-            await db.execute(
-                "DELETE FROM important_tasks WHERE tg_id=? AND task_id=?",
-                (tg_id, task_id)
-            )
-        else:
-            await db.execute(
-                "INSERT OR IGNORE INTO important_tasks (tg_id, task_id) VALUES (?, ?)",
-                (tg_id, task_id)
-            )
-        cur = await db.execute(
-            "SELECT task_id FROM important_tasks WHERE tg_id=?",
-            (tg_id,),
-        )
-        rows = await cur.fetchall()
-        await db.commit()
-        return {r[0] for r in rows}
+    """Mark or unmark a task as important; returns the user's important set afterwards."""
+    # One unit on the writer: the insert only runs when the delete found nothing (changes() = 0).
+    *_, result = await run_write([
+        WriteStatement("DELETE FROM important_tasks WHERE tg_id=? AND task_id=?", (tg_id, task_id)),
+        WriteStatement(
+            "INSERT OR IGNORE INTO important_tasks (tg_id, task_id) SELECT ?, ? WHERE changes() = 0",
+            (tg_id, task_id),
+        ),
+        WriteStatement("SELECT task_id FROM important_tasks WHERE tg_id=?", (tg_id,)),
+    ])
+    return {r[0] for r in result.rows}
 
 
 async def save_qc_check(tg_id: int, task_id: int, key: str, value: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO qc_checks (tg_id, task_id, key, value) VALUES (?, ?, ?, ?)",
-            (tg_id, task_id, key, value)
-        )
-        await db.commit()
+    await execute_write(
+        "INSERT OR REPLACE INTO qc_checks (tg_id, task_id, key, value) VALUES (?, ?, ?, ?)",
+        (tg_id, task_id, key, value)
+    )
 
 
 async def was_qc_checked(tg_id: int, task_id: int, key: str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("was_qc_checked") as db:
         cur = await db.execute(
             "SELECT 1 FROM qc_checks WHERE tg_id=? AND task_id=? AND key=?",
             (tg_id, task_id, key)
@@ -539,29 +843,27 @@ async def was_qc_checked(tg_id: int, task_id: int, key: str) -> bool:
 
 
 async def reset_progress_only(tg_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE user_tasks SET done=0 WHERE tg_id=?", (tg_id,))
-        await db.execute("UPDATE user_accounts SET status=0 WHERE tg_id=?", (tg_id,))
-        await db.commit()
+    await execute_write(
+        "UPDATE users SET tasks_mask=0, accounts_json='{}', focus_show_completed=0 WHERE tg_id=?", (tg_id,)
+    )
 
 
 async def reset_all_data(tg_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE user_tasks SET done=0 WHERE tg_id=?", (tg_id,))
-        await db.execute("UPDATE user_accounts SET status=0 WHERE tg_id=?", (tg_id,))
-        await db.execute("DELETE FROM important_tasks WHERE tg_id=?", (tg_id,))
-        await db.execute("DELETE FROM qc_checks WHERE tg_id=?", (tg_id,))
-        await db.execute("DELETE FROM reminder_log WHERE tg_id=?", (tg_id,))
-        await db.execute("DELETE FROM smartlink_subscriptions WHERE subscriber_tg_id=?", (tg_id,))
-        await db.execute("DELETE FROM smartlink_reminders WHERE tg_id=?", (tg_id,))
-        await db.execute("DELETE FROM smartlink_reminder_sends WHERE tg_id=?", (tg_id,))
-        await db.execute("DELETE FROM smartlinks WHERE owner_tg_id=?", (tg_id,))
-        await db.execute(
-            "UPDATE users SET release_date=NULL, reminders_enabled=1 WHERE tg_id=?",
-            (tg_id,)
-        )
-        await db.execute("DELETE FROM user_forms WHERE tg_id=?", (tg_id,))
-        await db.commit()
+    await run_write([
+        WriteStatement(
+            "UPDATE users SET tasks_mask=0, accounts_json='{}', focus_show_completed=0 WHERE tg_id=?", (tg_id,)
+        ),
+        WriteStatement("DELETE FROM important_tasks WHERE tg_id=?", (tg_id,)),
+        WriteStatement("DELETE FROM qc_checks WHERE tg_id=?", (tg_id,)),
+        WriteStatement("DELETE FROM reminder_log WHERE tg_id=?", (tg_id,)),
+        WriteStatement("DELETE FROM smartlink_subscriptions WHERE subscriber_tg_id=?", (tg_id,)),
+        WriteStatement("DELETE FROM smartlink_reminders WHERE tg_id=?", (tg_id,)),
+        WriteStatement("DELETE FROM smartlink_reminder_sends WHERE tg_id=?", (tg_id,)),
+        WriteStatement("DELETE FROM smartlinks WHERE owner_tg_id=?", (tg_id,)),
+        WriteStatement("UPDATE users SET release_date=NULL, reminders_enabled=1 WHERE tg_id=?", (tg_id,)),
+        WriteStatement("DELETE FROM user_forms WHERE tg_id=?", (tg_id,)),
+    ])
+    _forget_form(tg_id)
 
 
 def _smartlink_row_to_dict(row) -> dict:
@@ -598,11 +900,12 @@ async def save_smartlink(
     reminders_enabled: bool = True,
     project_id: int | None = None,
 ) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
+    [result] = await run_write([
+        WriteStatement(
             """
             INSERT INTO smartlinks (owner_tg_id, artist, title, release_date, pre_save_enabled, reminders_enabled, project_id, cover_file_id, links_json, caption_text, branding_disabled, created_at)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
             """,
             (
                 owner_tg_id,
@@ -619,21 +922,54 @@ async def save_smartlink(
                 dt.datetime.utcnow().isoformat(),
             ),
         )
-        await db.commit()
-        return cur.lastrowid
+    ])
+    return result.rows[0][0]
+
+
+async def save_smartlinks(owner_tg_id: int, items: list[dict]) -> int:
+    """Insert several smartlinks in one transaction; returns how many were saved."""
+    if not items:
+        return 0
+    created_at = dt.datetime.utcnow().isoformat()
+    rows = [
+        (
+            owner_tg_id,
+            item.get("artist") or "",
+            item.get("title") or "",
+            item.get("release_date") or "",
+            1 if item.get("pre_save_enabled", True) else 0,
+            1 if item.get("reminders_enabled", True) else 0,
+            item.get("project_id"),
+            item.get("cover_file_id") or "",
+            json.dumps(item.get("links") or {}, ensure_ascii=False),
+            item.get("caption_text") or "",
+            1 if item.get("branding_disabled") else 0,
+            created_at,
+        )
+        for item in items
+    ]
+    await run_write([
+        WriteStatement(
+            """
+            INSERT INTO smartlinks (owner_tg_id, artist, title, release_date, pre_save_enabled, reminders_enabled, project_id, cover_file_id, links_json, caption_text, branding_disabled, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+            many=True,
+        )
+    ])
+    return len(rows)
 
 
 async def update_smartlink_caption(smartlink_id: int, caption_text: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE smartlinks SET caption_text=? WHERE id=?",
-            (caption_text, smartlink_id),
-        )
-        await db.commit()
+    await execute_write(
+        "UPDATE smartlinks SET caption_text=? WHERE id=?",
+        (caption_text, smartlink_id),
+    )
 
 
 async def get_latest_smartlink(owner_tg_id: int) -> dict | None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_latest_smartlink") as db:
         cur = await db.execute(
             "SELECT id, owner_tg_id, artist, title, release_date, pre_save_enabled, reminders_enabled, project_id, cover_file_id, links_json, caption_text, branding_disabled, created_at, branding_paid FROM smartlinks WHERE owner_tg_id=? ORDER BY id DESC LIMIT 1",
             (owner_tg_id,),
@@ -643,7 +979,7 @@ async def get_latest_smartlink(owner_tg_id: int) -> dict | None:
 
 
 async def get_smartlink_by_id(smartlink_id: int) -> dict | None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_smartlink_by_id") as db:
         cur = await db.execute(
             "SELECT id, owner_tg_id, artist, title, release_date, pre_save_enabled, reminders_enabled, project_id, cover_file_id, links_json, caption_text, branding_disabled, created_at, branding_paid FROM smartlinks WHERE id=?",
             (smartlink_id,),
@@ -653,7 +989,7 @@ async def get_smartlink_by_id(smartlink_id: int) -> dict | None:
 
 
 async def list_smartlinks(owner_tg_id: int, limit: int = 5, offset: int = 0) -> list[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("list_smartlinks") as db:
         cur = await db.execute(
             "SELECT id, owner_tg_id, artist, title, release_date, pre_save_enabled, reminders_enabled, project_id, cover_file_id, links_json, caption_text, branding_disabled, created_at, branding_paid FROM smartlinks WHERE owner_tg_id=? ORDER BY id DESC LIMIT ? OFFSET ?",
             (owner_tg_id, limit, offset),
@@ -662,7 +998,7 @@ async def list_smartlinks(owner_tg_id: int, limit: int = 5, offset: int = 0) ->
 
 
 async def count_smartlinks(owner_tg_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("count_smartlinks") as db:
         cur = await db.execute("SELECT COUNT(*) FROM smartlinks WHERE owner_tg_id=?", (owner_tg_id,))
         row = await cur.fetchone()
         return int(row[0]) if row else 0
@@ -706,41 +1042,37 @@ async def update_smartlink_data(smartlink_id: int, owner_tg_id: int, updates: di
 
     params.extend([smartlink_id, owner_tg_id])
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            f"UPDATE smartlinks SET {', '.join(fields)} WHERE id=? AND owner_tg_id=?",
-            params,
-        )
-        await db.commit()
+    await execute_write(
+        f"UPDATE smartlinks SET {', '.join(fields)} WHERE id=? AND owner_tg_id=?",
+        params,
+    )
     return True
 
 
 async def delete_smartlink(smartlink_id: int, owner_tg_id: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM smartlinks WHERE id=? AND owner_tg_id=?", (smartlink_id, owner_tg_id))
-        await db.execute("DELETE FROM smartlink_subscriptions WHERE smartlink_id=?", (smartlink_id,))
-        await db.execute("DELETE FROM smartlink_reminders WHERE smartlink_id=?", (smartlink_id,))
-        await db.execute("DELETE FROM smartlink_reminder_sends WHERE smartlink_id=?", (smartlink_id,))
-        await db.commit()
+    await run_write([
+        WriteStatement("DELETE FROM smartlinks WHERE id=? AND owner_tg_id=?", (smartlink_id, owner_tg_id)),
+        WriteStatement("DELETE FROM smartlink_subscriptions WHERE smartlink_id=?", (smartlink_id,)),
+        WriteStatement("DELETE FROM smartlink_reminders WHERE smartlink_id=?", (smartlink_id,)),
+        WriteStatement("DELETE FROM smartlink_reminder_sends WHERE smartlink_id=?", (smartlink_id,)),
+    ])
 
 
 async def set_smartlink_subscription(smartlink_id: int, subscriber_tg_id: int, subscribed: bool):
-    async with aiosqlite.connect(DB_PATH) as db:
-        if subscribed:
-            await db.execute(
-                "INSERT OR REPLACE INTO smartlink_subscriptions (smartlink_id, subscriber_tg_id, notified) VALUES (?, ?, 0)",
-                (smartlink_id, subscriber_tg_id),
-            )
-        else:
-            await db.execute(
-                "DELETE FROM smartlink_subscriptions WHERE smartlink_id=? AND subscriber_tg_id=?",
-                (smartlink_id, subscriber_tg_id),
-            )
-        await db.commit()
+    if subscribed:
+        await execute_write(
+            "INSERT OR REPLACE INTO smartlink_subscriptions (smartlink_id, subscriber_tg_id, notified) VALUES (?, ?, 0)",
+            (smartlink_id, subscriber_tg_id),
+        )
+    else:
+        await execute_write(
+            "DELETE FROM smartlink_subscriptions WHERE smartlink_id=? AND subscriber_tg_id=?",
+            (smartlink_id, subscriber_tg_id),
+        )
 
 
 async def is_smartlink_subscribed(smartlink_id: int, subscriber_tg_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("is_smartlink_subscribed") as db:
         cur = await db.execute(
             "SELECT 1 FROM smartlink_subscriptions WHERE smartlink_id=? AND subscriber_tg_id=?",
             (smartlink_id, subscriber_tg_id),
@@ -750,7 +1082,7 @@ async def is_smartlink_subscribed(smartlink_id: int, subscriber_tg_id: int) -> b
 
 
 async def get_smartlink_subscribers(smartlink_id: int) -> list[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_smartlink_subscribers") as db:
         cur = await db.execute(
             "SELECT subscriber_tg_id FROM smartlink_subscriptions WHERE smartlink_id=?",
             (smartlink_id,),
@@ -759,62 +1091,287 @@ async def get_smartlink_subscribers(smartlink_id: int) -> list[int]:
 
 
 async def mark_smartlink_notified(smartlink_id: int, subscriber_tg_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE smartlink_subscriptions SET notified=1 WHERE smartlink_id=? AND subscriber_tg_id=?",
-            (smartlink_id, subscriber_tg_id),
-        )
-        await db.commit()
+    await execute_write(
+        "UPDATE smartlink_subscriptions SET notified=1 WHERE smartlink_id=? AND subscriber_tg_id=?",
+        (smartlink_id, subscriber_tg_id),
+    )
 
 
 async def get_smartlinks_with_release() -> list[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_smartlinks_with_release") as db:
         cur = await db.execute(
             "SELECT id, owner_tg_id, artist, title, release_date, pre_save_enabled, reminders_enabled, project_id, cover_file_id, links_json, caption_text, branding_disabled, created_at, branding_paid FROM smartlinks WHERE release_date IS NOT NULL",
         )
         return [_smartlink_row_to_dict(row) for row in await cur.fetchall()]
 
 
-async def form_start(tg_id: int, form_name: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO user_forms (tg_id, form_name, step, data_json) VALUES (?, ?, 0, ?)",
-            (tg_id, form_name, "{}")
+async def get_cached_cover(cover_url: str) -> str | None:
+    async with _connect("get_cached_cover") as db:
+        cur = await db.execute("SELECT file_id FROM cover_cache WHERE cover_url=?", (cover_url,))
+        row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def save_cached_cover(cover_url: str, content_hash: str | None, file_id: str):
+    """Remember the Telegram file_id for a cover; every URL with the same content gets it too.
+
+    The id just uploaded is the one Telegram is known to accept, so it replaces older
+    ids for that content rather than the other way round.
+    """
+    now = dt.datetime.utcnow().isoformat()
+    await run_write([
+        WriteStatement(
+            "INSERT OR REPLACE INTO cover_cache (cover_url, content_hash, file_id, created_at) VALUES (?, ?, ?, ?)",
+            (cover_url, content_hash, file_id, now),
+        ),
+        WriteStatement(
+            "UPDATE cover_cache SET file_id=? WHERE content_hash=? AND file_id != ?",
+            (file_id, content_hash, file_id),
+        ),
+    ])
+
+
+async def delete_cached_cover(cover_url: str):
+    await execute_write("DELETE FROM cover_cache WHERE cover_url=?", (cover_url,))
+
+
+async def try_acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    """Take or renew the named lease; True while `holder` owns it for the next `ttl` seconds."""
+    now = time.time()
+    changed = await execute_write(
+        "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at "
+        "WHERE leases.holder=excluded.holder OR leases.expires_at < ?",
+        (name, holder, now + ttl, now),
+    )
+    return changed > 0
+
+
+async def release_lease(name: str, holder: str):
+    await execute_write("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+
+
+async def claim_update(update_id: int) -> bool:
+    """True for the first process to see `update_id`; False for any redelivery."""
+    changed = await execute_write(
+        "INSERT OR IGNORE INTO processed_updates (update_id, processed_at) VALUES (?, ?)",
+        (update_id, time.time()),
+    )
+    return changed > 0
+
+
+async def release_update(update_id: int):
+    await execute_write("DELETE FROM processed_updates WHERE update_id=?", (update_id,))
+
+
+async def compact_processed_updates(older_than: float) -> int:
+    """Forget update_ids claimed before the `older_than` unix time; Telegram will not resend those."""
+    return await execute_write("DELETE FROM processed_updates WHERE processed_at < ?", (older_than,))
+
+
+async def claim_payment_charge(charge_id: str, tg_id: int) -> bool:
+    """True the first time a payment charge is seen. Payments are never compacted."""
+    changed = await execute_write(
+        "INSERT OR IGNORE INTO processed_payments (charge_id, tg_id, processed_at) VALUES (?, ?, ?)",
+        (charge_id, tg_id, time.time()),
+    )
+    return changed > 0
+
+
+async def release_payment_charge(charge_id: str):
+    await execute_write("DELETE FROM processed_payments WHERE charge_id=?", (charge_id,))
+
+
+async def get_bot_state(key: str) -> str | None:
+    async with _connect("get_bot_state") as db:
+        cur = await db.execute("SELECT value FROM bot_state WHERE key=?", (key,))
+        row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def set_bot_state(key: str, value: str | None):
+    await execute_write(
+        "INSERT INTO bot_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (key, value),
+    )
+
+
+async def journal_updates(payloads: Sequence[dict]):
+    """Keep raw updates until forget_updates(); one write unit per batch."""
+    await run_write([
+        WriteStatement(
+            "INSERT OR IGNORE INTO pending_updates (update_id, payload) VALUES (?, ?)",
+            [(p["update_id"], json.dumps(p, ensure_ascii=False)) for p in payloads],
+            many=True,
         )
-        await db.commit()
+    ])
+
+
+async def forget_updates(update_ids: Sequence[int]):
+    await run_write([
+        WriteStatement("DELETE FROM pending_updates WHERE update_id=?", [(i,) for i in update_ids], many=True)
+    ])
+
+
+async def load_pending_updates() -> list[dict]:
+    async with _connect("load_pending_updates") as db:
+        cur = await db.execute("SELECT payload FROM pending_updates ORDER BY update_id")
+        rows = await cur.fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+
+async def _ensure_forms_loaded():
+    global _FORMS_LOADED
+    if _FORMS_LOADED:
+        return
+    async with _FORMS_LOAD_LOCK:
+        if _FORMS_LOADED:
+            return
+        async with _connect("_ensure_forms_loaded") as db:
+            cur = await db.execute("SELECT tg_id FROM user_forms")
+            _FORM_OWNERS.update(row[0] for row in await cur.fetchall())
+        _FORMS_LOADED = True
+
+
+def _mark_form_dirty(tg_id: int):
+    global _FORMS_FLUSH_TASK
+    _FORMS_DIRTY.add(tg_id)
+    if _FORMS_FLUSH_TASK is None or _FORMS_FLUSH_TASK.done():
+        _FORMS_FLUSH_TASK = asyncio.create_task(_form_flush_loop())
+
+
+def _forget_form(tg_id: int):
+    _FORMS.pop(tg_id, None)
+    _FORM_OWNERS.discard(tg_id)
+    _FORMS_DIRTY.discard(tg_id)
+
+
+async def _form_flush_loop():
+    while _FORMS_DIRTY:
+        await asyncio.sleep(FORM_FLUSH_INTERVAL)
+        try:
+            await flush_forms()
+        except Exception as e:
+            print(f"[forms] flush failed: {e}")
+    _expire_forms()
+
+
+def _expire_forms():
+    """Drop idle sessions from memory; user_forms still has them."""
+    deadline = time.monotonic() - FORM_TTL_SECONDS
+    for tg_id in [k for k, v in _FORMS.items() if v["touched"] < deadline and k not in _FORMS_DIRTY]:
+        del _FORMS[tg_id]
+
+
+async def flush_forms():
+    """Write every pending form change to user_forms in one transaction."""
+    if not _FORMS_DIRTY:
+        return
+    pending = list(_FORMS_DIRTY)
+    _FORMS_DIRTY.difference_update(pending)
+    upserts = []
+    deletes = []
+    for tg_id in pending:
+        entry = _FORMS.get(tg_id)
+        if entry is None:
+            deletes.append((tg_id,))
+        else:
+            upserts.append(
+                (tg_id, entry["form_name"], entry["step"], json.dumps(entry["data"], ensure_ascii=False))
+            )
+    try:
+        await run_write([
+            WriteStatement("DELETE FROM user_forms WHERE tg_id=?", deletes, many=True),
+            WriteStatement(
+                "INSERT OR REPLACE INTO user_forms (tg_id, form_name, step, data_json) VALUES (?, ?, ?, ?)",
+                upserts,
+                many=True,
+            ),
+        ])
+    except BaseException:
+        _FORMS_DIRTY.update(pending)
+        raise
+
+
+async def close_form_store():
+    global _FORMS_FLUSH_TASK
+    if _FORMS_FLUSH_TASK:
+        _FORMS_FLUSH_TASK.cancel()
+        _FORMS_FLUSH_TASK = None
+    await flush_forms()
+
+
+async def load_form_store():
+    """Read which users have a form, dropping any snapshot taken earlier.
+
+    Call it once the previous instance has flushed its sessions and before this one
+    takes traffic; until then the old instance is still starting and clearing forms.
+    """
+    global _FORMS_LOADED
+    _FORMS.clear()
+    _FORM_OWNERS.clear()
+    _FORMS_LOADED = False
+    await _ensure_forms_loaded()
+
+
+async def has_active_form(tg_id: int) -> bool:
+    await _ensure_forms_loaded()
+    return tg_id in _FORM_OWNERS
+
+
+async def form_start(tg_id: int, form_name: str):
+    await _ensure_forms_loaded()
+    _FORMS[tg_id] = {"form_name": form_name, "step": 0, "data": {}, "touched": time.monotonic()}
+    _FORM_OWNERS.add(tg_id)
+    _mark_form_dirty(tg_id)
 
 
 async def form_get(tg_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT form_name, step, data_json FROM user_forms WHERE tg_id=?", (tg_id,))
-        row = await cur.fetchone()
-    if not row:
+    await _ensure_forms_loaded()
+    if tg_id not in _FORM_OWNERS:
         return None
-    form_name, step, data_json = row
-    try:
-        data = json.loads(data_json or "{}")
-    except Exception:
-        data = {}
-    return {"form_name": form_name, "step": step, "data": data}
+    entry = _FORMS.get(tg_id)
+    if entry is None:
+        async with _connect("form_get") as db:
+            cur = await db.execute("SELECT form_name, step, data_json FROM user_forms WHERE tg_id=?", (tg_id,))
+            row = await cur.fetchone()
+        if not row:
+            _FORM_OWNERS.discard(tg_id)
+            return None
+        form_name, step, data_json = row
+        try:
+            data = json.loads(data_json or "{}")
+        except Exception:
+            data = {}
+        entry = _FORMS[tg_id] = {"form_name": form_name, "step": step, "data": data, "touched": 0.0}
+    entry["touched"] = time.monotonic()
+    return {"form_name": entry["form_name"], "step": entry["step"], "data": copy.deepcopy(entry["data"])}
 
 
 async def form_set(tg_id: int, step: int, data: dict):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE user_forms SET step=?, data_json=? WHERE tg_id=?",
-            (step, json.dumps(data, ensure_ascii=False), tg_id)
-        )
-        await db.commit()
+    entry = _FORMS.get(tg_id)
+    if entry is None:
+        # Like the UPDATE it replaces: no-op unless a form is active.
+        if await form_get(tg_id) is None:
+            return
+        entry = _FORMS[tg_id]
+    entry["step"] = step
+    entry["data"] = copy.deepcopy(data)
+    entry["touched"] = time.monotonic()
+    _mark_form_dirty(tg_id)
 
 
 async def form_clear(tg_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM user_forms WHERE tg_id=?", (tg_id,))
-        await db.commit()
+    await _ensure_forms_loaded()
+    if tg_id not in _FORM_OWNERS and tg_id not in _FORMS:
+        return
+    _FORMS.pop(tg_id, None)
+    _FORM_OWNERS.discard(tg_id)
+    _mark_form_dirty(tg_id)
 
 
 async def was_reminder_sent(tg_id: int, key: str, when: str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("was_reminder_sent") as db:
         cur = await db.execute(
             "SELECT 1 FROM reminder_log WHERE tg_id=? AND key=? AND \"when\"=?",
             (tg_id, key, when)
@@ -824,16 +1381,14 @@ async def was_reminder_sent(tg_id: int, key: str, when: str) -> bool:
 
 
 async def mark_reminder_sent(tg_id: int, key: str, when: str, sent_on: dt.date):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO reminder_log (tg_id, key, \"when\", sent_on) VALUES (?, ?, ?, ?)",
-            (tg_id, key, when, sent_on.isoformat())
-        )
-        await db.commit()
+    await execute_write(
+        "INSERT OR IGNORE INTO reminder_log (tg_id, key, \"when\", sent_on) VALUES (?, ?, ?, ?)",
+        (tg_id, key, when, sent_on.isoformat())
+    )
 
 
 async def was_smartlink_day_sent(smartlink_id: int, subscriber_tg_id: int, offset_days: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("was_smartlink_day_sent") as db:
         cur = await db.execute(
             "SELECT 1 FROM smartlink_reminder_log WHERE smartlink_id=? AND subscriber_tg_id=? AND offset_days=?",
             (smartlink_id, subscriber_tg_id, offset_days),
@@ -842,12 +1397,10 @@ async def was_smartlink_day_sent(smartlink_id: int, subscriber_tg_id: int, offse
 
 
 async def mark_smartlink_day_sent(smartlink_id: int, subscriber_tg_id: int, offset_days: int, sent_on: dt.date):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO smartlink_reminder_log (smartlink_id, subscriber_tg_id, offset_days, sent_on) VALUES (?, ?, ?, ?)",
-            (smartlink_id, subscriber_tg_id, offset_days, sent_on.isoformat()),
-        )
-        await db.commit()
+    await execute_write(
+        "INSERT OR REPLACE INTO smartlink_reminder_log (smartlink_id, subscriber_tg_id, offset_days, sent_on) VALUES (?, ?, ?, ?)",
+        (smartlink_id, subscriber_tg_id, offset_days, sent_on.isoformat()),
+    )
 
 
 def _parse_smartlink_date(date_str: str | None) -> dt.date | None:
@@ -866,27 +1419,23 @@ def _parse_smartlink_date(date_str: str | None) -> dt.date | None:
 
 
 async def add_smartlink_reminder(tg_id: int, smartlink_id: int | str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "INSERT OR IGNORE INTO smartlink_reminders (smartlink_id, tg_id, created_at) VALUES (?, ?, ?)",
-            (smartlink_id, tg_id, dt.datetime.utcnow().isoformat()),
-        )
-        await db.commit()
-        return cur.rowcount > 0
+    changed = await execute_write(
+        "INSERT OR IGNORE INTO smartlink_reminders (smartlink_id, tg_id, created_at) VALUES (?, ?, ?)",
+        (smartlink_id, tg_id, dt.datetime.utcnow().isoformat()),
+    )
+    return changed > 0
 
 
 async def remove_smartlink_reminder(tg_id: int, smartlink_id: int | str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "DELETE FROM smartlink_reminders WHERE smartlink_id=? AND tg_id=?",
-            (smartlink_id, tg_id),
-        )
-        await db.commit()
-        return cur.rowcount > 0
+    changed = await execute_write(
+        "DELETE FROM smartlink_reminders WHERE smartlink_id=? AND tg_id=?",
+        (smartlink_id, tg_id),
+    )
+    return changed > 0
 
 
 async def is_smartlink_reminder_set(tg_id: int, smartlink_id: int | str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("is_smartlink_reminder_set") as db:
         cur = await db.execute(
             "SELECT 1 FROM smartlink_reminders WHERE smartlink_id=? AND tg_id=?",
             (smartlink_id, tg_id),
@@ -899,7 +1448,7 @@ async def get_due_smartlink_reminders(today_date_str: str) -> list[tuple[int | s
     if not target_date:
         return []
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_due_smartlink_reminders") as db:
         cur = await db.execute(
             "SELECT r.smartlink_id, r.tg_id, s.release_date FROM smartlink_reminders r JOIN smartlinks s ON r.smartlink_id = s.id"
         )
@@ -914,16 +1463,14 @@ async def get_due_smartlink_reminders(today_date_str: str) -> list[tuple[int | s
 
 
 async def mark_smartlink_reminder_sent(tg_id: int, smartlink_id: int | str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO smartlink_reminder_sends (smartlink_id, tg_id, sent_at) VALUES (?, ?, ?)",
-            (smartlink_id, tg_id, dt.datetime.utcnow().isoformat()),
-        )
-        await db.commit()
+    await execute_write(
+        "INSERT OR IGNORE INTO smartlink_reminder_sends (smartlink_id, tg_id, sent_at) VALUES (?, ?, ?)",
+        (smartlink_id, tg_id, dt.datetime.utcnow().isoformat()),
+    )
 
 
 async def was_smartlink_reminder_sent(tg_id: int, smartlink_id: int | str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("was_smartlink_reminder_sent") as db:
         cur = await db.execute(
             "SELECT 1 FROM smartlink_reminder_sends WHERE smartlink_id=? AND tg_id=?",
             (smartlink_id, tg_id),
@@ -933,16 +1480,14 @@ async def was_smartlink_reminder_sent(tg_id: int, smartlink_id: int | str) -> bo
 
 async def cleanup_reminder_log(today: dt.date, clean_days: int = REMINDER_CLEAN_DAYS):
     threshold = today - dt.timedelta(days=clean_days)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM reminder_log WHERE sent_on IS NOT NULL AND sent_on < ?",
-            (threshold.isoformat(),),
-        )
-        await db.commit()
+    await execute_write(
+        "DELETE FROM reminder_log WHERE sent_on IS NOT NULL AND sent_on < ?",
+        (threshold.isoformat(),),
+    )
 
 
 async def get_reminder_users() -> list[tuple[int, str | None, str | None]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_reminder_users") as db:
         cur = await db.execute(
             "SELECT tg_id, username, release_date FROM users WHERE reminders_enabled=1 AND release_date IS NOT NULL"
         )
@@ -950,7 +1495,7 @@ async def get_reminder_users() -> list[tuple[int, str | None, str | None]]:
 
 
 async def get_updates_opt_in_users() -> list[tuple[int, str | None]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect("get_updates_opt_in_users") as db:
         cur = await db.execute(
             "SELECT tg_id, last_update_notified FROM users WHERE updates_opt_in=1"
         )
@@ -0,0 +1,160 @@
+import asyncio
+import contextlib
+import json
+import os
+
+# Line protocol over a Unix socket, new process -> old process:
+#   new: HANDOVER          old stops getUpdates and drains its handlers
+#   old: {"offset": N}     first update_id the old process has not finished
+#     or REFUSED           handlers did not drain in time; the old process keeps polling
+#   new: ACK               sent once the new process has confirmed N with getUpdates
+#   old: closes            after shutting down and releasing the polling lock
+# The old process sends WAIT every KEEPALIVE_INTERVAL seconds from the request until it
+# closes, so the new one only gives up when the old one stops answering, however long
+# draining and shutdown take. Without an ACK the old process resumes polling.
+HANDOVER_REQUEST = b"HANDOVER"
+HANDOVER_WAIT = b"WAIT"
+HANDOVER_REFUSED = b"REFUSED"
+HANDOVER_ACK = b"ACK"
+KEEPALIVE_INTERVAL = 5.0
+
+
+class HandoverSession:
+    """Old-process side of one successor's connection; keeps it alive until closed."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._keepalive = asyncio.create_task(self._ping())
+
+    async def _ping(self):
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            self._send(HANDOVER_WAIT)
+
+    def _send(self, line: bytes):
+        if not self._writer.is_closing():
+            self._writer.write(line + b"\n")
+
+    def refuse(self):
+        self._send(HANDOVER_REFUSED)
+        self.close()
+
+    async def send_offset(self, offset: int | None, timeout: float) -> bool:
+        """True once the successor confirmed `offset`; False if it went away or took too long."""
+        self._send(json.dumps({"offset": offset}).encode())
+        try:
+            await self._writer.drain()
+            ack = await asyncio.wait_for(self._reader.readline(), timeout)
+        except (asyncio.TimeoutError, OSError) as e:
+            print(f"[handover] no ACK from the successor: {e!r}")
+            return False
+        return ack.strip() == HANDOVER_ACK
+
+    def close(self):
+        """Tell the successor the lock is free (or that it is not getting it)."""
+        self._keepalive.cancel()
+        self._writer.close()
+
+
+class HandoverServer:
+    """Old-process side: queues successors' requests for the main loop to act on."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._requests: asyncio.Queue[HandoverSession] = asyncio.Queue()
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+        except OSError:
+            line = b""
+        if line.strip() != HANDOVER_REQUEST:
+            writer.close()
+            return
+        self._requests.put_nowait(HandoverSession(reader, writer))
+
+    async def next_request(self) -> HandoverSession:
+        return await self._requests.get()
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+        # Successors still waiting in line: nobody is going to hand over to them.
+        while not self._requests.empty():
+            self._requests.get_nowait().refuse()
+
+
+class HandoverClient:
+    """New-process side: asks the running instance to stop and receives its offset.
+
+    `idle_timeout` bounds the silence between two lines, not the whole exchange.
+    """
+
+    def __init__(self, path: str, idle_timeout: float):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def _readline(self) -> bytes:
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(), self.idle_timeout)
+            if line.strip() != HANDOVER_WAIT:
+                return line
+
+    async def request(self) -> tuple[bool, int | None]:
+        """(True, offset) once the old process has drained; (False, None) if it refused or is gone."""
+        try:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        except OSError:
+            return False, None
+        try:
+            self._writer.write(HANDOVER_REQUEST + b"\n")
+            await self._writer.drain()
+            line = await self._readline()
+            if line.strip() == HANDOVER_REFUSED:
+                print("[handover] the running instance is busy and keeps polling")
+                self.close()
+                return False, None
+            return True, json.loads(line)["offset"]
+        except (asyncio.TimeoutError, OSError, ValueError, KeyError) as e:
+            print(f"[handover] no offset from the running instance: {e!r}")
+            self.close()
+            return False, None
+
+    async def ack(self):
+        if self._writer is None:
+            return
+        with contextlib.suppress(OSError):
+            self._writer.write(HANDOVER_ACK + b"\n")
+            await self._writer.drain()
+
+    async def wait_released(self) -> bool:
+        """Wait until the old process closes the connection, i.e. has released the lock."""
+        if self._reader is None:
+            return False
+        try:
+            while await self._readline():
+                pass
+        except (asyncio.TimeoutError, OSError) as e:
+            print(f"[handover] the running instance stopped answering while shutting down: {e!r}")
+            return False
+        finally:
+            self.close()
+        return True
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -1,7 +1,10 @@
 import datetime as dt
+import hashlib
 import html
 import logging
+import os
 import re
+from collections import OrderedDict
 
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InlineKeyboardMarkup, Message
@@ -13,6 +16,41 @@ def escape_html(text: str | None) -> str:
 
 logger = logging.getLogger(__name__)
 
+# Last content we rendered into each (chat_id, message_id); identical edits are skipped.
+EDIT_FINGERPRINT_LIMIT = int(os.getenv("EDIT_FINGERPRINT_LIMIT", "20000"))
+_EDIT_FINGERPRINTS: OrderedDict[tuple[int, int], bytes] = OrderedDict()
+EDIT_STATS = {"sent": 0, "skipped": 0, "not_modified": 0}
+
+
+def _edit_fingerprint(kind: str, text: str, reply_markup: InlineKeyboardMarkup | None) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(kind.encode())
+    digest.update(text.encode())
+    if reply_markup is not None:
+        digest.update(reply_markup.model_dump_json(exclude_none=True).encode())
+    return digest.digest()
+
+
+def _is_unchanged(message: Message, fingerprint: bytes) -> bool:
+    key = (message.chat.id, message.message_id)
+    if _EDIT_FINGERPRINTS.get(key) == fingerprint:
+        _EDIT_FINGERPRINTS.move_to_end(key)
+        EDIT_STATS["skipped"] += 1
+        return True
+    return False
+
+
+def _remember_render(message: Message, fingerprint: bytes):
+    key = (message.chat.id, message.message_id)
+    _EDIT_FINGERPRINTS[key] = fingerprint
+    _EDIT_FINGERPRINTS.move_to_end(key)
+    while len(_EDIT_FINGERPRINTS) > EDIT_FINGERPRINT_LIMIT:
+        _EDIT_FINGERPRINTS.popitem(last=False)
+
+
+def _is_not_modified(err: TelegramBadRequest) -> bool:
+    return "message is not modified" in str(err).lower()
+
 
 def format_date_ru(value: dt.date | dt.datetime | str | None) -> str:
     if isinstance(value, dt.datetime):
@@ -26,14 +64,24 @@ def format_date_ru(value: dt.date | dt.datetime | str | None) -> str:
 
 
 async def safe_edit(target: Message, text: str, reply_markup: InlineKeyboardMarkup | None = None) -> Message | None:
+    fingerprint = _edit_fingerprint("text", text, reply_markup)
+    if _is_unchanged(target, fingerprint):
+        return target
     try:
         await target.edit_text(text, reply_markup=reply_markup)
+        EDIT_STATS["sent"] += 1
+        _remember_render(target, fingerprint)
         return target
-    except TelegramBadRequest:
+    except TelegramBadRequest as err:
+        if _is_not_modified(err):
+            EDIT_STATS["not_modified"] += 1
+            _remember_render(target, fingerprint)
         return target
     except Exception as edit_err:
         try:
-            return await target.answer(text, reply_markup=reply_markup)
+            sent = await target.answer(text, reply_markup=reply_markup)
+            _remember_render(sent, fingerprint)
+            return sent
         except Exception as answer_err:
             print(f"[safe_edit] edit failed: {edit_err}; answer failed: {answer_err}")
             return None
@@ -78,17 +126,29 @@ def smartlink_can_remind(smartlink: dict) -> bool:
 
 
 async def safe_edit_caption(message: Message, caption: str, kb: InlineKeyboardMarkup | None) -> Message | None:
+    fingerprint = _edit_fingerprint("caption", caption, kb)
+    if _is_unchanged(message, fingerprint):
+        return message
     try:
         await message.edit_caption(caption=caption, reply_markup=kb, parse_mode="HTML")
+        EDIT_STATS["sent"] += 1
+        _remember_render(message, fingerprint)
         return message
     except Exception as edit_err:
+        # Same content: nothing to re-send.
+        if isinstance(edit_err, TelegramBadRequest) and _is_not_modified(edit_err):
+            EDIT_STATS["not_modified"] += 1
+            _remember_render(message, fingerprint)
+            return message
         try:
-            return await message.answer_photo(
+            sent = await message.answer_photo(
                 photo=message.photo[-1].file_id if message.photo else None,
                 caption=caption,
                 reply_markup=kb,
                 parse_mode="HTML",
             )
+            _remember_render(sent, fingerprint)
+            return sent
         except Exception as answer_err:
             print(f"[safe_edit_caption] edit failed: {edit_err}; answer failed: {answer_err}")
             return None
@@ -1,12 +1,26 @@
+from functools import lru_cache
+from types import MappingProxyType
+
 from aiogram.types import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     KeyboardButton,
     ReplyKeyboardMarkup,
 )
+from pydantic import ConfigDict
 from helpers import smartlink_pre_save_active
 
 
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """Markup returned from the render caches below: shared between replies, so never mutate it."""
+
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+
 LINKS = {
     "bandlink_home": "https://band.link/",
     "bandlink_login": "https://band.link/login",
@@ -22,6 +36,7 @@ LINKS = {
 }
 
 
+# Statuses are stored per key (users.accounts_json), so this order is display only.
 ACCOUNTS = [
     ("spotify", "Spotify for Artists"),
     ("yandex", "Яндекс для артистов"),
@@ -29,6 +44,7 @@ ACCOUNTS = [
     ("zvuk", "Звук Studio"),
     ("tiktok", "TikTok (аккаунт + Artist/Music Tab)"),
 ]
+ACCOUNT_KEYS = [key for key, _ in ACCOUNTS]
 
 
 def next_acc_status(v: int) -> int:
@@ -39,6 +55,7 @@ def task_mark(done: int) -> str:
     return "✅" if done else "▫️"
 
 
+# Task ids are bit positions in users.tasks_mask (id - 1); keep them stable.
 TASKS = [
     (1, "Цель релиза выбрана (зачем это выпускаю)"),
     (2, "Права/ownership: все участники согласны + семплы/биты легальны"),
@@ -132,46 +149,117 @@ BRANDING_DISABLE_PRICE = 10
 EXPORT_UNLOCK_PRICE = 25
 
 
-def count_progress(tasks_state: dict[int, int]) -> tuple[int, int]:
-    total = len(TASKS)
-    done = sum(1 for task_id, _ in TASKS if tasks_state.get(task_id, 0) == 1)
-    return done, total
-
+class TaskCatalogue:
+    """Read-only index over TASKS/SECTIONS, built once at import.
+
+    Task state is handled as a bitmask (bit task_id - 1, the users.tasks_mask layout),
+    so progress is a popcount and the next task is the lowest pending bit.
+    """
+
+    __slots__ = (
+        "order",
+        "titles",
+        "position",
+        "full_mask",
+        "section_order",
+        "section_titles",
+        "section_ids",
+        "section_masks",
+        "section_index",
+        "section_of",
+        "_id_ordered",
+    )
 
-def get_next_task(tasks_state: dict[int, int]):
-    for task_id, title in TASKS:
-        if tasks_state.get(task_id, 0) == 0:
-            return task_id, title
-    return None
+    def __init__(self, tasks: list[tuple[int, str]], sections: list[tuple[str, str, list[int]]]):
+        self.order = tuple(tid for tid, _ in tasks)
+        self.titles = MappingProxyType(dict(tasks))
+        self.position = MappingProxyType({tid: pos for pos, tid in enumerate(self.order)})
+        self.full_mask = sum(1 << (tid - 1) for tid in self.order)
+        self.section_order = tuple(sid for sid, _, _ in sections)
+        self.section_titles = MappingProxyType({sid: stitle for sid, stitle, _ in sections})
+        self.section_ids = MappingProxyType({sid: tuple(ids) for sid, _, ids in sections})
+        self.section_masks = MappingProxyType({sid: sum(1 << (tid - 1) for tid in ids) for sid, _, ids in sections})
+        self.section_index = MappingProxyType({sid: idx for idx, sid in enumerate(self.section_order, start=1)})
+        section_of: dict[int, tuple[str, str]] = {}
+        for sid, stitle, ids in sections:
+            for tid in ids:
+                section_of.setdefault(tid, (sid, stitle))
+        self.section_of = MappingProxyType(section_of)
+        # With ids in catalogue order, bit order is display order and lowest-bit tricks apply.
+        self._id_ordered = list(self.order) == sorted(self.order)
+
+    @staticmethod
+    def mask_of(tasks_state: dict[int, int] | int) -> int:
+        if isinstance(tasks_state, int):
+            return tasks_state
+        mask = 0
+        for tid, done in tasks_state.items():
+            if done == 1 and tid > 0:
+                mask |= 1 << (tid - 1)
+        return mask
+
+    def iter_ids(self, mask: int):
+        """Task ids whose bit is set in mask, in catalogue order."""
+        mask &= self.full_mask
+        if not self._id_ordered:
+            yield from (tid for tid in self.order if mask >> (tid - 1) & 1)
+            return
+        while mask:
+            low = mask & -mask
+            yield low.bit_length()
+            mask ^= low
+
+    def progress(self, mask: int) -> tuple[int, int]:
+        return (mask & self.full_mask).bit_count(), len(self.order)
+
+    def section_progress(self, mask: int, section_id: str) -> tuple[int, int]:
+        return (mask & self.section_masks[section_id]).bit_count(), len(self.section_ids[section_id])
+
+    def next_task(self, mask: int) -> int | None:
+        pending = ~mask & self.full_mask
+        if not pending:
+            return None
+        if self._id_ordered:
+            return (pending & -pending).bit_length()
+        return next(self.iter_ids(pending), None)
+
+
+CATALOGUE = TaskCatalogue(TASKS, SECTIONS)
+
+
+def count_progress(tasks_state: dict[int, int] | int) -> tuple[int, int]:
+    return CATALOGUE.progress(CATALOGUE.mask_of(tasks_state))
+
+
+def get_next_task(tasks_state: dict[int, int] | int):
+    task_id = CATALOGUE.next_task(CATALOGUE.mask_of(tasks_state))
+    if task_id is None:
+        return None
+    return task_id, CATALOGUE.titles[task_id]
 
 
 def get_task_title(task_id: int) -> str:
-    for tid, t in TASKS:
-        if tid == task_id:
-            return t
-    return "Задача"
+    return CATALOGUE.titles.get(task_id, "Задача")
 
 
 def find_section_for_task(task_id: int) -> tuple[str, str] | None:
-    for sid, stitle, ids in SECTIONS:
-        if task_id in ids:
-            return sid, stitle
-    return None
+    return CATALOGUE.section_of.get(task_id)
 
 
 def build_focus(
-    tasks_state: dict[int, int],
+    tasks_state: dict[int, int] | int,
     experience: str | None = None,
     important: set[int] | None = None,
     focus_task_id: int | None = None,
     show_completed: bool = False,
 ) -> tuple[str, InlineKeyboardMarkup]:
-    done, total = count_progress(tasks_state)
+    mask = CATALOGUE.mask_of(tasks_state)
+    done, total = CATALOGUE.progress(mask)
     next_task = None
     if focus_task_id:
         next_task = (focus_task_id, get_task_title(focus_task_id))
     else:
-        next_task = get_next_task(tasks_state)
+        next_task = get_next_task(mask)
 
     lines = []
     lines.append("🎯 Фокус-режим")
@@ -199,20 +287,16 @@ def build_focus(
     sec = find_section_for_task(task_id)
     if sec:
         sid, stitle = sec
-        idx = next((i for i, s in enumerate(SECTIONS) if s[0] == sid), 0) + 1
-        sec_total = len(SECTIONS)
-        section_ids = next((s[2] for s in SECTIONS if s[0] == sid), [])
-        section_done = sum(1 for tid in section_ids if tasks_state.get(tid, 0) == 1)
-        lines.append(f"Раздел: {idx}/{sec_total} — {stitle}")
-        lines.append(f"Прогресс по разделу: {section_done}/{len(section_ids)}")
+        section_done, section_total = CATALOGUE.section_progress(mask, sid)
+        lines.append(f"Раздел: {CATALOGUE.section_index[sid]}/{len(CATALOGUE.section_order)} — {stitle}")
+        lines.append(f"Прогресс по разделу: {section_done}/{section_total}")
     lines.append(f"Следующая задача:\n▫️ {title}\n")
 
     upcoming = []
-    for tid, t in TASKS:
+    for tid in CATALOGUE.iter_ids(~mask):
         if tid == task_id:
             continue
-        if tasks_state.get(tid, 0) == 0:
-            upcoming.append(t)
+        upcoming.append(CATALOGUE.titles[tid])
         if len(upcoming) >= 3:
             break
     if upcoming:
@@ -221,14 +305,14 @@ def build_focus(
             lines.append(f"▫️ {t}")
 
     if show_completed and done:
-        completed = [t for tid, t in TASKS if tasks_state.get(tid, 0) == 1]
+        completed = [CATALOGUE.titles[tid] for tid in CATALOGUE.iter_ids(mask)]
         if completed:
             lines.append("")
             lines.append(f"Выполненные ({len(completed)}):")
             for t in completed:
                 lines.append(f"✅ {t}")
 
-    is_done = tasks_state.get(task_id, 0) == 1
+    is_done = bool(mask >> (task_id - 1) & 1) if task_id > 0 else False
     mark_text = f"↩️ Отменить: {title}" if is_done else f"✅ Сделано: {title}"
     rows.append([
         InlineKeyboardButton(
@@ -257,39 +341,40 @@ def build_focus_keyboard(
     return kb
 
 
-def build_sections_menu(tasks_state: dict[int, int]) -> tuple[str, InlineKeyboardMarkup]:
-    done, total = count_progress(tasks_state)
+def build_sections_menu(tasks_state: dict[int, int] | int) -> tuple[str, InlineKeyboardMarkup]:
+    mask = CATALOGUE.mask_of(tasks_state)
+    done, total = CATALOGUE.progress(mask)
     text = f"📦 Задачи по разделам\nПрогресс: {done}/{total}\n\nВыбери раздел:"
     inline = []
-    for sid, title, ids in SECTIONS:
-        section_done = sum(1 for tid in ids if tasks_state.get(tid, 0) == 1)
-        inline.append([InlineKeyboardButton(text=f"{title} ({section_done}/{len(ids)})", callback_data=f"section:{sid}:0")])
+    for sid in CATALOGUE.section_order:
+        section_done, section_total = CATALOGUE.section_progress(mask, sid)
+        title = CATALOGUE.section_titles[sid]
+        inline.append([InlineKeyboardButton(text=f"{title} ({section_done}/{section_total})", callback_data=f"section:{sid}:0")])
     inline.append([InlineKeyboardButton(text="↩️ Назад в фокус", callback_data="back_to_focus")])
     return text, InlineKeyboardMarkup(inline_keyboard=inline)
 
 
-def build_section_page(tasks_state: dict[int, int], section_id: str, page: int, page_size: int = 6) -> tuple[str, InlineKeyboardMarkup]:
-    sec = next((s for s in SECTIONS if s[0] == section_id), None)
-    if not sec:
+def build_section_page(tasks_state: dict[int, int] | int, section_id: str, page: int, page_size: int = 6) -> tuple[str, InlineKeyboardMarkup]:
+    ids = CATALOGUE.section_ids.get(section_id)
+    if ids is None:
         return "Раздел не найден.", InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="↩️ Назад", callback_data="sections:open")]])
 
-    _, title, ids = sec
-    items = [(tid, get_task_title(tid)) for tid in ids]
-
-    total_pages = max(1, (len(items) + page_size - 1) // page_size)
+    title = CATALOGUE.section_titles[section_id]
+    total_pages = max(1, (len(ids) + page_size - 1) // page_size)
     page = max(0, min(page, total_pages - 1))
 
     start = page * page_size
-    chunk = items[start:start + page_size]
+    chunk = [(tid, get_task_title(tid)) for tid in ids[start:start + page_size]]
 
-    done, total = count_progress(tasks_state)
+    mask = CATALOGUE.mask_of(tasks_state)
+    done, total = CATALOGUE.progress(mask)
     header = f"{title}\nПрогресс общий: {done}/{total}\nСтраница: {page+1}/{total_pages}\n"
     text_lines = [header]
 
     inline = []
 
     for tid, t in chunk:
-        is_done = tasks_state.get(tid, 0) == 1
+        is_done = bool(mask >> (tid - 1) & 1)
         text_lines.append(f"{task_mark(1 if is_done else 0)} {t}")
 
         btn = "✅ Снять" if is_done else "▫️ Отметить"
@@ -314,17 +399,18 @@ def build_section_page(tasks_state: dict[int, int], section_id: str, page: int,
     return "\n".join(text_lines), InlineKeyboardMarkup(inline_keyboard=inline)
 
 
-def build_important_screen(tasks_state: dict[int, int], important_ids: set[int]) -> tuple[str, InlineKeyboardMarkup]:
+def build_important_screen(tasks_state: dict[int, int] | int, important_ids: set[int]) -> tuple[str, InlineKeyboardMarkup]:
     if not important_ids:
         text = "🔥 Важное\n\nПока ничего не закреплено. Отметь задачу кнопкой ⭐ Важное во фокусе."
         kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🎯 В фокус", callback_data="back_to_focus")]])
         return text, kb
 
+    mask = CATALOGUE.mask_of(tasks_state)
     text_lines = ["🔥 Важное"]
     inline: list[list[InlineKeyboardButton]] = []
     for tid in sorted(important_ids):
         title = get_task_title(tid)
-        status = "✅" if tasks_state.get(tid, 0) == 1 else "▫️"
+        status = "✅" if tid > 0 and mask >> (tid - 1) & 1 else "▫️"
         text_lines.append(f"{status} {title}")
         inline.append(
             [
@@ -349,8 +435,9 @@ def build_accounts_checklist(accounts_state: dict[str, int]) -> tuple[str, Inlin
     return text, InlineKeyboardMarkup(inline_keyboard=inline)
 
 
+@lru_cache(maxsize=None)
 def build_links_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
+    return FrozenInlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔥 Важное", callback_data="important:list")],
         [InlineKeyboardButton(text="🔗 Смартлинк", callback_data="smartlink:open")],
         [InlineKeyboardButton(text="✍️ Тексты", callback_data="texts:start")],
@@ -366,10 +453,12 @@ def build_links_kb() -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=None)
 def smartlinks_menu_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+    return FrozenInlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="➕ Создать смарт-линк", callback_data="smartlinks:create")],
+            [InlineKeyboardButton(text="📦 Массовый импорт", callback_data="smartlinks:bulk")],
             [InlineKeyboardButton(text="📂 Мои смарт-линки", callback_data="smartlinks:list:0")],
             [InlineKeyboardButton(text="✏️ Редактировать смарт-линк", callback_data="smartlinks:list:0")],
             [InlineKeyboardButton(text="📋 Скопировать ссылки", callback_data="smartlinks:list:0")],
@@ -379,8 +468,9 @@ def smartlinks_menu_kb() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=2048)
 def smartlink_view_kb(smartlink_id: int, page: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+    return FrozenInlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="🔗 Открыть", callback_data=f"smartlinks:open:{smartlink_id}:{page}")],
             [InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"smartlinks:edit_menu:{smartlink_id}:{page}")],
@@ -392,6 +482,7 @@ def smartlink_view_kb(smartlink_id: int, page: int) -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=2048)
 def smartlink_edit_menu_kb(
     smartlink_id: int, page: int, branding_disabled: bool = False, branding_paid: bool = False
 ) -> InlineKeyboardMarkup:
@@ -401,7 +492,7 @@ def smartlink_edit_menu_kb(
         branding_text = "🏷 Брендинг ИСКРЫ: Вкл"
     else:
         branding_text = "Убрать брендинг ⭐10"
-    return InlineKeyboardMarkup(
+    return FrozenInlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="Артист/Название", callback_data=f"smartlinks:edit_field:{smartlink_id}:{page}:title")],
             [InlineKeyboardButton(text="Дата релиза", callback_data=f"smartlinks:edit_field:{smartlink_id}:{page}:date")],
@@ -414,17 +505,19 @@ def smartlink_edit_menu_kb(
     )
 
 
+@lru_cache(maxsize=2048)
 def smartlink_links_menu_kb(smartlink_id: int, page: int) -> InlineKeyboardMarkup:
     rows: list[list[InlineKeyboardButton]] = []
     for key, label in SMARTLINK_BUTTON_ORDER:
         rows.append([InlineKeyboardButton(text=label, callback_data=f"smartlinks:edit_link:{smartlink_id}:{page}:{key}")])
     rows.append([InlineKeyboardButton(text="◀️ Назад", callback_data=f"smartlinks:edit_menu:{smartlink_id}:{page}")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+    return FrozenInlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@lru_cache(maxsize=2048)
 def smartlink_export_kb(smartlink_id: int, page: int | None = None) -> InlineKeyboardMarkup:
     page_marker = page if page is not None else -1
-    return InlineKeyboardMarkup(
+    return FrozenInlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="📋 Текст для Telegram", callback_data=f"smartlinks:exportfmt:{smartlink_id}:{page_marker}:tg")],
             [InlineKeyboardButton(text="🧱 Текст для VK", callback_data=f"smartlinks:exportfmt:{smartlink_id}:{page_marker}:vk")],
@@ -435,9 +528,10 @@ def smartlink_export_kb(smartlink_id: int, page: int | None = None) -> InlineKey
     )
 
 
+@lru_cache(maxsize=2048)
 def smartlink_export_paywall_kb(smartlink_id: int, page: int | None = None) -> InlineKeyboardMarkup:
     page_marker = page if page is not None else -1
-    return InlineKeyboardMarkup(
+    return FrozenInlineKeyboardMarkup(
         inline_keyboard=[
             [
                 InlineKeyboardButton(
@@ -450,8 +544,9 @@ def smartlink_export_paywall_kb(smartlink_id: int, page: int | None = None) -> I
     )
 
 
+@lru_cache(maxsize=2048)
 def smartlink_branding_confirm_kb(smartlink_id: int, page: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+    return FrozenInlineKeyboardMarkup(
         inline_keyboard=[
             [
                 InlineKeyboardButton(
@@ -523,8 +618,9 @@ def build_smartlink_keyboard(
     )
 
 
+@lru_cache(maxsize=None)
 def smartlink_step_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+    return FrozenInlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="Пропустить", callback_data="smartlink:skip")],
             [InlineKeyboardButton(text="Отмена", callback_data="smartlink:cancel")],
@@ -532,25 +628,28 @@ def smartlink_step_kb() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def build_timeline_kb(reminders_enabled: bool, has_date: bool = True) -> InlineKeyboardMarkup:
     toggle_text = "🔔 Напоминания: вкл" if reminders_enabled else "🔕 Напоминания: выкл"
     rows = [[InlineKeyboardButton(text=toggle_text, callback_data="reminders:toggle")]]
     if has_date:
         rows.append([InlineKeyboardButton(text="📅 Установить дату", callback_data="timeline:set_date")])
     rows.append([InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_focus")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+    return FrozenInlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@lru_cache(maxsize=None)
 def build_reset_menu_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
+    return FrozenInlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Да, сбросить", callback_data="reset_progress_yes")],
         [InlineKeyboardButton(text="Сбросить всё (дата/настройки)", callback_data="reset_all_yes")],
         [InlineKeyboardButton(text="Отмена", callback_data="back_to_focus")],
     ])
 
 
+@lru_cache(maxsize=None)
 def build_donate_menu_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
+    return FrozenInlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Спасибо ⭐10", callback_data="donate:10")],
         [InlineKeyboardButton(text="Поддержать ⭐25", callback_data="donate:25")],
         [InlineKeyboardButton(text="Сильно поддержать ⭐50", callback_data="donate:50")],
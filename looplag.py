@@ -0,0 +1,114 @@
+import asyncio
+import contextlib
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from metrics import LOOP_LAG_AVG, LOOP_LAG_SECONDS, LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Measures event loop scheduling delay and reports what is blocking it.
+
+    A ticker on the loop sleeps `interval` seconds and records how late it woke up.
+    A watchdog thread checks the ticker's heartbeat; once the loop has been stuck for
+    `stall_threshold` seconds it logs the loop thread's current stack, which is the
+    synchronous code holding everyone else up. `degraded` is true while the moving
+    average of lag (over roughly `window` seconds) stays above `degraded_threshold`.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        stall_threshold: float = 0.5,
+        degraded_threshold: float = 0.1,
+        window: float = 10.0,
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.degraded_threshold = degraded_threshold
+        self._alpha = min(1.0, interval / window) if window > 0 else 1.0
+        self.last_lag = 0.0
+        self.avg_lag = 0.0
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._ticker: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @property
+    def degraded(self) -> bool:
+        return self.avg_lag > self.degraded_threshold or self.blocked_for > self.stall_threshold
+
+    @property
+    def blocked_for(self) -> float:
+        """Seconds since the ticker last ran beyond its normal sleep."""
+        return max(0.0, time.monotonic() - self._heartbeat - self.interval)
+
+    def start(self):
+        if self._ticker is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._ticker = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._ticker is not None:
+            self._ticker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._ticker
+            self._ticker = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join, 1.0)
+            self._watchdog = None
+
+    async def _tick(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._heartbeat = now
+            self.last_lag = lag
+            self.avg_lag += self._alpha * (lag - self.avg_lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            LOOP_LAG_AVG.set(self.avg_lag)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            if heartbeat == reported or self.blocked_for < self.stall_threshold:
+                continue
+            # One report per stall: the heartbeat moves again once the loop is free.
+            reported = heartbeat
+            self.stalls += 1
+            LOOP_STALLS.inc()
+            self._report_stall()
+
+    def _report_stall(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        task_name = None
+        with contextlib.suppress(Exception):
+            task = asyncio.current_task(self._loop)
+            task_name = task.get_name() if task else None
+        stack = "".join(traceback.format_stack(frame))
+        logger.warning(
+            "Event loop blocked for %.3fs (task %s), stack of the loop thread:\n%s",
+            self.blocked_for,
+            task_name,
+            stack,
+        )
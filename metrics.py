@@ -0,0 +1,161 @@
+import time
+from bisect import bisect_left
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Seconds. Covers a cached keyboard render (~1 ms) up to a slow upstream (~10 s).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Recording is a dict lookup plus a few additions; text is only built when /metrics is scraped.
+REGISTRY: list["Counter | Gauge | Histogram"] = []
+INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: [per-bucket counts..., +Inf count, sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str):
+        slots = self._values.get(labels)
+        if slots is None:
+            slots = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    def counts(self) -> dict[tuple[str, ...], int]:
+        return {labels: int(sum(slots[:-1])) for labels, slots in self._values.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, slots in sorted(self._values.items()):
+            cumulative = 0.0
+            for bound, hits in zip(self.buckets, slots):
+                cumulative += hits
+                le = _label_text(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += slots[-2]
+            lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, INF_LABEL)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {slots[-1]}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent handling one update.", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Updates whose handler raised.", ("handler",))
+DB_SECONDS = Histogram("bot_db_seconds", "Time per db.py call, connection included.", ("op",))
+HTTP_SECONDS = Histogram("bot_http_seconds", "Outbound HTTP time to response headers.", ("upstream", "status"))
+HTTP_ERRORS = Counter("bot_http_errors_total", "Outbound HTTP requests that failed.", ("upstream",))
+TELEGRAM_SECONDS = Histogram("bot_telegram_api_seconds", "Bot API call time.", ("method",))
+TELEGRAM_ERRORS = Counter("bot_telegram_api_errors_total", "Bot API calls that raised.", ("method",))
+LOOP_LAG_SECONDS = Histogram("bot_loop_lag_seconds", "How late the event loop ran a timer that was due.")
+LOOP_LAG_AVG = Gauge("bot_loop_lag_avg_seconds", "Moving average of event loop lag.")
+LOOP_STALLS = Counter("bot_loop_stalls_total", "Times the loop was blocked past the stall threshold.")
+
+
+def http_trace(upstream: str) -> aiohttp.TraceConfig:
+    """Trace config for a ClientSession: times every request under the `upstream` label."""
+
+    async def on_start(session, ctx: SimpleNamespace, params):
+        ctx.started = time.perf_counter()
+
+    async def on_end(session, ctx: SimpleNamespace, params: aiohttp.TraceRequestEndParams):
+        HTTP_SECONDS.observe(time.perf_counter() - ctx.started, upstream, str(params.response.status))
+
+    async def on_exception(session, ctx: SimpleNamespace, params):
+        HTTP_ERRORS.inc(upstream)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_start)
+    trace.on_request_end.append(on_end)
+    trace.on_request_exception.append(on_exception)
+    return trace
+
+
+# Bot API method name -> monotonic time of its last successful call.
+TELEGRAM_LAST_OK: dict[str, float] = {}
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: times each Bot API call by method name."""
+
+    async def __call__(self, make_request: Callable[..., Awaitable[Any]], bot, method) -> Any:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+            TELEGRAM_LAST_OK[name] = time.monotonic()
+            return response
+        except Exception:
+            TELEGRAM_ERRORS.inc(name)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, name)
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import operator
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Iterator
+
+from aiogram import BaseMiddleware, Router
+from aiogram.filters import Command
+from aiogram.types import Update
+from magic_filter import MagicFilter
+from magic_filter.operations import CallOperation, ComparatorOperation, FunctionOperation, GetAttributeOperation
+
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+URL_RE = re.compile(r"https?://", re.IGNORECASE)
+
+
+def is_slow_update(update: Update) -> bool:
+    """Link imports and uploaded documents resolve over the network: send them to the slow lane."""
+    message = update.message
+    if message is None:
+        return False
+    if message.document is not None:
+        return True
+    return bool(message.text and URL_RE.search(message.text))
+
+
+class _UserLocks:
+    """tg_id -> lock, dropped as soon as nobody holds or waits for it."""
+
+    def __init__(self):
+        self._locks: dict[int, list] = {}
+
+    def acquire(self, key: int) -> asyncio.Lock:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, key: int):
+        entry = self._locks.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """Outer update middleware: one update at a time per user, bounded concurrency overall.
+
+    Updates of the same user wait on a FIFO lock, so double taps are applied in order.
+    Handlers then take a slot from the fast lane, or from the separate slow lane for
+    network-heavy updates, so imports cannot use up the slots button presses need.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        slow_lane: int = 4,
+        slow_predicate: Callable[[Update], bool] = is_slow_update,
+    ):
+        self._fast = asyncio.Semaphore(max(1, max_in_flight))
+        self._slow = asyncio.Semaphore(max(1, slow_lane))
+        self._is_slow = slow_predicate
+        self._locks = _UserLocks()
+        self.stats = {"handled": 0, "slow": 0, "waited": 0}
+
+    @property
+    def active_users(self) -> int:
+        return len(self._locks)
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        slow = self._is_slow(event)
+        lane = self._slow if slow else self._fast
+        self.stats["handled"] += 1
+        if slow:
+            self.stats["slow"] += 1
+
+        user = data.get("event_from_user")
+        if user is None:
+            async with lane:
+                return await handler(event, data)
+
+        lock = self._locks.acquire(user.id)
+        try:
+            if lock.locked():
+                self.stats["waited"] += 1
+            async with lock:
+                async with lane:
+                    return await handler(event, data)
+        finally:
+            self._locks.release(user.id)
+
+
+class UpdateTracker(BaseMiddleware):
+    """Outer update middleware: newest update_id taken in, and which ones are still running.
+
+    Register it before UserSerialMiddleware so updates waiting for their user's turn count too.
+    """
+
+    def __init__(self):
+        self.last_update_id: int | None = None
+        self._running: Counter[int] = Counter()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._running.values())
+
+    @property
+    def next_offset(self) -> int | None:
+        return None if self.last_update_id is None else self.last_update_id + 1
+
+    @property
+    def processed_offset(self) -> int | None:
+        """First update_id that may not be finished yet; everything below it is done."""
+        if self._running:
+            return min(self._running)
+        return self.next_offset
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        update_id = event.update_id
+        if self.last_update_id is None or update_id > self.last_update_id:
+            self.last_update_id = update_id
+        self._running[update_id] += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self._running[update_id] -= 1
+            if self._running[update_id] <= 0:
+                del self._running[update_id]
+            if not self._running:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait until no update is running; False if some were still running after `timeout`."""
+        # Let handler tasks created just before polling stopped reach this middleware.
+        await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class IdempotencyMiddleware(BaseMiddleware):
+    """Outer update middleware: each update_id reaches the handlers once.
+
+    Recent ids are remembered in memory, so a duplicate in this process is dropped
+    without a query; everything else is claimed in the database, which covers restarts
+    and other processes. A failed handler releases its claim. Claims older than `ttl`
+    are compacted every `compact_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        claim: Callable[[int], Awaitable[bool]],
+        release: Callable[[int], Awaitable[Any]],
+        compact: Callable[[float], Awaitable[Any]],
+        *,
+        memory_size: int = 10000,
+        ttl: float = 172800.0,
+        compact_interval: float = 600.0,
+    ):
+        self._claim = claim
+        self._release = release
+        self._compact = compact
+        self._recent: OrderedDict[int, None] = OrderedDict()
+        self._memory_size = max(1, memory_size)
+        self._ttl = ttl
+        self._compact_interval = compact_interval
+        self._last_compact = 0.0
+        self._compacting: asyncio.Task | None = None
+        self.stats = {"claimed": 0, "duplicates": 0}
+
+    def _remember(self, update_id: int) -> bool:
+        if update_id in self._recent:
+            return False
+        self._recent[update_id] = None
+        if len(self._recent) > self._memory_size:
+            self._recent.popitem(last=False)
+        return True
+
+    def _maybe_compact(self):
+        now = time.monotonic()
+        if now - self._last_compact < self._compact_interval:
+            return
+        if self._compacting is not None and not self._compacting.done():
+            return
+        self._last_compact = now
+        self._compacting = asyncio.create_task(self._compact(time.time() - self._ttl))
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        update_id = event.update_id
+        if not self._remember(update_id):
+            self.stats["duplicates"] += 1
+            return None
+        try:
+            fresh = await self._claim(update_id)
+        except Exception:
+            # Handling an update twice beats dropping it because the store is unavailable.
+            logger.exception("Could not claim update %s", update_id)
+            fresh = True
+        if not fresh:
+            self.stats["duplicates"] += 1
+            return None
+        self.stats["claimed"] += 1
+        self._maybe_compact()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self._recent.pop(update_id, None)
+            try:
+                await self._release(update_id)
+            except Exception:
+                logger.exception("Could not release update %s", update_id)
+            raise
+
+
+def handler_label(update: Update, commands: frozenset[str], callbacks: frozenset[str]) -> str:
+    """Low-cardinality name for what an update asks for: callback prefix, command or kind.
+
+    Commands and callback data come from users, so only labels in `commands` /
+    `callbacks` are used as is; anything else is "other".
+    """
+    if update.callback_query is not None:
+        data = update.callback_query.data
+        if not data:
+            return "callback"
+        parts = data.split(":", 2)
+        for label in (":".join(parts[:2]), parts[0]):
+            if label in callbacks:
+                return label
+        return "other"
+    message = update.message
+    if message is not None:
+        if message.successful_payment is not None:
+            return "payment"
+        if message.document is not None:
+            return "document"
+        if message.text and message.text.startswith("/"):
+            command = message.text.split(maxsplit=1)[0].split("@", 1)[0]
+            return command if command in commands else "other"
+        return "message"
+    return update.event_type
+
+
+def _callback_data_values(magic: MagicFilter | None) -> Iterator[str]:
+    """Strings an F.data == / F.data.startswith() / F.data.in_() filter compares against."""
+    operations = getattr(magic, "_operations", ())
+    if not operations or not isinstance(operations[0], GetAttributeOperation) or operations[0].name != "data":
+        return
+    rest = operations[1:]
+    if len(rest) == 1 and isinstance(rest[0], ComparatorOperation) and rest[0].comparator is operator.eq:
+        values = [rest[0].right]
+    elif len(rest) == 2 and isinstance(rest[0], GetAttributeOperation) and rest[0].name == "startswith":
+        values = list(rest[1].args[:1]) if isinstance(rest[1], CallOperation) else []
+        if values and isinstance(values[0], tuple):
+            values = list(values[0])
+    elif len(rest) == 1 and isinstance(rest[0], FunctionOperation) and rest[0].args:
+        values = list(rest[0].args[0]) if isinstance(rest[0].args[0], (set, frozenset, list, tuple)) else []
+    else:
+        values = []
+    yield from (value for value in values if isinstance(value, str))
+
+
+def registered_labels(router: Router) -> tuple[frozenset[str], frozenset[str]]:
+    """The commands and callback labels `router` and its sub-routers have handlers for.
+
+    A callback label is the filtered value up to its second ":", as handler_label cuts it.
+    """
+    commands: set[str] = set()
+    callbacks: set[str] = set()
+    for node in router.chain_tail:
+        for handler in node.message.handlers:
+            for flt in handler.filters or ():
+                if isinstance(flt.callback, Command):
+                    prefix = flt.callback.prefix
+                    commands.update(prefix + c for c in flt.callback.commands if isinstance(c, str))
+        for handler in node.callback_query.handlers:
+            for flt in handler.filters or ():
+                for value in _callback_data_values(flt.magic):
+                    callbacks.add(":".join(value.rstrip(":").split(":", 2)[:2]))
+    return frozenset(commands), frozenset(callbacks)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Outer update middleware: latency and errors per handler label.
+
+    Register it last, so the time spent waiting for the user's turn is not counted.
+    The allowed labels are read from `router`'s handlers on the first update, once
+    every handler is registered.
+    """
+
+    def __init__(self, router: Router):
+        self.router = router
+        self.commands: frozenset[str] | None = None
+        self.callbacks: frozenset[str] = frozenset()
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        if self.commands is None:
+            self.commands, self.callbacks = registered_labels(self.router)
+        label = handler_label(event, self.commands, self.callbacks)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(label)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, label)
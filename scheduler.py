@@ -1,5 +1,6 @@
 import asyncio
 import datetime as dt
+import time
 from typing import Awaitable, Callable
 from zoneinfo import ZoneInfo
 
@@ -19,6 +20,7 @@ from db import (
     mark_smartlink_reminder_sent,
     mark_smartlink_day_sent,
     mark_smartlink_notified,
+    set_bot_state,
     was_reminder_sent,
     was_smartlink_reminder_sent,
     was_smartlink_day_sent,
@@ -27,6 +29,10 @@ from helpers import parse_date
 
 REMINDER_INTERVAL_SECONDS = 300
 REMINDER_LAST_CLEAN: dt.date | None = None
+# Heartbeat for readiness checks: monotonic times of the scheduler start and its last pass.
+SCHEDULER_STATE: dict[str, float | None] = {"started_at": None, "last_run_at": None}
+# The same heartbeat in bot_state (Unix time), for processes that don't run the scheduler.
+SCHEDULER_HEARTBEAT_KEY = "reminder_scheduler_last_run"
 
 DEADLINES = [
     {"key": "pitching", "title": "Pitching (Spotify / Яндекс / VK / Звук / МТС-КИОН)", "offset": -14},
@@ -174,6 +180,7 @@ async def process_smartlink_release_day_reminders(bot: Bot, send_smartlink_photo
 
 
 async def reminder_scheduler(bot: Bot, send_smartlink_photo: Callable[..., Awaitable]):
+    SCHEDULER_STATE.update({"started_at": time.monotonic(), "last_run_at": None})
     while True:
         try:
             await asyncio.gather(
@@ -183,4 +190,9 @@ async def reminder_scheduler(bot: Bot, send_smartlink_photo: Callable[..., Await
             )
         except Exception as err:
             print(f"[reminder_scheduler] failed: {err}")
+        SCHEDULER_STATE["last_run_at"] = time.monotonic()
+        try:
+            await set_bot_state(SCHEDULER_HEARTBEAT_KEY, str(time.time()))
+        except Exception as err:
+            print(f"[reminder_scheduler] heartbeat failed: {err}")
         await asyncio.sleep(REMINDER_INTERVAL_SECONDS)
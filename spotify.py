@@ -0,0 +1,222 @@
+import asyncio
+import re
+import time
+
+import aiohttp
+
+from metrics import http_trace
+
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+SPOTIFY_SEARCH_URL = "https://api.spotify.com/v1/search"
+
+UPC_RE = re.compile(r"\d{12,14}")
+ISRC_RE = re.compile(r"[A-Z]{2}[A-Z0-9]{3}\d{7}")
+
+
+class _RateBudget:
+    """Spaces requests at least `interval` seconds apart; a 429 pushes the next slot back."""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now = time.monotonic()
+            self._next_at = max(now, self._next_at) + self.interval
+
+    def defer(self, seconds: float):
+        self._next_at = max(self._next_at, time.monotonic() + seconds)
+
+
+class SpotifyClient:
+    """Client-credentials Spotify client shared by all handlers.
+
+    The access token is refreshed behind a lock, so concurrent callers never race to
+    /api/token, and a background task renews it `refresh_margin` seconds before expiry.
+    """
+
+    def __init__(
+        self,
+        client_id: str | None,
+        client_secret: str | None,
+        *,
+        concurrency: int = 4,
+        requests_per_second: float = 8.0,
+        refresh_margin: float = 60.0,
+        max_retries: int = 3,
+    ):
+        self.client_id = client_id or ""
+        self.client_secret = client_secret or ""
+        self.refresh_margin = refresh_margin
+        self.max_retries = max_retries
+        self._session: aiohttp.ClientSession | None = None
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._last_used = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._budget = _RateBudget(requests_per_second)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.client_id and self.client_secret)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10), trace_configs=[http_trace("spotify")]
+            )
+        return self._session
+
+    async def close(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @staticmethod
+    def _retry_after(resp: aiohttp.ClientResponse) -> float:
+        try:
+            return max(float(resp.headers.get("Retry-After", "1")), 0.0)
+        except ValueError:
+            return 1.0
+
+    def _token_valid(self) -> bool:
+        return bool(self._token) and time.monotonic() < self._expires_at
+
+    async def get_token(self) -> str | None:
+        if not self.enabled:
+            return None
+        self._last_used = time.monotonic()
+        if self._token_valid():
+            return self._token
+        async with self._refresh_lock:
+            if self._token_valid():
+                return self._token
+            return await self._refresh()
+
+    async def _refresh(self) -> str | None:
+        session = self._get_session()
+        for _ in range(self.max_retries):
+            try:
+                async with session.post(
+                    SPOTIFY_TOKEN_URL,
+                    data={"grant_type": "client_credentials"},
+                    auth=aiohttp.BasicAuth(self.client_id, self.client_secret),
+                ) as resp:
+                    if resp.status == 429:
+                        delay = self._retry_after(resp)
+                        print(f"[spotify] token rate limited, retry in {delay:.1f}s")
+                        await asyncio.sleep(delay)
+                        continue
+                    if resp.status >= 400:
+                        print(f"[spotify] token request failed: status {resp.status}")
+                        return None
+                    payload = await resp.json()
+            except Exception as e:
+                print(f"[spotify] token request error: {e}")
+                return None
+            token = payload.get("access_token")
+            if not token:
+                return None
+            expires_in = int(payload.get("expires_in", 3600))
+            self._token = token
+            self._expires_at = time.monotonic() + max(expires_in - 30, 0)
+            self._schedule_refresh(expires_in)
+            return token
+        return None
+
+    def _schedule_refresh(self, expires_in: float):
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        self._refresh_task = asyncio.create_task(self._refresh_ahead(max(expires_in - self.refresh_margin, 1.0)))
+
+    async def _refresh_ahead(self, delay: float):
+        await asyncio.sleep(delay)
+        # Don't keep renewing a token nobody has asked for since the last refresh.
+        if time.monotonic() - self._last_used > delay:
+            return
+        async with self._refresh_lock:
+            self._refresh_task = None
+            await self._refresh()
+
+    async def _get_json(self, url: str, params: dict) -> dict | None:
+        token_retried = False
+        attempt = 0
+        while attempt < self.max_retries:
+            token = await self.get_token()
+            if not token:
+                return None
+            await self._budget.acquire()
+            try:
+                async with self._semaphore:
+                    async with self._get_session().get(
+                        url, params=params, headers={"Authorization": f"Bearer {token}"}
+                    ) as resp:
+                        if resp.status == 429:
+                            delay = self._retry_after(resp)
+                            self._budget.defer(delay)
+                            print(f"[spotify] rate limited, retry in {delay:.1f}s")
+                            attempt += 1
+                            continue
+                        if resp.status == 401 and not token_retried:
+                            token_retried = True
+                            self._token = None
+                            continue
+                        if resp.status >= 400:
+                            return None
+                        return await resp.json()
+            except Exception as e:
+                print(f"[spotify] request error: {e}")
+                return None
+        return None
+
+    async def search(self, query: str, types: str = "album,track", limit: int = 5) -> list[dict[str, str]]:
+        data = await self._get_json(SPOTIFY_SEARCH_URL, {"q": query, "type": types, "limit": limit})
+        if not data:
+            return []
+
+        candidates: list[dict[str, str]] = []
+        seen_urls: set[str] = set()
+        for kind in ("albums", "tracks"):
+            for item in (data.get(kind) or {}).get("items", []) or []:
+                url = (item.get("external_urls") or {}).get("spotify")
+                if not url or url in seen_urls:
+                    continue
+                artist_names = ", ".join(
+                    name
+                    for a in item.get("artists", []) or []
+                    if (name := a.get("name") if isinstance(a, dict) else str(a))
+                )
+                candidates.append({"artist": artist_names, "title": item.get("name", ""), "spotify_url": url})
+                seen_urls.add(url)
+        return candidates
+
+    async def search_upc(self, upc: str) -> list[dict[str, str]]:
+        return await self.search(f"upc:{upc}")
+
+    async def search_isrc(self, isrc: str) -> list[dict[str, str]]:
+        return await self.search(f"isrc:{isrc}", types="track")
+
+    async def lookup_many(self, codes: list[str]) -> dict[str, list[dict[str, str]]]:
+        """Resolve several UPC/ISRC codes concurrently; unknown formats map to []."""
+
+        async def lookup(code: str) -> list[dict[str, str]]:
+            if UPC_RE.fullmatch(code):
+                return await self.search_upc(code)
+            if ISRC_RE.fullmatch(code):
+                return await self.search_isrc(code)
+            return []
+
+        unique = list(dict.fromkeys(code.strip().upper().replace("-", "") for code in codes if code.strip()))
+        results = await asyncio.gather(*(lookup(code) for code in unique))
+        return dict(zip(unique, results))
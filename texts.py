@@ -91,6 +91,14 @@ SMARTLINK_IMPORT_PROMPT = (
     "Отмена: /cancel"
 )
 
+SMARTLINK_BULK_PROMPT = (
+    "📦 Массовый импорт смарт-линков.\n\n"
+    "Пришли список ссылок на релизы (по одной в строке) или файл .txt/.csv.\n"
+    "Можно добавить UPC или ISRC — найду релиз в Spotify.\n"
+    "Я создам карточки сразу для всех релизов, обложки и даты можно будет поправить потом.\n\n"
+    "Отмена: /cancel"
+)
+
 SMARTLINKS_HELP_TEXT = (
     "🔗 Смарт-линки\n\n"
     "• Создавай ссылку по BandLink или площадке — подтяну остальные автоматически.\n"
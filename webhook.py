@@ -0,0 +1,116 @@
+import asyncio
+import hmac
+import logging
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateFeeder:
+    """Bounded hand-off between whoever receives raw updates and whoever processes them.
+
+    `submit` only enqueues, so the receiver can answer at once. A pump task passes the
+    queue to `sink` in arrival order, at most `concurrency` updates at a time, the same
+    way polling hands off its batches.
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[dict], Awaitable[Any]],
+        *,
+        queue_size: int = 1000,
+        concurrency: int = 1000,
+    ):
+        self.sink = sink
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._tasks: set[asyncio.Task] = set()
+        self._pump: asyncio.Task | None = None
+        self.closing = False
+        self.stats = {"received": 0, "rejected": 0, "processed": 0, "failed": 0}
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, payload: dict) -> bool:
+        """Queue one raw update; False when full or shutting down."""
+        if self.closing:
+            return False
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            return False
+        self.stats["received"] += 1
+        return True
+
+    def start(self):
+        self.closing = False
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            payload = await self._queue.get()
+            await self._slots.acquire()
+            task = asyncio.create_task(self._process(payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, payload: dict):
+        try:
+            await self.sink(payload)
+            self.stats["processed"] += 1
+        except Exception:
+            self.stats["failed"] += 1
+            logger.exception("Update failed: %s", payload.get("update_id") if isinstance(payload, dict) else None)
+        finally:
+            self._slots.release()
+            self._queue.task_done()
+
+    async def stop(self, timeout: float = 30.0):
+        """Finish what was already accepted (up to `timeout` seconds), then stop the pump."""
+        self.closing = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[feeder] stopped with {self._queue.qsize()} queued, {len(self._tasks)} running updates")
+        if self._pump:
+            self._pump.cancel()
+            self._pump = None
+
+
+class WebhookIngress:
+    """Webhook endpoint that acks Telegram at once and leaves processing to an UpdateFeeder.
+
+    When the feeder's queue is full, or the process is shutting down, the request gets a
+    503 and Telegram redelivers it later, so a burst slows Telegram down instead of
+    growing memory.
+    """
+
+    def __init__(self, feeder: UpdateFeeder, secret_token: str):
+        self.feeder = feeder
+        self._secret = secret_token.encode()
+        self.unauthorized = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "").encode()
+        if not hmac.compare_digest(token, self._secret):
+            self.unauthorized += 1
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not self.feeder.submit(payload):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response()